@@ -259,10 +259,10 @@ interp = Extension('odin.interp',
 
 corr = Extension('odin.corr',
                      sources=['src/corr/correlate.pyx', 'src/corr/corr.cpp'],
-                     extra_compile_args={'gcc': ['--fast-math', '-O3', '-fPIC', '-Wall'],
-                                         'g++': ['--fast-math', '-O3', '-fPIC', '-Wall']},
+                     extra_compile_args={'gcc': ['--fast-math', '-O3', '-fPIC', '-Wall'] + omp_compile,
+                                         'g++': ['--fast-math', '-O3', '-fPIC', '-Wall'] + omp_compile},
                      runtime_library_dirs=['/usr/lib', '/usr/local/lib'],
-                     extra_link_args = ['-lstdc++', '-lm'],
+                     extra_link_args = ['-lstdc++', '-lm'] + omp_link,
                      include_dirs = [numpy_include, 'src/corr'],
                      language='c++')
 
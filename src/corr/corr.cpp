@@ -1,5 +1,7 @@
 #include <math.h>
 #include <iostream>
+#include <vector>
+#include <algorithm>
 
 #ifdef NO_OMP
    #define omp_get_thread_num() 0
@@ -69,3 +71,86 @@ Corr::~Corr() {
 }
 
 
+void photon_pairs(int n_shots, const long * shot_ptr, const int * q_bin,
+                  const int * phi_bin, const double * weight, int num_q,
+                  int num_phi, bool self_pairs, double * hist, double * count) {
+
+  #pragma omp parallel
+  {
+    // the threads share one histogram (updated atomically), so its memory
+    // does not grow with the number of threads -- only the (small) per-ring
+    // photon counts and shot counts are per-thread
+    vector<double> c((long) num_q * num_q, 0.0);
+    vector<double> n(num_q, 0.0);
+
+    #pragma omp for schedule(dynamic)
+    for ( int s=0; s < n_shots; s++ ) {
+
+      long start = shot_ptr[s];
+      long stop  = shot_ptr[s+1];
+
+      // the number of photons in each ring
+      fill(n.begin(), n.end(), 0.0);
+      for ( long a=start; a < stop; a++ ) {
+        n[q_bin[a]] += weight[a];
+      }
+
+      for ( long a=start; a < stop; a++ ) {
+        int qa = q_bin[a];
+        int pa = phi_bin[a];
+        double wa = weight[a];
+
+        for ( long b=start; b < stop; b++ ) {
+          int qb = q_bin[b];
+
+          // normalize by the number of pairs -- n(n-1) within a ring when
+          // photons are not paired with themselves
+          double norm = n[qa] * n[qb];
+          if (qa == qb && !self_pairs) {
+            norm -= n[qa];
+          }
+          if (norm <= 0) {
+            continue;
+          }
+
+          // a pixel with w photons makes w(w-1) distinct pairs with itself
+          double w = wa * weight[b];
+          if (a == b && !self_pairs) {
+            w -= wa;
+          }
+          if (w == 0) {
+            continue;
+          }
+
+          // the lag is phi(a) - phi(b), as in Rings._correlate_rows
+          int lag = pa - phi_bin[b];
+          if (lag < 0) {
+            lag += num_phi;
+          }
+
+          #pragma omp atomic
+          hist[((long) qa * num_q + qb) * num_phi + lag] += w / norm;
+        }
+      }
+
+      for ( int i=0; i < num_q; i++ ) {
+        for ( int j=0; j < num_q; j++ ) {
+          double norm = n[i] * n[j];
+          if (i == j && !self_pairs) {
+            norm -= n[i];
+          }
+          if (n[i] > 0 && n[j] > 0 && norm > 0) {
+            c[(long) i * num_q + j] += 1;
+          }
+        }
+      }
+    }
+
+    #pragma omp critical
+    {
+      for ( long i=0; i < (long) num_q * num_q; i++ ) {
+        count[i] += c[i];
+      }
+    }
+  }
+}
@@ -11,3 +11,15 @@ public:
   ~Corr();
 };
 
+// histogram the pairs of photons on each of `n_shots` shots by (q1, q2,
+// delta-phi), where the photons of shot s are shot_ptr[s] to shot_ptr[s+1]
+// and have integer (q, phi) bins and a weight (count). The lag of a pair is
+// phi(q1) - phi(q2), the convention of Rings._correlate_rows. Each shot's
+// pairs are normalized by its number of pairs in the two rings -- n1 n2, or
+// n(n-1) within a ring without self pairs -- and added to the
+// (num_q x num_q x num_phi) `hist`; the (num_q x num_q) `count` is the
+// number of shots with pairs in both rings. Shots run in parallel, sharing
+// one histogram
+void photon_pairs(int n_shots, const long * shot_ptr, const int * q_bin,
+                  const int * phi_bin, const double * weight, int num_q,
+                  int num_phi, bool self_pairs, double * hist, double * count);
@@ -5,6 +5,10 @@ cimport numpy as np
 cdef extern from "corr.h":
   cdef cppclass Corr:
     Corr(int N_, float * ar1, float * ar2, float * ar3) except +
+  void c_photon_pairs "photon_pairs"(int n_shots, long * shot_ptr, int * q_bin,
+                                     int * phi_bin, double * weight, int num_q,
+                                     int num_phi, bint self_pairs, double * hist,
+                                     double * count) nogil
 
 cdef Corr * c
 
@@ -37,3 +41,93 @@ def correlate(A, B):
     return v3
 
 
+def photon_pairs(shot_ptr, q_bin, phi_bin, weight, num_q, num_phi,
+                 self_pairs=False):
+    """
+    Histogram the pairs of photons on each shot by (q1, q2, delta-phi), for
+    sparse shots given as photon lists. The cost is O(photons^2) per shot,
+    and shots are processed in parallel (OpenMP) without holding the GIL.
+    
+    Parameters
+    ----------
+    shot_ptr : 1D numpy array, int
+        A len n_shots + 1 array: the photons of shot s are
+        shot_ptr[s]:shot_ptr[s+1] (as the indptr of a CSR matrix).
+        
+    q_bin, phi_bin : 1D numpy arrays, int
+        The ring (0 to num_q - 1) and azimuthal bin (0 to num_phi - 1) of each
+        photon.
+        
+    weight : 1D numpy array, float
+        The number of photons at each position.
+        
+    num_q, num_phi : int
+        The number of rings, and of bins around each ring.
+        
+    Optional Parameters
+    -------------------
+    self_pairs : bool
+        Count each photon paired with itself (as a dense correlation of the
+        photon counts would).
+        
+    Returns
+    -------
+    hist : numpy array, float
+        A (num_q, num_q, num_phi) array: hist[i,j,k] is the sum over shots of
+        the number of pairs with one photon in ring i at phi bin p and one in
+        ring j at bin p - k (the lag convention of Rings._correlate_rows),
+        divided by the number of such pairs on the shot at any lag: n_i n_j,
+        or n_i (n_i - 1) for i == j without `self_pairs`.
+        
+    count : numpy array, float
+        A (num_q, num_q) array of the number of shots with pairs of photons in
+        rings i and j.
+    """
+    
+    cdef np.ndarray[ndim=1, dtype=np.int_t, mode='c'] ptr
+    cdef np.ndarray[ndim=1, dtype=np.int32_t, mode='c'] qb
+    cdef np.ndarray[ndim=1, dtype=np.int32_t, mode='c'] pb
+    cdef np.ndarray[ndim=1, dtype=np.float64_t, mode='c'] w
+    cdef np.ndarray[ndim=3, dtype=np.float64_t, mode='c'] hist
+    cdef np.ndarray[ndim=2, dtype=np.float64_t, mode='c'] count
+    
+    ptr = np.ascontiguousarray(shot_ptr, dtype=np.int_)
+    qb  = np.ascontiguousarray(q_bin, dtype=np.int32)
+    pb  = np.ascontiguousarray(phi_bin, dtype=np.int32)
+    w   = np.ascontiguousarray(weight, dtype=np.float64)
+    
+    cdef int n_shots = ptr.shape[0] - 1
+    cdef int nq = num_q
+    cdef int nphi = num_phi
+    cdef bint sp = self_pairs
+    
+    if n_shots < 0:
+        raise ValueError("`shot_ptr` must have at least one entry")
+    if not (qb.shape[0] == pb.shape[0] == w.shape[0] == ptr[n_shots]):
+        raise ValueError("`q_bin`, `phi_bin` and `weight` must have one entry "
+                         "per photon")
+    if qb.shape[0] > 0:
+        if qb.min() < 0 or qb.max() >= num_q:
+            raise ValueError("`q_bin` must be in [0, num_q)")
+        if pb.min() < 0 or pb.max() >= num_phi:
+            raise ValueError("`phi_bin` must be in [0, num_phi)")
+    if np.any(np.diff(ptr) < 0):
+        raise ValueError("`shot_ptr` must be non-decreasing")
+    
+    hist  = np.zeros((num_q, num_q, num_phi), dtype=np.float64)
+    count = np.zeros((num_q, num_q), dtype=np.float64)
+    
+    cdef long * p_ptr = <long *> &ptr[0]
+    cdef int * p_qb = NULL
+    cdef int * p_pb = NULL
+    cdef double * p_w = NULL
+    if qb.shape[0] > 0:
+        p_qb = <int *> &qb[0]
+        p_pb = <int *> &pb[0]
+        p_w  = &w[0]
+    
+        with nogil:
+            c_photon_pairs(n_shots, p_ptr, p_qb, p_pb, p_w, nq, nphi, sp,
+                           &hist[0,0,0], &count[0,0])
+    
+    return hist, count
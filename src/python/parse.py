@@ -363,14 +363,14 @@ class CBF(object):
         # todo better value for photons
         b = xray.Beam(1e4, wavelength=self.wavelength) 
         d = xray.Detector(bg, b.k)
-        s = xray.Shotset(self.intensities.flatten().astype(np.float64), d, self.mask)
+        s = xray.Shotset(self.intensities.flatten(), d, self.mask)
         
         return s
     
         
     @classmethod
     def files_to_shotset(cls, list_of_cbf_files, shotset_filename=None,
-                         autocenter=True):
+                         autocenter=True, screen=None, corrections=None):
         """
         Convert a bunch of CBF files to a single ODIN shotset instance. If you 
         write the shotset immediately to disk, does this in a smart "lazy" way 
@@ -389,14 +389,65 @@ class CBF(object):
         autocenter : bool
             Whether or not to automatically determine the center of the detector.
             
+        screen : dict
+            If passed, each shot is screened as it is read, and shots that fail
+            are left out of the shotset. The dictionary holds keyword arguments
+            to odin.xray.Shotset.screen, e.g. {'min_hit_score' : 0.01}. Cuts
+            that compare shots to each other (`max_profile_deviation`) cannot
+            be made one shot at a time, and raise a ValueError -- apply them
+            to the finished shotset instead.
+            
+        corrections : dict
+            If passed, per-pixel corrections are applied to each shot (after
+            screening) as it is read. The dictionary holds keyword arguments
+            to odin.xray.Shotset.correct, e.g. {'polarization' : 0.99}.
+            
         Returns
         -------
         ss : odin.xray.Shotset
             If `shotset_filename` is None, then returns the shotset object
         """
         
-        # convert one CBF, and use it to get the detector, etc info
-        seed_shot = cls(list_of_cbf_files[0], autocenter=autocenter).as_shotset()
+        if screen != None and 'max_profile_deviation' in screen:
+            raise ValueError('`max_profile_deviation` compares shots to each '
+                             'other, and cannot screen shots one at a time -- '
+                             'screen the finished shotset instead')
+
+        def accepted(ss):
+            if screen == None:
+                return True
+            return len(ss.screen(**screen)) == 1
+        
+        # convert the first good CBF, and use it to get the detector, etc info
+        seed_shot = None
+        for i,fn in enumerate(list_of_cbf_files):
+            seed_shot = cls(fn, autocenter=autocenter).as_shotset()
+            if accepted(seed_shot):
+                break
+            logger.info('Rejected shot: %s' % fn)
+            seed_shot = None
+        if seed_shot == None:
+            raise ValueError('No shots passed screening')
+        remaining = list_of_cbf_files[i+1:]
+        
+        if corrections != None:
+            seed_shot.correct(**corrections)
+        
+        def shots():
+            for fn in remaining:
+                x = cls(fn, autocenter=False).intensities.flatten()
+                if not len(x) == seed_shot.num_pixels:
+                    raise ValueError('Variable number of pixels in shots!')
+                if (screen == None) and (corrections == None):
+                    yield x
+                    continue
+                ss = xray.Shotset(x, seed_shot.detector, seed_shot.mask)
+                if not accepted(ss):
+                    logger.info('Rejected shot: %s' % fn)
+                    continue
+                if corrections != None:
+                    ss.correct(**corrections)
+                yield ss.intensities[0]
         
         if shotset_filename:
             logger.info('writing CBF files straight to disk at: %s' % shotset_filename)
@@ -404,27 +455,28 @@ class CBF(object):
             seed_shot.save(shotset_filename)
             
             # now open a handle to that h5 file and add to it
-            for i,fn in enumerate(list_of_cbf_files[1:]):
-                 
-                # i+1 b/c we already saved one shot
-                d = {('shot%d' % (i+1,)) : cls(fn, autocenter=False).intensities.flatten()}
-                io.saveh( shotset_filename, **d )
+            h5 = tables.openFile(shotset_filename, mode='a')
+            try:
+                for x in shots():
+                    h5.root.intensities.append( x[None,:] )
+                h5.root.num_shots[:] = np.array([ h5.root.intensities.shape[0] ])
+            finally:
+                h5.close()
                 
-            io.saveh( shotset_filename, num_shots=np.array([ len(list_of_cbf_files) ]) )
             logger.info('Combined CBF data into: %s' % shotset_filename)
             return
 
         else:
-            shot_i = np.zeros(( len(list_of_cbf_files), seed_shot.intensities.shape[1] ))
+            shot_i = np.zeros(( len(remaining) + 1, seed_shot.num_pixels ),
+                              dtype=seed_shot.dtype)
             shot_i[0,:] = seed_shot.intensities.flatten()
             
-            for i,fn in enumerate(list_of_cbf_files[1:]):
-                x = cls(fn, autocenter=False).intensities.flatten()
-                if not len(x) == shot_i.shape[1]:
-                    raise ValueError('Variable number of pixels in shots!')
-                shot_i[i+1,:] = x
+            n = 1
+            for x in shots():
+                shot_i[n,:] = x
+                n += 1
             
-            ss = xray.Shotset( shot_i, seed_shot.detector, seed_shot.mask )
+            ss = xray.Shotset( shot_i[:n], seed_shot.detector, seed_shot.mask )
 
             return ss
             
@@ -10,6 +10,7 @@ logger = logging.getLogger(__name__)
 import numpy as np
 from scipy import misc, special
 from threading import Thread
+from itertools import izip
 
 from odin import _cpuscatter
 from odin.refdata import cromer_mann_params
@@ -94,15 +95,18 @@ def simulate_shot(traj, num_molecules, detector, traj_weights=None,
     num_per_shapshot = np.random.multinomial(num_molecules, traj_weights)
     
         
-    # get the scattering vectors
-    if str(type(detector)).find('Detector') > -1:    
-        qxyz = detector.reciprocal
-        assert detector.num_pixels == qxyz.shape[0]
+    # get the scattering vectors -- for a Detector these are generated one
+    # panel at a time, so the full set of q-vectors is never in memory
+    if str(type(detector)).find('Detector') > -1:
+        num_q = detector.num_pixels
+        def panels():
+            return izip(detector.panel_slices, detector.iter_reciprocal())
     elif isinstance(detector, np.ndarray):
-        qxyz = detector
+        num_q = detector.shape[0]
+        def panels():
+            return [ (slice(0, num_q), detector) ]
     else:
         raise ValueError('`detector` must be {odin.xray.Detector, np.ndarray}')
-    num_q = qxyz.shape[0]
     
     
     # figure out finite photon statistics
@@ -148,10 +152,13 @@ def simulate_shot(traj, num_molecules, detector, traj_weights=None,
             
             logger.info('Running %d molecules from snapshot %d...' % (num, i))  
 
+            # draw the molecular orientations once, so that every detector
+            # panel sees the same set of rotated molecules
+            rfloats = np.random.rand(num, 3)
+
             # multiprocessing cannot return values, so generate a helper function
             # that will dump returned values into a shared array
-            threads = []
-            def multi_helper(compute_device, fargs):
+            def multi_helper(compute_device, slc, fargs, fkwargs):
                 """ a helper function that performs either CPU or GPU calcs """
                 if compute_device == 'cpu':
                     func = _cpuscatter.simulate
@@ -160,27 +167,36 @@ def simulate_shot(traj, num_molecules, detector, traj_weights=None,
                 else:
                     raise ValueError('`compute_device` should be one of {"cpu",\
                      "gpu"}, was: %s' % compute_device)
-                intensities[:] += func(*fargs)
+                intensities[slc] += func(*fargs, **fkwargs)
                 return
 
-            # run dat shit
-            if num_cpu > 0:
-                logger.debug('Running CPU scattering code (%d/%d)...' % (num_cpu, num))
-                cpu_args = (num_cpu, qxyz, rxyz, atomic_numbers)
-                t_cpu = Thread(target=multi_helper, args=('cpu', cpu_args))
-                t_cpu.start()
-                threads.append(t_cpu)                
-
-            if num_gpu > 0:
-                logger.debug('Sending calculation to GPU device...')
-                gpu_args = (num_gpu, qxyz, rxyz, atomic_numbers, device_id)
-                t_gpu = Thread(target=multi_helper, args=('gpu', gpu_args))
-                t_gpu.start()
-                threads.append(t_gpu)
-                
-            # ensure child processes have finished
-            for t in threads:
-                t.join()
+            for slc, qxyz in panels():
+
+                threads = []
+
+                # run dat shit
+                if num_cpu > 0:
+                    logger.debug('Running CPU scattering code (%d/%d)...' % (num_cpu, num))
+                    cpu_args = (num_cpu, qxyz, rxyz, atomic_numbers)
+                    cpu_kwargs = {'rfloats' : rfloats[:num_cpu]}
+                    t_cpu = Thread(target=multi_helper,
+                                   args=('cpu', slc, cpu_args, cpu_kwargs))
+                    t_cpu.start()
+                    threads.append(t_cpu)
+
+                if num_gpu > 0:
+                    logger.debug('Sending calculation to GPU device...')
+                    gpu_args = (num_gpu, qxyz, rxyz, atomic_numbers)
+                    gpu_kwargs = {'device_id' : device_id,
+                                  'rfloats'   : rfloats[num_cpu:]}
+                    t_gpu = Thread(target=multi_helper,
+                                   args=('gpu', slc, gpu_args, gpu_kwargs))
+                    t_gpu.start()
+                    threads.append(t_gpu)
+
+                # ensure child processes have finished
+                for t in threads:
+                    t.join()
         
         
     # if we're using finite photons, sample those stats
@@ -435,7 +451,7 @@ class IntensityProfileData(ExptData):
 
         
         
-def CorrelationData(ExptData):
+class CorrelationData(ExptData):
     """
     This is the correlation function of an intensity 'ring' on the detector.
     These correlations promise to hold more structural information than
@@ -448,37 +464,148 @@ def CorrelationData(ExptData):
     
        C(l,q1,q2)
        
-           with l --> the (even) legendre order
+           with l --> the legendre order
             q1/q2 --> the |q| values of the correlation
        
-    and must be supplemented by a list of l-values and q-values.
+    and must be supplemented by a list of q-values, as well as the wavenumber
+    and number of points in phi the correlations were measured with, which
+    are needed to predict the coefficients for a structure.
     """
     
-    def add_correlation_collection(self, cc):
+    def __init__(self, q_values, coefficients, k, num_phi, errors=None,
+                 use_inter_statistics=False):
         """
-        Add a set of correlations to the experimental dataset in the form of
-        a correlation collection.
+        Instantiate a CorrelationData experimental data class.
+        
+        Parameters
+        ----------
+        q_values : ndarray, float
+            The |q| values of the correlated rings.
+            
+        coefficients : ndarray, float
+            The Legendre coefficients C(l,q1,q2), shape (order, num_q, num_q).
+            
+        k : float
+            The wavenumber of the beam, in inverse Angstroms.
+            
+        num_phi : int
+            The number of points around each ring.
+            
+        Optional Parameters
+        -------------------
+        errors : ndarray, float
+            The standard error of each coefficient, same shape as
+            `coefficients`.
+            
+        use_inter_statistics : bool
+            Whether the inter-shot correlations were subtracted before
+            projecting. Predictions are made the same way.
         """
         
+        q_values = np.asarray(q_values)
+        coefficients = np.asarray(coefficients)
+        num_q = len(q_values)
+        
+        if not ((len(coefficients.shape) == 3) and
+                (coefficients.shape[1:] == (num_q, num_q))):
+            raise ValueError('`coefficients` must have shape (order, %d, %d), '
+                             'got %s' % (num_q, num_q, str(coefficients.shape)))
+        
+        self.q_values = q_values
+        self.coefficients = coefficients
+        self.k = float(k)
+        self.num_phi = int(num_phi)
+        self.use_inter_statistics = bool(use_inter_statistics)
+        self._n_data = coefficients.size
+        
+        if errors == None:
+            self._errors = self._default_error()
+        else:
+            errors = np.asarray(errors)
+            if not errors.shape == coefficients.shape:
+                raise ValueError('`errors` must have the same shape as '
+                                 '`coefficients`')
+            self._errors = errors.flatten()
         
         return
     
-
-    def _load_file(self, filename):
+    
+    @classmethod
+    def from_accumulator(cls, accumulator, order, use_inter_statistics=False,
+                         method='jackknife', num_samples=200):
+        """
+        Compute the Legendre coefficients and their errors from an
+        odin.xray.CorrelationAccumulator. If it has per-block statistics, the
+        errors are estimated by resampling those blocks, otherwise the default
+        error is used.
+        
+        Parameters
+        ----------
+        accumulator : odin.xray.CorrelationAccumulator
+            The accumulated correlations.
+            
+        order : int
+            The order at which to truncate the Legendre expansion.
+            
+        Optional Parameters
+        -------------------
+        use_inter_statistics : bool
+            Subtract the inter-shot correlations before projecting.
+            
+        method : str
+            Either 'jackknife' or 'bootstrap'.
+            
+        num_samples : int
+            The number of bootstrap replicates.
         """
-        Load a file.
+        
+        inter = use_inter_statistics
+        if accumulator.block_size == None:
+            cl = accumulator.legendre_matrix(order, use_inter_statistics=inter)
+            errors = None
+        else:
+            cl, errors = accumulator.legendre_errors(order,
+                                                     use_inter_statistics=inter,
+                                                     method=method,
+                                                     num_samples=num_samples)
+        
+        return cls(accumulator.q_values, cl, accumulator.k, accumulator.num_phi,
+                   errors=errors, use_inter_statistics=inter)
+        
+        
+    @classmethod
+    def from_file(cls, filename, order, **kwargs):
         """
-        return
-
-
-    def predict(self, trajectory):
+        Load a saved odin.xray.CorrelationAccumulator, and compute the
+        coefficients & errors from it (see from_accumulator).
+        """
+        from odin.xray import CorrelationAccumulator
+        accumulator = CorrelationAccumulator.load(filename)
+        return cls.from_accumulator(accumulator, order, **kwargs)
+    
+    
+    def predict(self, trajectory, num_shots=100, force_no_gpu=False):
         """
         Method to predict the array `values` for each snapshot in `trajectory`.
+        
+        Each snapshot is scattered, in `num_shots` random orientations, onto
+        the same rings as the data, and the correlations of those shots are
+        projected onto the Legendre polynomials exactly as the data were. The
+        prediction is therefore a Monte Carlo estimate, which converges as
+        `num_shots` grows.
 
         Parameters
         ----------
         trajectory : mdtraj.trajectory
             A trajectory to predict the experimental values for.
+            
+        Optional Parameters
+        -------------------
+        num_shots : int
+            The number of randomly oriented shots to simulate per snapshot.
+            
+        force_no_gpu : bool
+            Run the scattering simulations on the CPU.
 
         Returns
         -------
@@ -486,6 +613,20 @@ def CorrelationData(ExptData):
            The predicted values. Will be two dimensional, 
            len(trajectory) X len(values).
         """
+        
+        from odin.xray import Beam, Rings
+        energy = Beam(None, wavenumber=self.k).energy
+        order = self.coefficients.shape[0]
+        
+        prediction = np.zeros((trajectory.n_frames, self.n_data))
+        for i in range(trajectory.n_frames):
+            rings = Rings.simulate(trajectory[i], 1, self.q_values,
+                                   self.num_phi, num_shots, energy=energy,
+                                   force_no_gpu=force_no_gpu)
+            cl = rings.legendre_matrix(order,
+                             use_inter_statistics=self.use_inter_statistics)
+            prediction[i] = cl.flatten()
+        
         return prediction
 
 
@@ -494,6 +635,14 @@ def CorrelationData(ExptData):
         Method to estimate the error of the experiment (conservatively) in the
         absence of explicit input.
         """
+        # no resampling information: assume 100% error, but never less than
+        # 1% of the largest coefficient -- a coefficient that happens to be
+        # (near) zero is not known exactly
+        c = np.abs(self.coefficients).flatten()
+        floor = 0.01 * c.max()
+        if floor == 0.0:
+            floor = 1.0
+        error_guess = np.maximum(c, floor)
         return error_guess
 
 
@@ -502,7 +651,7 @@ def CorrelationData(ExptData):
         Return an array `values`, in an order that ensures it will match up
         with the method self.predict()
         """
-        return values
+        return self.coefficients.flatten()
 
 
     def _get_errors(self):
@@ -510,7 +659,7 @@ def CorrelationData(ExptData):
         Return an array `errors`, in an order that ensures it will match up
         with the method self.predict()
         """
-        return errors
+        return self._errors
 
 
     @property
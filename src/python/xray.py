@@ -10,12 +10,17 @@ logging.basicConfig()
 logger = logging.getLogger(__name__)
 #logger.setLevel('DEBUG')
 
+import os
 import cPickle
+import hashlib
+import multiprocessing
 from bisect import bisect_left
+from itertools import izip
 
 import numpy as np
+import tables
 from matplotlib import nxutils
-from scipy import interpolate, fftpack
+from scipy import interpolate, fftpack, sparse
 from scipy.ndimage import filters
 from scipy.special import legendre
 
@@ -23,14 +28,13 @@ from odin.math2 import arctan3, smooth
 from odin import scatter
 from odin.interp import Bcinterp
 from odin.utils import unique_rows, maxima, random_pairs
-from odin.corr import correlate as gap_correlate
 from odin.structure import multiply_conformations
+from odin.corr import photon_pairs
 
 from odin.math2 import arctan3, smooth
 from odin import scatter
 from odin.interp import Bcinterp
 from odin.utils import unique_rows, maxima, random_pairs
-from odin.corr import correlate as gap_correlate
 
 from mdtraj import trajectory
 from mdtraj import io
@@ -46,6 +50,229 @@ h = 4.135677516e-15   # Planks constant | eV s
 c = 299792458         # speed of light  | m / s
 
 # ------------------------------------------------------------------------------
+# DEFAULTS
+
+MEMORY_BUDGET = 2**28 # working memory for streaming over shots | bytes
+
+# ------------------------------------------------------------------------------
+
+
+class DiskArray(object):
+    """
+    A read-only handle on an array stored in an HDF5 file. Nothing is read
+    from disk until the array is sliced, and then only the requested data are
+    read -- so a few rows of a very large array can be accessed cheaply.
+    Use `np.array(disk_array)` to read the entire array into memory.
+    """
+
+    def __init__(self, filename, where):
+        """
+        Parameters
+        ----------
+        filename : str
+            The path to the HDF5 file containing the array.
+
+        where : str
+            The path to the array node inside the file, e.g. '/detector/pixels'.
+        """
+
+        self.filename = filename
+        self.where    = where
+
+        h5 = tables.openFile(filename, mode='r')
+        try:
+            node = h5.getNode(where)
+            self.shape = tuple(node.shape)
+            self.dtype = node.atom.dtype
+        finally:
+            h5.close()
+
+        return
+
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+
+    @property
+    def itemsize(self):
+        return self.dtype.itemsize
+
+
+    def __len__(self):
+        return self.shape[0]
+
+
+    def __getitem__(self, key):
+        h5 = tables.openFile(self.filename, mode='r')
+        try:
+            x = h5.getNode(self.where)[key]
+        finally:
+            h5.close()
+        return x
+
+
+    def __array__(self, dtype=None):
+        x = self[:]
+        if dtype != None:
+            x = x.astype(dtype)
+        return x
+
+
+class ArrayBlocks(object):
+    """
+    An array stored as a list of blocks, stacked along the first axis.
+    Appending a block costs only the new data; the blocks are concatenated
+    into one contiguous array only when the whole array is asked for (e.g.
+    `np.array(blocks)`). Slicing along the first axis reads only the blocks
+    involved, so blocks may themselves be lazy (e.g. DiskArrays).
+    """
+
+    def __init__(self, blocks=None):
+        """
+        Parameters
+        ----------
+        blocks : list
+            Arrays (or DiskArrays, or other ArrayBlocks) with the same trailing
+            dimensions, to stack along the first axis.
+        """
+        self._blocks = []
+        self._num_rows = 0
+        if blocks != None:
+            for b in blocks:
+                self.append(b)
+        return
+
+
+    def append(self, block):
+        """
+        Append `block` to the end of the array (along the first axis).
+        """
+
+        if isinstance(block, ArrayBlocks):
+            for b in block._blocks:
+                self.append(b)
+            return
+
+        if len(self._blocks) > 0:
+            if not tuple(block.shape[1:]) == self.shape[1:]:
+                raise ValueError('Cannot append a block of shape %s to an '
+                                 'array of shape %s' % (str(block.shape),
+                                                        str(self.shape)))
+        if block.shape[0] > 0:
+            self._blocks.append(block)
+            self._num_rows += block.shape[0]
+
+        return
+
+
+    @property
+    def num_blocks(self):
+        return len(self._blocks)
+
+
+    @property
+    def in_memory(self):
+        return all([ isinstance(b, np.ndarray) and not isinstance(b, np.memmap)
+                     for b in self._blocks ])
+
+
+    @property
+    def shape(self):
+        if len(self._blocks) == 0:
+            return (0,)
+        return (self._num_rows,) + tuple(self._blocks[0].shape[1:])
+
+
+    @property
+    def dtype(self):
+        if len(self._blocks) == 0:
+            return np.dtype(np.float64)
+        return np.result_type(*[ b.dtype for b in self._blocks ])
+
+
+    @property
+    def itemsize(self):
+        return self.dtype.itemsize
+
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+
+    def __len__(self):
+        return self.shape[0]
+
+
+    def __getitem__(self, key):
+
+        if type(key) == tuple:
+            first, rest = key[0], key[1:]
+        else:
+            first, rest = key, ()
+
+        n = self.shape[0]
+        starts = np.cumsum([0] + [ b.shape[0] for b in self._blocks ])
+
+        # single row
+        if isinstance(first, (int, long, np.integer)):
+            if first < 0:
+                first += n
+            if (first < 0) or (first >= n):
+                raise IndexError('index %d out of bounds' % first)
+            i = np.searchsorted(starts, first, side='right') - 1
+            return np.asarray(self._blocks[i][(first - starts[i],) + rest])
+
+        # contiguous rows -- read only the blocks that overlap, and only the
+        # requested part of each row
+        elif type(first) == slice and first.step in [None, 1]:
+            start, stop, step = first.indices(n)
+            parts = []
+            for i, b in enumerate(self._blocks):
+                lo = max(start, starts[i])
+                hi = min(stop, starts[i+1])
+                if hi > lo:
+                    rows = slice(lo-starts[i], hi-starts[i])
+                    parts.append(np.asarray(b[(rows,) + rest]))
+            if len(parts) == 0:
+                return np.zeros((0,) + self.shape[1:], dtype=self.dtype)[(slice(None),) + rest]
+            return np.concatenate(parts)
+
+        # stepped slices, index arrays and boolean masks -- read each distinct
+        # row once, in contiguous runs, then index as numpy would
+        elif isinstance(first, (slice, list, np.ndarray)):
+            if type(first) == slice:
+                rows = np.arange(*first.indices(n))
+            else:
+                rows = np.asarray(first)
+                if rows.dtype == np.bool:
+                    if not rows.shape == (n,):
+                        raise IndexError('boolean index has the wrong length')
+                    rows = np.where(rows)[0]
+            rows = rows.astype(np.int)
+            if np.any((rows < -n) | (rows >= n)):
+                raise IndexError('index out of bounds for an array with %d rows' % n)
+            unique, inverse = np.unique(rows % max(n, 1), return_inverse=True)
+            if len(unique) == 0:
+                x = np.zeros((0,) + self.shape[1:], dtype=self.dtype)
+            else:
+                x = _read_rows(self, unique)
+            return x[(inverse.reshape(rows.shape),) + rest]
+
+        else:
+            return np.asarray(self)[key]
+
+
+    def __array__(self, dtype=None):
+        if len(self._blocks) == 0:
+            x = np.zeros(self.shape, dtype=self.dtype)
+        else:
+            x = np.concatenate([ np.asarray(b) for b in self._blocks ])
+        if dtype != None:
+            x = x.astype(dtype)
+        return x
 
 
 class Beam(object):
@@ -382,11 +609,49 @@ class BasisGrid(object):
         --------
         grid_as_explicit
         """
-        ex_grids = [ self.grid_as_explicit(i) for i in range(self.num_grids) ]
-        xyz = np.concatenate([ g.reshape((g.shape[0]* g.shape[1], 3)) for g in ex_grids ])
+        xyz = np.zeros((self.num_pixels, 3))
+        for slc, g in izip(self.grid_slices, self.iter_explicit()):
+            xyz[slc,:] = g
         return xyz
 
 
+    def iter_explicit(self):
+        """
+        Iterate over the grids, generating the x,y,z positions of the pixels
+        in one grid at a time. Use this instead of `to_explicit` to keep
+        memory use bounded by the size of the largest grid.
+
+        Yields
+        ------
+        xyz : np.ndarray, float
+            An (n_g) x 3 array of the x,y,z positions of each pixel in the
+            current grid, where n_g is the number of pixels in that grid.
+
+        See Also
+        --------
+        to_explicit
+        grid_slices
+        """
+        for i in range(self.num_grids):
+            g = self.grid_as_explicit(i)
+            yield g.reshape((g.shape[0] * g.shape[1], 3))
+
+
+    @property
+    def grid_slices(self):
+        """
+        A list of slice objects, one per grid, that give the position of each
+        grid's pixels in the flattened (explicit) pixel array.
+        """
+        slices = []
+        start = 0
+        for shape in self._shapes:
+            end = start + int(np.product(shape))
+            slices.append( slice(start, end) )
+            start = end
+        return slices
+
+
     def grid_as_explicit(self, grid_number):
         """
         Get the x,y,z coordiantes for a single grid.
@@ -456,7 +721,7 @@ class Detector(Beam):
             beam is assumed to be purely in the z-direction.
         """
 
-        if type(xyz) == np.ndarray:
+        if type(xyz) in [np.ndarray, DiskArray]:
             logger.debug('xyz type: np.ndarray, initializing an explicit detector')
 
             self._pixels = xyz
@@ -516,9 +781,23 @@ class Detector(Beam):
         return self._xyz_type
 
 
+    def _detach(self, filename):
+        """
+        If the explicit pixels are still on disk in `filename` (from `load`),
+        read them into memory, so that `filename` can be safely overwritten.
+        """
+        if isinstance(self._pixels, DiskArray):
+            if os.path.abspath(self._pixels.filename) == os.path.abspath(filename):
+                self._pixels = np.array(self._pixels)
+        return
+
+
     @property
     def xyz(self):
         if self.xyz_type == 'explicit':
+            if isinstance(self._pixels, DiskArray):
+                # pixels still on disk (from `load`) -- read them in once
+                self._pixels = np.array(self._pixels)
             return self._pixels
         elif self.xyz_type == 'implicit':
             return self._basis_grid.to_explicit()
@@ -541,10 +820,88 @@ class Detector(Beam):
 
     @property
     def recpolar(self):
-        a = self._real_to_recpolar(self.real)
-        # convention: theta is angle of q-vec with plane normal to beam
-        a[:,1] = self.polar[:,1] / 2.0
-        return a
+        return self._real_to_recpolar_pixels(self.real)
+
+
+    @property
+    def num_panels(self):
+        """
+        The number of panels the detector is broken into. For implicit
+        detectors this is the number of basis grids, explicit detectors are
+        treated as a single panel.
+        """
+        if self.xyz_type == 'explicit':
+            return 1
+        elif self.xyz_type == 'implicit':
+            return self._basis_grid.num_grids
+
+
+    @property
+    def panel_slices(self):
+        """
+        A list of slice objects, one per panel, giving the position of that
+        panel's pixels in a flattened intensity array.
+        """
+        if self.xyz_type == 'explicit':
+            return [ slice(0, self.num_pixels) ]
+        elif self.xyz_type == 'implicit':
+            return self._basis_grid.grid_slices
+
+
+    def iter_real(self):
+        """
+        Iterate over the detector panels, yielding the real space (x,y,z)
+        pixel positions of one panel at a time. Peak memory use is bounded by
+        the size of the largest panel, rather than the whole detector.
+
+        Yields
+        ------
+        xyz : np.ndarray, float
+            An n x 3 array of pixel positions for the current panel. The
+            corresponding slice of the full pixel array is given by the
+            same entry in `panel_slices`.
+
+        See Also
+        --------
+        panel_slices
+        iter_polar
+        iter_reciprocal
+        iter_recpolar
+        """
+        if self.xyz_type == 'explicit':
+            yield np.array(self._pixels)
+        elif self.xyz_type == 'implicit':
+            for xyz in self._basis_grid.iter_explicit():
+                yield xyz
+
+
+    def iter_polar(self):
+        """
+        Iterate over the detector panels, yielding the real space pixel
+        positions of one panel at a time in polar coordinates. See `iter_real`.
+        """
+        for xyz in self.iter_real():
+            yield self._real_to_polar(xyz)
+
+
+    def iter_reciprocal(self):
+        """
+        Iterate over the detector panels, yielding the reciprocal space
+        (q_x, q_y, q_z) pixel positions of one panel at a time. See
+        `iter_real`.
+        """
+        for xyz in self.iter_real():
+            yield self._real_to_reciprocal(xyz)
+
+
+    def iter_recpolar(self):
+        """
+        Iterate over the detector panels, yielding the reciprocal space
+        pixel positions of one panel at a time in polar coordinates,
+        (|q|, theta, phi). See `iter_real`.
+        """
+        for xyz in self.iter_real():
+            yield self._real_to_recpolar_pixels(xyz)
 
 
     @property
@@ -566,1335 +923,3609 @@ class Detector(Beam):
         return q_max
 
 
-    def evaluate_qmag(self, xyz):
+    @property
+    def solid_angle(self):
+        """
+        The solid angle subtended by each pixel. For implicit detectors this is
+        computed from the pixel area and orientation, in steradians. Explicit
+        detectors carry no pixel area or orientation, so a flat detector normal
+        to the beam is assumed and the relative solid angle, cos^3(2-theta), is
+        returned instead.
         """
-        Given the positions of pixels `xyz`, compute the corresponding |q|
-        value for each.
 
-        Parameters
-        ----------
-        qxyz : ndarray, float
-            The array of pixels (shape : N x 3)
+        omega = np.zeros(self.num_pixels)
 
-        Returns
-        -------
-        qmag : ndarray, float
-            The array of q-magnitudes, len N.
-        """
-        thetas = self._evaluate_theta(xyz)
-        qmag = 2.0 * self.k * np.sin(thetas/2.0)
-        return qmag
+        if self.xyz_type == 'explicit':
+            u = self._unit_vector(np.array(self._pixels))
+            omega[:] = np.power(np.abs(np.dot(u, self.beam_vector)), 3)
 
+        elif self.xyz_type == 'implicit':
+            bg = self._basis_grid
+            for i, (slc, xyz) in enumerate(izip(self.panel_slices, self.iter_real())):
+                n = np.cross(bg._ss[i], bg._fs[i]) # normal, norm = pixel area
+                r = self._norm(xyz)
+                omega[slc] = np.abs(np.dot(xyz, n)) / np.power(r, 3)
 
-    def _evaluate_theta(self, xyz):
+        return omega
+
+
+    def polarization_factor(self, out_of_plane=0.99):
         """
-        Given the positions of pixels `xyz`, compute the corresponding
-        scattering angle theta for each.
+        The polarization factor of each pixel: the fraction of the scattered
+        intensity that is measured, for a beam polarized in the horizontal
+        (x) direction with `out_of_plane` of its intensity and in the vertical
+        (y) direction with the remainder. Uses the same convention as
+        Rings.dePolarize.
 
-        Parameters
-        ----------
-        xyz : ndarray, float
-            The array of pixels (shape : N x 3)
+        Optional Parameters
+        -------------------
+        out_of_plane : float
+            The fraction of the beam polarization out of the synchrotron plane
+            (between 0 and 1).
 
         Returns
         -------
-        thetas : ndarray, float
-            The scattering angles for each pixel
+        factor : ndarray, float
+            The `num_pixels` polarization factors, between 0 and 1.
         """
-        u_xyz  = self._unit_vector(xyz)
-        thetas = np.arccos(np.dot( u_xyz, self.beam_vector ))
-        return thetas
 
+        wavelength = 2.0 * np.pi / self.k
+        factor = np.zeros(self.num_pixels)
 
-    def _real_to_polar(self, xyz):
-        """
-        Convert the real-space representation to polar coordinates.
-        """
-        polar = self._to_polar(xyz)
-        return polar
+        for slc, rp in izip(self.panel_slices, self.iter_recpolar()):
+            sin_2theta = np.sin(2.0 * np.arcsin(rp[:,0] * wavelength / (4.0 * np.pi)))
+            factor[slc] = out_of_plane * (1.0 - sin_2theta**2 * np.cos(rp[:,2])**2) + \
+                    (1.0 - out_of_plane) * (1.0 - sin_2theta**2 * np.sin(rp[:,2])**2)
 
+        return factor
 
-    def _real_to_reciprocal(self, xyz):
+
+    def correction_map(self, polarization=None, solid_angle=False, gain=None):
         """
-        Convert the real-space to reciprocal-space in cartesian form.
+        Get a single per-pixel factor that applies several multiplicative
+        corrections at once: dividing by the polarization factor, the relative
+        solid angle and the pixel gain. Multiplying a (dark subtracted) shot by
+        the map applies all of them in one pass. Maps are cached on the
+        detector, so they are computed only once per detector.
+
+        Optional Parameters
+        -------------------
+        polarization : float
+            If passed, correct for polarization, with this fraction of the
+            beam polarization out of the synchrotron plane. See
+            `polarization_factor`.
+
+        solid_angle : bool
+            If True, correct for the solid angle subtended by each pixel,
+            relative to the largest. See `solid_angle`.
+
+        gain : ndarray, float
+            The gain (e.g. ADU per photon) of each pixel. Pixels with zero
+            gain are dead, and their factor is set to zero.
+
+        Returns
+        -------
+        factor : ndarray, float
+            The `num_pixels` correction factors.
         """
 
-        assert len(xyz.shape) == 2
-        assert xyz.shape[1] == 3
+        if gain != None:
+            gain = np.asarray(gain, dtype=np.float64).flatten()
+            if len(gain) != self.num_pixels:
+                raise ValueError('`gain` must be a len `num_pixels` array')
+            gain_key = hashlib.sha1(gain.tostring()).hexdigest()
+        else:
+            gain_key = None
 
-        # generate unit vectors in the pixel direction, origin at sample
-        S = self._unit_vector(xyz)
-        q = self.k * (S - self.beam_vector)
+        if polarization != None:
+            polarization = float(polarization)
 
-        return q
+        cache, key, _ = self._operator_cache(('correction', polarization,
+                                              bool(solid_angle), gain_key))
+        if key in cache:
+            return cache[key]
 
+        denominator = np.ones(self.num_pixels)
+        if polarization != None:
+            denominator *= self.polarization_factor(polarization)
+        if solid_angle:
+            omega = self.solid_angle
+            denominator *= omega / omega.max()
+        if gain != None:
+            denominator *= gain
 
-    def _real_to_recpolar(self, xyz):
-        """
-        Convert the real-space to reciprocal-space in polar form, that is
-        (|q|, theta , phi).
-        """
-        reciprocal_polar = self._to_polar( self._real_to_reciprocal(xyz) )
-        return reciprocal_polar
+        factor = np.zeros(self.num_pixels)
+        live = (denominator != 0.0)
+        factor[live] = 1.0 / denominator[live]
 
+        cache[key] = factor
 
-    @staticmethod
-    def _norm(vector):
-        """
-        Compute the norm of an n x m array of vectors, where m is the dimension.
-        """
-        if len(vector.shape) == 2:
-            assert vector.shape[1] == 3
-            norm = np.sqrt( np.sum( np.power(vector, 2), axis=1 ) )
-        elif len(vector.shape) == 1:
-            assert vector.shape[0] == 3
-            norm = np.sqrt( np.sum( np.power(vector, 2) ) )
-        else:
-            raise ValueError('Shape of vector wrong')
-        return norm
+        return factor
 
 
-    def _unit_vector(self, vector):
+    def _operator_cache(self, key, mask=None):
         """
-        Returns a unit-norm version of `vector`.
-
-        Parameters
-        ----------
-        vector : ndarray, float
-            An n x m vector of floats, where m is assumed to be the dimension
-            of the space.
+        Look up the cache of operators built from this detector's geometry,
+        checking `mask` and adding it to `key`.
 
         Returns
         -------
-        unit_vectors : ndarray,float
-            An n x m vector, same as before, but now of unit length
-        """
-
-        norm = self._norm(vector)
+        cache : dict
+            The cache, stored on the detector.
 
-        if len(vector.shape) == 1:
-            unit_vectors = vector / norm
+        key : tuple
+            `key`, extended with a hash of the mask (or None).
 
-        elif len(vector.shape) == 2:
-            unit_vectors = np.zeros( vector.shape )
-            for i in range(vector.shape[0]):
-                unit_vectors[i,:] = vector[i,:] / norm[i]
+        mask : ndarray, bool
+            The mask as a flat `num_pixels` bool array, or None.
+        """
 
+        if mask != None:
+            mask = np.asarray(mask).flatten().astype(np.bool)
+            if len(mask) != self.num_pixels:
+                raise ValueError('Mask must be a len `num_pixels` array')
+            mask_key = hashlib.sha1(mask.tostring()).hexdigest()
         else:
-            raise ValueError('invalid shape for `vector`: %s' % str(vector.shape))
+            mask_key = None
 
-        return unit_vectors
+        # detectors from older pickles may lack the cache attribute
+        cache = self.__dict__.setdefault('_integrator_cache', {})
 
+        return cache, tuple(key) + (mask_key,), mask
 
-    def _to_polar(self, vector):
-        """
-        Converts n m-dimensional `vector`s to polar coordinates. By polar
-        coordinates, I mean the cannonical physicist's (r, theta, phi), no
-        2-theta business.
 
-        We take, as convention, the 'z' direction to be along self.beam_vector
+    @staticmethod
+    def _ring_widths(q_values, q_width=None):
+        """
+        Check the rings `q_values`, of width `q_width` -- by default, the
+        smallest spacing between them. Returns both, as float.
         """
 
-        polar = np.zeros( vector.shape )
+        q_values = np.array(q_values, dtype=np.float).flatten()
 
-        # note the below is a little modified from the standard, to take into
-        # account the fact that the beam may not be only in the z direction
+        if q_width == None:
+            if len(q_values) < 2:
+                raise ValueError('`q_width` must be passed to bin a single ring')
+            q_width = np.min(np.diff(np.sort(q_values)))
+        if q_width <= 0.0:
+            raise ValueError('`q_width` must be positive, and `q_values` unique')
 
-        polar[:,0] = self._norm(vector)
-        polar[:,1] = np.arccos( np.dot(vector, self.beam_vector) / \
-                                (polar[:,0]+1e-16) )           # cos^{-1}(z.x/r)
-        polar[:,2] = arctan3(vector[:,1] - self.beam_vector[1],
-                             vector[:,0] - self.beam_vector[0])   # y first!
-
-        return polar
+        return q_values, float(q_width)
 
 
-    def _compute_intersections(self, q_vectors, grid_index, run_checks=True):
+    def azimuthal_integrator(self, q_spacing=0.05, num_phi=None, mask=None,
+                             solid_angle=False):
         """
-        Compute the points i=(x,y,z) where the scattering vectors described by
-        `q_vectors` intersect the detector.
+        Get a sparse operator that averages pixel intensities into |q| bins
+        (or, optionally, into |q|-phi bins). Applying the operator to an array
+        of intensities -- one shot or many -- integrates all of them in a
+        single sparse product, e.g.
 
-        Parameters
-        ----------
-        q_vectors : np.ndarray
-            An N x 3 array representing q-vectors in cartesian q-space.
+            >>> q_values, A = detector.azimuthal_integrator()
+            >>> profiles = A.dot(intensities.T).T  # (n_shots, n_bins)
 
-        grid_index : int
-            The index of the grid array to intersect
+        Operators are cached on the detector, so repeated calls with the same
+        arguments are essentially free.
 
         Optional Parameters
         -------------------
-        run_checks: bool
-            Whether to run some good sanity checks, at small computational cost.
+        q_spacing : float
+            The resolution of the |q|-axis. Bin `i` contains all pixels with
+            q_values[i-1] <= |q| < q_values[i] (bin 0 starts at |q| = 0).
+
+        num_phi : int
+            If passed, also bin in the azimuth, using `num_phi` equally spaced
+            bins over [0, 2pi). The operator rows are then ordered (q, phi),
+            with phi changing fastest.
+
+        mask : ndarray, bool
+            A `num_pixels` array that is True for pixels that should be
+            included and False for pixels that should be ignored.
+
+        solid_angle : bool
+            If True, scale each pixel's intensity by the inverse of its
+            (relative) solid angle before averaging.
 
         Returns
         -------
-        pix_n : ndarray, float
-            The coefficients of the position of each intersection in terms of
-            the basis grids s/f vectors.
-
-        intersect: ndarray, bool
-            A boolean array of which of `q_vectors` intersect with the grid
-            plane. First column is slow scan vector (s),  second is fast (f).
+        q_values : ndarray, float
+            The |q| values of the bins.
 
-        References
-        ----------
-        .[1] http://en.wikipedia.org/wiki/Line-plane_intersection
+        integrator : scipy.sparse.csr_matrix
+            The (n_bins x num_pixels) averaging operator, where n_bins is
+            len(q_values) or len(q_values) * num_phi. Empty bins are zero.
         """
 
-        if not self.xyz_type == 'implicit':
-            raise RuntimeError('intersections can only be computed for implicit'
-                               ' detectors')
+        cache, key, mask = self._operator_cache((float(q_spacing), num_phi,
+                                                 bool(solid_angle)), mask)
+        if key in cache:
+            return cache[key]
 
-        # compute the scattering vectors correspoding to q_vectors
-        S = (q_vectors / self.k) + self.beam_vector
+        # compute |q| and phi one panel at a time
+        qs = []
+        phis = []
+        for rp in self.iter_recpolar():
+            qs.append(rp[:,0].copy())
+            phis.append(rp[:,2].copy())
+        q = np.concatenate(qs)
+        phi = np.concatenate(phis)
 
-        # compute intersections
-        p, s, f, shape = self._basis_grid.get_grid(grid_index)
-        n = self._unit_vector( np.cross(s, f) )
-        i = (np.dot(p, n) / np.dot(S, n))[:,None] * S
+        q_values = np.arange(q_spacing, q.max(), q_spacing)
+        num_q = len(q_values)
 
-        # convert to pixel units by solving for the coefficients of proj
-        A = np.array([s,f]).T
-        pix_n, resid, rank, sigma = np.linalg.lstsq( A, (i-p).T )
+        rows = np.digitize(q, q_values)
+        keep = (rows < num_q) # last bin is |q| > q_values.max(), discarded
+        if mask != None:
+            keep *= mask
 
-        if run_checks:
-            err = np.sum( np.abs((i-p) - np.transpose( np.dot(A, pix_n) )) )
-            if err > 1e-6:
-                raise RuntimeError('Error in computing where scattering vectors '
-                                   'intersect with detector. Intersect not reproduced'
-                                   ' (err: %f per pixel)' % (err / i.shape[0],) )
+        if num_phi != None:
+            phi_ind = np.floor(phi / (2.0 * np.pi / float(num_phi))).astype(np.int)
+            rows = rows * num_phi + (phi_ind % num_phi)
+            num_bins = num_q * num_phi
+        else:
+            num_bins = num_q
 
-            if not np.sum(resid) < 1e-6:
-                raise RuntimeError('Error in basis grid (residuals of point '
-                                   'placement too large). Perhaps fast/slow '
-                                   'vectors describing basis grid are linearly '
-                                   'dependant?')
+        cols = np.arange(self.num_pixels)[keep]
+        rows = rows[keep]
 
-        pix_n = pix_n.T
-        assert pix_n.shape[1] == 2 # s/f
+        if solid_angle:
+            omega = self.solid_angle[keep]
+            weights = omega.max() / omega
+        else:
+            weights = np.ones(len(cols))
 
-        # see if the intersection in the plane is on the detector grid
-        intersect = (pix_n[:,0] >= 0.0) * (pix_n[:,0] <= float(shape[0]-1)) *\
-                    (pix_n[:,1] >= 0.0) * (pix_n[:,1] <= float(shape[1]-1))
+        counts = np.bincount(rows, minlength=num_bins).astype(np.float)
+        weights /= counts[rows]
 
-        logger.debug('%.3f %% of pixels intersected by grid %d' % \
-            ( (float(np.sum(intersect)) / float(np.product(intersect.shape)) * 100.0),
-            grid_index) )
+        integrator = sparse.csr_matrix((weights, (rows, cols)),
+                                       shape=(num_bins, self.num_pixels))
 
-        return pix_n[intersect], intersect
+        cache[key] = (q_values, integrator)
 
+        return q_values, integrator
 
-    @classmethod
-    def generic(cls, spacing=1.00, lim=100.0, energy=10.0,
-                photons_scattered_per_shot=1e4, l=50.0,
-                force_explicit=False):
+
+    def image_assembler(self, num_x=None, num_y=None, binning=1):
         """
-        Generates a simple grid detector that can be used for testing
-        (factory function).
+        Get a sparse operator that places each pixel directly into a 2D
+        real-space image of the detector (the x/y plane), e.g.
+
+            >>> A, shape = detector.image_assembler()
+            >>> image = A.dot(intensities).reshape(shape)
+
+        Each pixel is assigned to the image cell nearest its center; cells
+        receiving more than one pixel take their average, and cells receiving
+        none (e.g. gaps between panels) are zero. The operator is cached on
+        the detector.
 
         Optional Parameters
         -------------------
-        spacing : float
-            The real-space grid spacing
-        lim : float
-            The upper and lower limits of the grid
-        energy : float
-            Energy of the beam (in keV)
-        l : float
-            The path length from the sample to the detector, in the same units
-            as the detector dimensions.
-        force_explicit : bool
-            Forces the detector to be xyz_type explicit. Mostly for debugging.
-            Recommend keeping `False`.
+        num_x,num_y : int
+            The number of cells in the x/y direction of the image. By default,
+            implicit detectors use the finest pixel pitch of any panel, and
+            explicit detectors sqrt(num_pixels) cells in each direction.
+
+        binning : int
+            Reduce the default image size by this factor in each direction,
+            averaging pixels into larger cells. Useful for fast previews.
+            Ignored if `num_x` and `num_y` are passed.
 
         Returns
         -------
-        detector : odin.xray.Detector
-            An instance of the detector that meets the specifications of the
-            parameters
-        """
-
-        beam = Beam(photons_scattered_per_shot, energy=energy)
+        assembler : scipy.sparse.csr_matrix
+            A (num_y * num_x x num_pixels) operator.
 
-        if not force_explicit:
+        shape : tuple
+            The shape of the image, (num_y, num_x).
+        """
 
-            p = np.array([-lim, -lim, l])   # corner position
-            f = np.array([0.0, spacing, 0.0]) # slow scan is x
-            s = np.array([spacing, 0.0, 0.0]) # fast scan is y
+        cache, key, _ = self._operator_cache(('image', num_x, num_y, int(binning)))
+        if key in cache:
+            return cache[key]
 
-            dim = int(2*(lim / spacing) + 1)
-            shape = (dim, dim)
+        # gather the (x,y) positions panel-by-panel, ignoring the z-comp. of
+        # the detector -- only two of the three coordinates are ever stored
+        points = np.zeros((self.num_pixels, 2))
+        for slc, xyz in izip(self.panel_slices, self.iter_real()):
+            points[slc,:] = xyz[:,:2]
 
-            basis = BasisGrid()
-            basis.add_grid(p, s, f, shape)
+        if (num_x == None) or (num_y == None):
+            if self.xyz_type == 'implicit':
+                # use the finest pixel spacing on any panel
+                bg = self._basis_grid
+                spacing = min([ min(self._norm(bg.get_grid(i)[1]),
+                                    self._norm(bg.get_grid(i)[2]))
+                                for i in range(bg.num_grids) ])
+                num_x = int(np.ceil(np.ptp(points[:,0]) / spacing)) + 1
+                num_y = int(np.ceil(np.ptp(points[:,1]) / spacing)) + 1
+            else:
+                num_x = int(np.sqrt(self.num_pixels))
+                num_y = int(np.sqrt(self.num_pixels))
+            num_x = max(int(np.ceil(num_x / float(binning))), 1)
+            num_y = max(int(np.ceil(num_y / float(binning))), 1)
 
-            detector = cls(basis, beam)
+        # nearest cell on a regular grid spanning the detector
+        cell = np.zeros((self.num_pixels, 2), dtype=np.int)
+        for i, n in enumerate([num_x, num_y]):
+            lo, width = points[:,i].min(), np.ptp(points[:,i])
+            if width > 0.0 and n > 1:
+                cell[:,i] = np.round((points[:,i] - lo) / width * (n - 1))
+        rows = cell[:,1] * num_x + cell[:,0]
 
-        else:
-            x = np.arange(-lim, lim+spacing, spacing)
-            xx, yy = np.meshgrid(x, x)
+        counts = np.bincount(rows, minlength=num_x * num_y).astype(np.float)
+        assembler = sparse.csr_matrix((1.0 / counts[rows],
+                                       (rows, np.arange(self.num_pixels))),
+                                      shape=(num_x * num_y, self.num_pixels))
 
-            xyz = np.zeros((len(x)**2, 3))
-            xyz[:,0] = yy.flatten() # fast scan is y
-            xyz[:,1] = xx.flatten() # slow scan is x
-            xyz[:,2] = l
+        cache[key] = (assembler, (num_y, num_x))
 
-            detector = cls(xyz, beam)
+        return assembler, (num_y, num_x)
 
-        return detector
 
+    def _pixel_overlaps(self, pixels, ring_lo, ring_hi, num_phi, subpixels=32):
+        """
+        Split each pixel in `pixels` across the polar bins it overlaps, in
+        proportion to the area of overlap.
 
-    def _to_serial(self):
-        """ serialize the object to an array """
-        s = np.array( cPickle.dumps(self) )
-        s.shape=(1,) # a bit nasty...
-        return s
+        The four corners of each pixel are mapped to (|q|, phi), and the
+        resulting quadrilateral is clipped against every bin it touches. The
+        few pixels around the beam center, which do not map to a
+        quadrilateral, are instead split into `subpixels` x `subpixels`
+        points. Explicit detectors carry no pixel size, so each of their
+        pixels is assigned whole to the bin containing its center.
 
+        Parameters
+        ----------
+        pixels : ndarray, int
+            The (sorted) pixels to split.
 
-    @classmethod
-    def _from_serial(self, serialized):
-        """ recover a Detector object from a serialized array """
-        if serialized.shape == (1,):
-            serialized = serialized[0]
-        d = cPickle.loads( str(serialized) )
-        return d
+        ring_lo, ring_hi : ndarray, float
+            The sorted, non-overlapping |q| bounds of the rings.
 
+        num_phi : int
+            The number of equally spaced bins around the azimuth.
 
-    def save(self, filename):
-        """
-        Writes the current Detector to disk.
+        Returns
+        -------
+        index, bins, fraction : ndarray
+            For every (pixel, bin) pair with a non-zero overlap: the position
+            of the pixel in `pixels`, the ring, the phi bin, and the fraction
+            of the pixel's area that falls in the bin.
+        """
+
+        phi_spacing = 2.0 * np.pi / float(num_phi)
+        block = max(1, int(MEMORY_BUDGET) // 2**12) # pixels at a time
+
+        def bin_points(q, phi):
+            ring = np.searchsorted(ring_lo, q, side='right') - 1
+            inside = (ring >= 0)
+            inside[inside] = (q[inside] < ring_hi[ring[inside]])
+            return ring, (phi // phi_spacing).astype(np.int) % num_phi, inside
+
+        index, rings, phis, fraction = [], [], [], []
+        for i, (slc, xyz) in enumerate(izip(self.panel_slices, self.iter_real())):
+
+            lo, hi = np.searchsorted(pixels, [slc.start, slc.stop])
+            for start in range(lo, hi, block):
+                stop = min(start + block, hi)
+                px = np.arange(start, stop)
+                centers = xyz[pixels[px] - slc.start]
+
+                if self.xyz_type == 'explicit':
+                    rp = self._real_to_recpolar_pixels(centers)
+                    ring, phi_bin, inside = bin_points(rp[:,0], rp[:,2])
+                    index.append(px[inside])
+                    rings.append(ring[inside])
+                    phis.append(phi_bin[inside])
+                    fraction.append(np.ones(np.sum(inside)))
+                    continue
+
+                # the pixel corners in (|q|, phi), in order around the pixel
+                s = self._basis_grid._ss[i] / 2.0
+                f = self._basis_grid._fs[i] / 2.0
+                corners = [ self._real_to_recpolar_pixels(centers + o) for o
+                            in [s + f, s - f, - s - f, - s + f] ]
+                q   = np.array([ c[:,0] for c in corners ]).T
+                phi = np.array([ c[:,2] for c in corners ]).T
+
+                # unwrap pixels that straddle the phi = 0 / 2pi branch cut --
+                # those that still span a wide angle are so close to the beam
+                # center that their edges curve in (|q|, phi)
+                wrapped = (phi.max(1) - phi.min(1)) > np.pi
+                phi[wrapped] += 2.0 * np.pi * (phi[wrapped] < np.pi)
+                center = (phi.max(1) - phi.min(1)) > 0.1
+
+                # clip the quadrilaterals against every bin in their bounding
+                # box, with two periods of phi bins to cover unwrapped pixels
+                quad = np.where(~center)[0]
+                q, phi = q[quad], phi[quad]
+                r_first = np.searchsorted(ring_hi, q.min(1), side='right')
+                r_last  = np.searchsorted(ring_lo, q.max(1), side='right') - 1
+                p_first = (phi.min(1) // phi_spacing).astype(np.int)
+                p_last  = (phi.max(1) // phi_spacing).astype(np.int)
+                num_r = np.maximum(r_last - r_first + 1, 0)
+                num_p = p_last - p_first + 1
+
+                counts = num_r * num_p
+                j = np.repeat(np.arange(len(quad)), counts)
+                k = np.arange(np.sum(counts)) - np.repeat(np.cumsum(counts) - counts,
+                                                          counts)
+                ring = r_first[j] + k // num_p[j]
+                phi_bin = p_first[j] + k % num_p[j]
+
+                area = _polygon_area(q, phi)
+                overlap = _clipped_area(q[j], phi[j], ring_lo[ring], ring_hi[ring],
+                                        phi_bin * phi_spacing,
+                                        (phi_bin + 1) * phi_spacing)
+                frac = overlap / area[j]
+                keep = (frac > 0.0)
+                index.append(px[quad[j[keep]]])
+                rings.append(ring[keep])
+                phis.append(phi_bin[keep] % num_phi)
+                fraction.append(frac[keep])
+
+                # sub-pixel points for the pixels around the beam center
+                if np.any(center):
+                    u = (np.arange(subpixels) + 0.5) / subpixels - 0.5
+                    o = (u[:,None,None] * 2.0 * s + u[None,:,None] * 2.0 * f).reshape(-1, 3)
+                    pts = (centers[center][:,None,:] + o[None,:,:]).reshape(-1, 3)
+                    rp = self._real_to_recpolar_pixels(pts)
+                    ring, phi_bin, inside = bin_points(rp[:,0], rp[:,2])
+                    index.append(np.repeat(px[center], len(o))[inside])
+                    rings.append(ring[inside])
+                    phis.append(phi_bin[inside])
+                    fraction.append(np.ones(np.sum(inside)) / float(len(o)))
+
+        if len(index) == 0:
+            return np.zeros(0, np.int), np.zeros(0, np.int), np.zeros(0, np.int), \
+                   np.zeros(0)
+
+        return np.concatenate(index), np.concatenate(rings), \
+               np.concatenate(phis), np.concatenate(fraction)
+
+
+    def polar_rebinner(self, q_values, num_phi, q_width=None, mask=None):
+        """
+        Get a sparse operator that rebins pixel intensities onto a polar
+        (|q|, phi) grid, by splitting each pixel's area across the polar bins
+        it overlaps. Unlike interpolation, every pixel contributes in
+        proportion to its overlap with each bin, so no data are discarded and
+        no mask dilation is required.
+
+        The overlap matrix is computed once and cached on the detector, so
+        rebinning many shots costs a single sparse product.
 
         Parameters
         ----------
-        filename : str
-            The path to the shotset file to save.
-        """
+        q_values : ndarray, float
+            The |q| values at the center of each ring.
 
-        if not filename.endswith('.dtc'):
-            filename += '.dtc'
+        num_phi : int
+            The number of equally spaced bins around the azimuth, starting at
+            phi = 0.
 
-        io.saveh(filename, detector=self._to_serial())
-        logger.info('Wrote %s to disk.' % filename)
+        Optional Parameters
+        -------------------
+        q_width : float
+            The radial width of each ring. By default, the smallest spacing
+            between adjacent `q_values`. Must be passed if there is only one
+            ring.
 
-        return
+        mask : ndarray, bool
+            A `num_pixels` array that is True for pixels that should be
+            included and False for pixels that should be ignored.
 
+        Returns
+        -------
+        rebinner : scipy.sparse.csr_matrix
+            A (num_q * num_phi x num_pixels) operator, rows ordered (q, phi)
+            with phi changing fastest. Each row averages the pixels overlapping
+            that bin, weighted by the overlap.
 
-    @classmethod
-    def load(cls, filename):
+        coverage : ndarray, float
+            A (num_q, num_phi) array of the number of pixels that fall in each
+            polar bin, counting partially-overlapping pixels fractionally.
+            Bins with zero coverage have no data.
+
+        Notes
+        -----
+        Each pixel is mapped to (|q|, phi) as the quadrilateral through its
+        four corners, which is then clipped against the bins exactly. Pixels
+        around the beam center are split into sub-pixels instead. Explicit
+        detectors carry no pixel size, so each pixel is assigned whole to the
+        bin containing its center.
         """
-        Loads the a Detector from disk.
 
-        Parameters
-        ----------
-        filename : str
-            The path to the shotset file.
+        q_values, q_width = self._ring_widths(q_values, q_width)
+        num_q = len(q_values)
 
-        Returns
-        -------
-        shotset : odin.xray.Shotset
-            A shotset object
-        """
+        cache, key, mask = self._operator_cache(('rebin', tuple(q_values),
+                                                 q_width, int(num_phi)), mask)
+        if key in cache:
+            return cache[key]
 
-        if not filename.endswith('.dtc'):
-            raise ValueError('Must load a detector file (.dtc extension)')
+        if mask != None:
+            pixels = np.where(mask)[0]
+        else:
+            pixels = np.arange(self.num_pixels)
 
-        hdf = io.loadh(filename)
-        d = cls._from_serial(hdf['detector'])
-        return d
-    
+        order = np.argsort(q_values)
+        ring_lo = q_values[order] - q_width / 2.0
+        ring_hi = q_values[order] + q_width / 2.0
+        index, ring, phi_bin, weights = self._pixel_overlaps(pixels, ring_lo,
+                                                             ring_hi, num_phi)
 
-class Shotset(object):
-    """
-    A collection of xray 'shots', and methods for anaylzing statistical
-    properties across shots (each shot a single x-ray image).
-    """
+        rows = order[ring] * num_phi + phi_bin
+        cols = pixels[index]
+
+        overlap = sparse.csr_matrix((weights, (rows, cols)),
+                                    shape=(num_q * num_phi, self.num_pixels))
 
-    def __init__(self, intensities, detector, mask=None):
+        coverage = np.array(overlap.sum(axis=1)).flatten()
+        norm = np.zeros_like(coverage)
+        norm[coverage > 0.0] = 1.0 / coverage[coverage > 0.0]
+        rebinner = sparse.diags(norm, 0).dot(overlap).tocsr()
+
+        coverage = coverage.reshape(num_q, num_phi)
+        cache[key] = (rebinner, coverage)
+
+        return rebinner, coverage
+
+
+
+    def photon_binner(self, q_values, num_phi, q_width=None, mask=None):
         """
-        Instantiate a Shotset class.
+        Assign each pixel whole to the polar (|q|, phi) bin containing its
+        center -- the binning used to correlate photon lists, where each
+        photon is a point, rather than an area to be split across bins.
+
+        The assignment is computed once and cached on the detector.
 
         Parameters
         ----------
-        intensities : ndarray, float
-            Either a list of one-D arrays, or a two-dimensional array. The first
-            dimension should index shots, the second intensities for each pixel
-            in that shot.
+        q_values : ndarray, float
+            The |q| values at the center of each ring.
 
-        detector : odin.xray.Detector
-            A detector object, containing the pixel positions in space.
+        num_phi : int
+            The number of equally spaced bins around the azimuth, starting at
+            phi = 0.
 
         Optional Parameters
         -------------------
-        mask : ndarray, np.bool
-            An array the same size (and shape -- 1d) as `intensities` with a
-            'np.True' in all indices that should be kept, and 'np.False'
-            for all indices that should be masked.
-        """
-
-        # parse detector
-        if not isinstance(detector, Detector):
-            raise ValueError('`detector` argument must be type: xray.Detector')
-        else:
-            self.detector = detector
+        q_width : float
+            The radial width of each ring. By default, the smallest spacing
+            between adjacent `q_values`. Must be passed if there is only one
+            ring.
 
-        # parse intensities
-        if type(intensities) == list:
-            intensities = np.array(intensities)
+        mask : ndarray, bool
+            A `num_pixels` array that is True for pixels that should be
+            included and False for pixels that should be ignored.
 
-        if type(intensities) == np.ndarray:
-            s = intensities.shape
+        Returns
+        -------
+        q_bin : ndarray, int
+            The ring of each pixel, -1 for pixels in no ring (or masked).
 
-            if len(s) == 1:
-                if not s[0] == self.detector.num_pixels:
-                    raise ValueError('`intensities` does not have the same '
-                                     'number of pixels as `detector`')
-                self.intensities = intensities[None,:]
+        phi_bin : ndarray, int
+            The azimuthal bin of each pixel.
 
-            elif len(s) == 2:
-                if not s[1] == self.detector.num_pixels:
-                    raise ValueError('`intensities` does not have the same '
-                                     'number of pixels as `detector`')
-                self.intensities = intensities
+        coverage : ndarray, float
+            A (num_q, num_phi) array of the number of pixels in each bin.
+        """
 
-            else:
-                raise ValueError('`intensities` has a invalid number of '
-                                 'dimensions, must be 1 or 2 (got: %d)' % len(s))
+        q_values, q_width = self._ring_widths(q_values, q_width)
+        num_q = len(q_values)
 
-        else:
-            raise TypeError('`intensities` must be type ndarray')
+        cache, key, mask = self._operator_cache(('photon', tuple(q_values),
+                                                 q_width, int(num_phi)), mask)
+        if key in cache:
+            return cache[key]
 
-        assert len(self.intensities.shape) == 2
+        order = np.argsort(q_values)
+        ring_lo = q_values[order] - q_width / 2.0
+        phi_spacing = 2.0 * np.pi / float(num_phi)
 
-        # parse mask
-        if mask != None:
-            mask = mask.flatten()
-            if len(mask) != self.detector.num_pixels:
-                raise ValueError('Mask must a len `detector.num_pixels` array')
-            self.mask = np.array(mask.flatten()).astype(np.bool)
-        else:
-            #self.mask = np.zeros(self.detector.num_pixels, dtype=np.bool)
-            self.mask = None
+        q_bin   = np.zeros(self.num_pixels, dtype=np.int32) - 1
+        phi_bin = np.zeros(self.num_pixels, dtype=np.int32)
 
+        # bin one panel at a time -- the ring whose
+        # [q - q_width/2, q + q_width/2) contains each pixel
+        for slc, rp in izip(self.panel_slices, self.iter_recpolar()):
+            i = np.searchsorted(ring_lo, rp[:,0], side='right') - 1
+            inside = (i >= 0)
+            inside[inside] = rp[inside,0] < ring_lo[i[inside]] + q_width
+            if mask != None:
+                inside &= mask[slc]
+            q_bin[slc][inside] = order[i[inside]]
 
-        return
+            p = np.floor(np.mod(rp[:,2], 2.0 * np.pi) / phi_spacing)
+            phi_bin[slc] = np.minimum(p.astype(np.int32), num_phi - 1)
 
+        inside = (q_bin >= 0)
+        coverage = np.bincount(q_bin[inside] * num_phi + phi_bin[inside],
+                               minlength=num_q * num_phi).astype(np.float)
+        coverage = coverage.reshape(num_q, num_phi)
 
-    @property
-    def num_shots(self):
-        return self.intensities.shape[0]
-        
-        
-    @property
-    def num_pixels(self):
-        return self.intensities.shape[1]
-    
+        cache[key] = (q_bin, phi_bin, coverage)
 
-    def __len__(self):
-        return self.num_shots
+        return q_bin, phi_bin, coverage
 
 
-    def __getitem__(self, key):
-        """
-        Slice the shotset into a smaller shotset.
+    def evaluate_qmag(self, xyz):
         """
-        if type(key) not in [np.ndarray, int]:
-            raise TypeError('Only int or np.ndarray:dtype int can slice a Shot')
-        new_i = self.intensities[key,:].copy()
-        return Shotset(new_i, self.detector, self.mask)
+        Given the positions of pixels `xyz`, compute the corresponding |q|
+        value for each.
 
+        Parameters
+        ----------
+        qxyz : ndarray, float
+            The array of pixels (shape : N x 3)
 
-    def __add__(self, other):
-        if not isinstance(other, Shotset):
-            raise TypeError('Cannot add types: %s and Shotset' % type(other))
-        if not self.detector == other.detector:
-            raise RuntimeError('shotset objects must share the same detector to add')
-        if not np.all(self.mask == other.mask):
-            raise RuntimeError('shotset objects must share the same mask to add')
-        new_i = np.vstack(( self.intensities, other.intensities ))
-        return Shotset(new_i, self.detector, self.mask)
+        Returns
+        -------
+        qmag : ndarray, float
+            The array of q-magnitudes, len N.
+        """
+        thetas = self._evaluate_theta(xyz)
+        qmag = 2.0 * self.k * np.sin(thetas/2.0)
+        return qmag
 
 
-    @property
-    def average_intensity(self):
-        return self.intensities.sum(0) # average over shots
+    def _evaluate_theta(self, xyz):
+        """
+        Given the positions of pixels `xyz`, compute the corresponding
+        scattering angle theta for each.
 
+        Parameters
+        ----------
+        xyz : ndarray, float
+            The array of pixels (shape : N x 3)
 
-    @staticmethod
-    def num_phi_to_values(num_phi):
+        Returns
+        -------
+        thetas : ndarray, float
+            The scattering angles for each pixel
         """
-        Converts `phi_spacing` to the explicit values, all in RADIANS.
+        u_xyz  = self._unit_vector(xyz)
+        thetas = np.arccos(np.dot( u_xyz, self.beam_vector ))
+        return thetas
+
+
+    def _real_to_polar(self, xyz):
         """
-        phi_values = np.arange(0, 2.0*np.pi, 2.0*np.pi/float(num_phi))
-        return phi_values
+        Convert the real-space representation to polar coordinates.
+        """
+        polar = self._to_polar(xyz)
+        return polar
+
+
+    def _real_to_reciprocal(self, xyz):
+        """
+        Convert the real-space to reciprocal-space in cartesian form.
+        """
+
+        assert len(xyz.shape) == 2
+        assert xyz.shape[1] == 3
+
+        # generate unit vectors in the pixel direction, origin at sample
+        S = self._unit_vector(xyz)
+        q = self.k * (S - self.beam_vector)
+
+        return q
+
+
+    def _real_to_recpolar(self, xyz):
+        """
+        Convert the real-space to reciprocal-space in polar form, that is
+        (|q|, theta , phi).
+        """
+        reciprocal_polar = self._to_polar( self._real_to_reciprocal(xyz) )
+        return reciprocal_polar
+
+
+    def _real_to_recpolar_pixels(self, xyz):
+        """
+        Convert real-space pixel positions to reciprocal-space polar form,
+        using the detector convention that theta is the angle of the q-vector
+        with the plane normal to the beam.
+        """
+        a = self._real_to_recpolar(xyz)
+        a[:,1] = self._real_to_polar(xyz)[:,1] / 2.0
+        return a
 
 
     @staticmethod
-    def num_phi_to_spacing(num_phi):
-        return 2.0*np.pi / float(num_phi)
+    def _norm(vector):
+        """
+        Compute the norm of an n x m array of vectors, where m is the dimension.
+        """
+        if len(vector.shape) == 2:
+            assert vector.shape[1] == 3
+            norm = np.sqrt( np.sum( np.power(vector, 2), axis=1 ) )
+        elif len(vector.shape) == 1:
+            assert vector.shape[0] == 3
+            norm = np.sqrt( np.sum( np.power(vector, 2) ) )
+        else:
+            raise ValueError('Shape of vector wrong')
+        return norm
 
 
-    def assemble_image(self, shot_index=None, num_x=None, num_y=None):
+    def _unit_vector(self, vector):
         """
-        Assembles the Shot object into a real-space image.
+        Returns a unit-norm version of `vector`.
 
         Parameters
         ----------
-        shot_index : int
-            The shot inside the Shotset to assemble. If `None`, will assemble
-            an average image.
+        vector : ndarray, float
+            An n x m vector of floats, where m is assumed to be the dimension
+            of the space.
 
-        num_x,num_y : int
-            The number of pixels in the x/y direction that will comprise the final
-            grid.
+        Returns
+        -------
+        unit_vectors : ndarray,float
+            An n x m vector, same as before, but now of unit length
+        """
+
+        norm = self._norm(vector)
+
+        if len(vector.shape) == 1:
+            unit_vectors = vector / norm
+
+        elif len(vector.shape) == 2:
+            unit_vectors = vector / norm[:,None]
+
+        else:
+            raise ValueError('invalid shape for `vector`: %s' % str(vector.shape))
+
+        return unit_vectors
+
+
+    def _to_polar(self, vector):
+        """
+        Converts n m-dimensional `vector`s to polar coordinates. By polar
+        coordinates, I mean the cannonical physicist's (r, theta, phi), no
+        2-theta business.
+
+        We take, as convention, the 'z' direction to be along self.beam_vector
+        """
+
+        polar = np.zeros( vector.shape )
+
+        # note the below is a little modified from the standard, to take into
+        # account the fact that the beam may not be only in the z direction
+
+        polar[:,0] = self._norm(vector)
+        polar[:,1] = np.arccos( np.dot(vector, self.beam_vector) / \
+                                (polar[:,0]+1e-16) )           # cos^{-1}(z.x/r)
+        polar[:,2] = arctan3(vector[:,1] - self.beam_vector[1],
+                             vector[:,0] - self.beam_vector[0])   # y first!
+
+        return polar
+
+
+    def _compute_intersections(self, q_vectors, grid_index, run_checks=True):
+        """
+        Compute the points i=(x,y,z) where the scattering vectors described by
+        `q_vectors` intersect the detector.
+
+        Parameters
+        ----------
+        q_vectors : np.ndarray
+            An N x 3 array representing q-vectors in cartesian q-space.
+
+        grid_index : int
+            The index of the grid array to intersect
+
+        Optional Parameters
+        -------------------
+        run_checks: bool
+            Whether to run some good sanity checks, at small computational cost.
 
         Returns
         -------
-        grid_z : ndarray, float
-            A 2d array representing the image one would see when viewing the
-            shot in real space. E.g., to visualize w/matplotlib:
+        pix_n : ndarray, float
+            The coefficients of the position of each intersection in terms of
+            the basis grids s/f vectors.
 
-            >>> imshow(grid_z.T)
-            >>> show()
-            ...
+        intersect: ndarray, bool
+            A boolean array of which of `q_vectors` intersect with the grid
+            plane. First column is slow scan vector (s),  second is fast (f).
+
+        References
+        ----------
+        .[1] http://en.wikipedia.org/wiki/Line-plane_intersection
         """
 
-        if shot_index == None:
-            inten = self.average_intensity
-        else:
-            inten = self.intensities[shot_index,:]
+        if not self.xyz_type == 'implicit':
+            raise RuntimeError('intersections can only be computed for implicit'
+                               ' detectors')
+
+        # compute the scattering vectors correspoding to q_vectors
+        S = (q_vectors / self.k) + self.beam_vector
+
+        # compute intersections
+        p, s, f, shape = self._basis_grid.get_grid(grid_index)
+        n = self._unit_vector( np.cross(s, f) )
+        i = (np.dot(p, n) / np.dot(S, n))[:,None] * S
+
+        # convert to pixel units by solving for the coefficients of proj
+        A = np.array([s,f]).T
+        pix_n, resid, rank, sigma = np.linalg.lstsq( A, (i-p).T )
+
+        if run_checks:
+            err = np.sum( np.abs((i-p) - np.transpose( np.dot(A, pix_n) )) )
+            if err > 1e-6:
+                raise RuntimeError('Error in computing where scattering vectors '
+                                   'intersect with detector. Intersect not reproduced'
+                                   ' (err: %f per pixel)' % (err / i.shape[0],) )
+
+            if not np.sum(resid) < 1e-6:
+                raise RuntimeError('Error in basis grid (residuals of point '
+                                   'placement too large). Perhaps fast/slow '
+                                   'vectors describing basis grid are linearly '
+                                   'dependant?')
+
+        pix_n = pix_n.T
+        assert pix_n.shape[1] == 2 # s/f
+
+        # see if the intersection in the plane is on the detector grid
+        intersect = (pix_n[:,0] >= 0.0) * (pix_n[:,0] <= float(shape[0]-1)) *\
+                    (pix_n[:,1] >= 0.0) * (pix_n[:,1] <= float(shape[1]-1))
+
+        logger.debug('%.3f %% of pixels intersected by grid %d' % \
+            ( (float(np.sum(intersect)) / float(np.product(intersect.shape)) * 100.0),
+            grid_index) )
+
+        return pix_n[intersect], intersect
+
+
+    def _interpolation_plan(self, q_values, num_phi):
+        """
+        The intersections of a polar grid with each of the detector's grids
+        (see `_compute_intersections`), i.e. everything needed to interpolate
+        shots onto the polar grid that does not depend on the intensities.
+        Plans are cached on the detector.
+
+        Returns
+        -------
+        plan : list
+            A list of (pix_n, intersect) tuples, one per grid.
+        """
+
+        q_values = np.asarray(q_values, dtype=np.float64)
+        cache, key, _ = self._operator_cache(('interpolate',
+                              hashlib.sha1(q_values.tostring()).hexdigest(),
+                              int(num_phi)))
+        if key in cache:
+            return cache[key]
+
+        q_vectors = _q_grid_as_xyz(q_values, num_phi, self.k)
+        plan = [ self._compute_intersections(q_vectors, g) for g in \
+                 range(self._basis_grid.num_grids) ]
+
+        cache[key] = plan
+
+        return plan
+
+
+    @classmethod
+    def generic(cls, spacing=1.00, lim=100.0, energy=10.0,
+                photons_scattered_per_shot=1e4, l=50.0,
+                force_explicit=False):
+        """
+        Generates a simple grid detector that can be used for testing
+        (factory function).
+
+        Optional Parameters
+        -------------------
+        spacing : float
+            The real-space grid spacing
+        lim : float
+            The upper and lower limits of the grid
+        energy : float
+            Energy of the beam (in keV)
+        l : float
+            The path length from the sample to the detector, in the same units
+            as the detector dimensions.
+        force_explicit : bool
+            Forces the detector to be xyz_type explicit. Mostly for debugging.
+            Recommend keeping `False`.
+
+        Returns
+        -------
+        detector : odin.xray.Detector
+            An instance of the detector that meets the specifications of the
+            parameters
+        """
+
+        beam = Beam(photons_scattered_per_shot, energy=energy)
+
+        if not force_explicit:
+
+            p = np.array([-lim, -lim, l])   # corner position
+            f = np.array([0.0, spacing, 0.0]) # slow scan is x
+            s = np.array([spacing, 0.0, 0.0]) # fast scan is y
+
+            dim = int(2*(lim / spacing) + 1)
+            shape = (dim, dim)
+
+            basis = BasisGrid()
+            basis.add_grid(p, s, f, shape)
+
+            detector = cls(basis, beam)
+
+        else:
+            x = np.arange(-lim, lim+spacing, spacing)
+            xx, yy = np.meshgrid(x, x)
+
+            xyz = np.zeros((len(x)**2, 3))
+            xyz[:,0] = yy.flatten() # fast scan is y
+            xyz[:,1] = xx.flatten() # slow scan is x
+            xyz[:,2] = l
+
+            detector = cls(xyz, beam)
+
+        return detector
+
+
+    def __getstate__(self):
+        # cached operators are derived data, don't carry them into pickles
+        state = self.__dict__.copy()
+        state.pop('_integrator_cache', None)
+        return state
+
+
+    def _to_serial(self):
+        """ serialize the object to an array """
+        s = np.array( cPickle.dumps(self) )
+        s.shape=(1,) # a bit nasty...
+        return s
+
+
+    @classmethod
+    def _from_serial(self, serialized):
+        """ recover a Detector object from a serialized array """
+        if serialized.shape == (1,):
+            serialized = serialized[0]
+        d = cPickle.loads( str(serialized) )
+        return d
+
+
+    def _to_hdf(self, filename, where='/'):
+        """
+        Write the detector into the HDF5 file `filename`, as a group named
+        'detector' under `where`. Any existing detector at that location is
+        replaced. The layout of the group is:
+
+            detector/              attrs: xyz_type, k
+                                   (+ energy, photons_scattered_per_shot)
+            detector/beam_vector   (3,)
+            detector/p, s, f       (num_grids, 3)   -- implicit only
+            detector/shape         (num_grids, 2)   -- implicit only
+            detector/pixels        (num_pixels, 3)  -- explicit only
+
+        Parameters
+        ----------
+        filename : str
+            The HDF5 file to write to. Created if it does not exist.
+
+        where : str
+            The group in the file to write the detector under.
+        """
+
+        self._detach(filename)
+        h5 = tables.openFile(filename, mode='a')
+
+        try:
+            path = where.rstrip('/') + '/detector'
+            if path in h5:
+                h5.removeNode(where, 'detector', recursive=True)
+
+            g = h5.createGroup(where, 'detector')
+            g._v_attrs.xyz_type = self.xyz_type
+            g._v_attrs.k        = float(self.k)
+            if self.beam != None:
+                g._v_attrs.energy = float(self.beam.energy)
+                g._v_attrs.photons_scattered_per_shot = \
+                    float(self.beam.photons_scattered_per_shot)
+
+            h5.createArray(g, 'beam_vector', np.array(self.beam_vector))
+
+            if self.xyz_type == 'implicit':
+                bg = self._basis_grid
+                h5.createArray(g, 'p', np.array(bg._ps, dtype=np.float64))
+                h5.createArray(g, 's', np.array(bg._ss, dtype=np.float64))
+                h5.createArray(g, 'f', np.array(bg._fs, dtype=np.float64))
+                h5.createArray(g, 'shape', np.array(bg._shapes, dtype=np.int64))
+
+            elif self.xyz_type == 'explicit':
+                filters = tables.Filters(complib='blosc', complevel=9, shuffle=True)
+                pixels = h5.createCArray(g, 'pixels', tables.Float64Atom(),
+                                         shape=(self.num_pixels, 3),
+                                         filters=filters)
+                pixels[:,:] = np.array(self._pixels)
+
+        finally:
+            h5.close()
+
+        return
+
+
+    @classmethod
+    def _from_hdf(cls, filename, where='/detector'):
+        """
+        Read a detector from the HDF5 file `filename`. Reads both the
+        structured layout written by `_to_hdf` and the legacy layout, where
+        the detector is stored as a pickled object.
+
+        Explicit pixel positions are not read into memory here -- they stay
+        on disk until they are first needed.
+
+        Parameters
+        ----------
+        filename : str
+            The HDF5 file to read from.
+
+        where : str
+            The path of the detector inside the file.
+
+        Returns
+        -------
+        detector : odin.xray.Detector
+            The detector.
+        """
+
+        h5 = tables.openFile(filename, mode='r')
+
+        try:
+            node = h5.getNode(where)
+
+            # legacy format -- a pickled object in a string array
+            if not isinstance(node, tables.Group):
+                return cls._from_serial(node.read())
+
+            attrs = node._v_attrs
+            beam_vector = node.beam_vector.read()
+
+            if attrs.xyz_type == 'implicit':
+                xyz = BasisGrid()
+                for p, s, f, shape in zip(node.p.read(), node.s.read(),
+                                          node.f.read(), node.shape.read()):
+                    xyz.add_grid(p, s, f, tuple([ int(x) for x in shape ]))
+
+            elif attrs.xyz_type == 'explicit':
+                xyz = DiskArray(filename, where.rstrip('/') + '/pixels')
+
+            else:
+                raise IOError('Unrecognized detector xyz_type in file: %s'
+                              % str(attrs.xyz_type))
+
+            k = float(attrs.k)
+            if 'energy' in attrs._v_attrnames:
+                beam = Beam(attrs.photons_scattered_per_shot, energy=attrs.energy)
+            else:
+                beam = None
+
+        finally:
+            h5.close()
+
+        d = cls(xyz, k, beam_vector=beam_vector)
+        d.beam = beam
+
+        return d
+
+
+    def save(self, filename):
+        """
+        Writes the current Detector to disk.
+
+        Parameters
+        ----------
+        filename : str
+            The path to the shotset file to save.
+        """
+
+        if not filename.endswith('.dtc'):
+            filename += '.dtc'
+
+        self._detach(filename)
+        h5 = tables.openFile(filename, mode='w')
+        h5.close()
+
+        self._to_hdf(filename)
+        logger.info('Wrote %s to disk.' % filename)
+
+        return
+
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Loads the a Detector from disk.
+
+        Parameters
+        ----------
+        filename : str
+            The path to the shotset file.
+
+        Returns
+        -------
+        shotset : odin.xray.Shotset
+            A shotset object
+        """
+
+        if not filename.endswith('.dtc'):
+            raise ValueError('Must load a detector file (.dtc extension)')
+
+        d = cls._from_hdf(filename)
+        return d
+    
+
+class Shotset(object):
+    """
+    A collection of xray 'shots', and methods for anaylzing statistical
+    properties across shots (each shot a single x-ray image).
+    """
+
+    def __init__(self, intensities, detector, mask=None, memory_budget=None,
+                 dtype=None):
+        """
+        Instantiate a Shotset class.
+
+        Parameters
+        ----------
+        intensities : ndarray, float
+            Either a list of one-D arrays, or a two-dimensional array. The first
+            dimension should index shots, the second intensities for each pixel
+            in that shot. May also be an np.memmap or an xray.DiskArray, in
+            which case the intensities are kept on disk and streamed through
+            memory as needed, or a scipy.sparse matrix, for low-flux data
+            that are mostly zeros.
+
+        detector : odin.xray.Detector
+            A detector object, containing the pixel positions in space.
+
+        Optional Parameters
+        -------------------
+        mask : ndarray, np.bool
+            An array the same size (and shape -- 1d) as `intensities` with a
+            'np.True' in all indices that should be kept, and 'np.False'
+            for all indices that should be masked.
+
+        memory_budget : int
+            The approximate number of bytes of intensity data to hold in memory
+            at once when streaming over shots. Defaults to MEMORY_BUDGET.
+
+        dtype : np.dtype
+            The type to store the intensities as, e.g. np.int32 for raw
+            detector counts or np.float32 to halve memory use. By default, the
+            type of `intensities` is kept. Computations upcast as needed, and
+            single precision data are processed in single precision.
+        """
+
+        # parse detector
+        if not isinstance(detector, Detector):
+            raise ValueError('`detector` argument must be type: xray.Detector')
+        else:
+            self.detector = detector
+
+        # parse intensities
+        if type(intensities) == list:
+            intensities = np.array(intensities)
+
+        if sparse.issparse(intensities):
+            intensities = sparse.csr_matrix(intensities)
+
+        if isinstance(intensities, (np.ndarray, DiskArray, ArrayBlocks,
+                                    sparse.csr_matrix)):
+            s = intensities.shape
+
+            if len(s) == 1:
+                if not s[0] == self.detector.num_pixels:
+                    raise ValueError('`intensities` does not have the same '
+                                     'number of pixels as `detector`')
+                self._intensities = np.array(intensities)[None,:]
+
+            elif len(s) == 2:
+                if not s[1] == self.detector.num_pixels:
+                    raise ValueError('`intensities` does not have the same '
+                                     'number of pixels as `detector`')
+                self._intensities = intensities
+
+            else:
+                raise ValueError('`intensities` has a invalid number of '
+                                 'dimensions, must be 1 or 2 (got: %d)' % len(s))
+
+        else:
+            raise TypeError('`intensities` must be type ndarray')
+
+        assert len(self._intensities.shape) == 2
+
+        if (dtype != None) and (not np.dtype(dtype) == self._intensities.dtype):
+            if not isinstance(self._intensities, (np.ndarray, sparse.csr_matrix)):
+                raise TypeError('Cannot change the dtype of intensities stored '
+                                'on disk or in blocks')
+            self._intensities = self._intensities.astype(dtype)
+
+        if memory_budget == None:
+            memory_budget = MEMORY_BUDGET
+        self.memory_budget = memory_budget
+
+        # corrections waiting to be applied to data read from disk -- see
+        # `correct`
+        self._correction = None
+
+        # parse mask
+        if mask != None:
+            mask = mask.flatten()
+            if len(mask) != self.detector.num_pixels:
+                raise ValueError('Mask must be a len `detector.num_pixels` array')
+            self.mask = np.array(mask.flatten()).astype(np.bool)
+        else:
+            #self.mask = np.zeros(self.detector.num_pixels, dtype=np.bool)
+            self.mask = None
+
+
+        return
+
+
+    @property
+    def intensities(self):
+        """
+        The (num_shots, num_pixels) array of intensities. If the shotset is
+        on disk, this reads every shot into memory -- use `iter_chunks` to
+        stream over large shotsets instead.
+        """
+        if self.on_disk or self.is_sparse:
+            return self._corrected(_dense(self._intensities))
+        elif isinstance(self._intensities, np.ndarray):
+            return self._intensities
+        else:
+            # in-memory blocks: concatenate once, then keep the result
+            self._intensities = np.array(self._intensities)
+            return self._intensities
+
+
+    @property
+    def dtype(self):
+        """
+        The type the intensities are stored as.
+        """
+        if (self._correction != None) and \
+           (not np.issubdtype(self._intensities.dtype, np.floating)):
+            return np.dtype(_compute_dtype(self._intensities.dtype))
+        return self._intensities.dtype
+
+
+    @property
+    def is_sparse(self):
+        """
+        Whether the intensities are stored as a sparse (CSR) matrix.
+        """
+        return sparse.issparse(self._intensities)
+
+
+    @property
+    def on_disk(self):
+        """
+        Whether the intensities are stored out-of-core, in an HDF5 file or a
+        memory-mapped file.
+        """
+        if isinstance(self._intensities, ArrayBlocks):
+            return not self._intensities.in_memory
+        return isinstance(self._intensities, (DiskArray, np.memmap))
+
+
+    @property
+    def num_shots(self):
+        return self._intensities.shape[0]
+        
+        
+    @property
+    def num_pixels(self):
+        return self._intensities.shape[1]
+    
+
+    def __len__(self):
+        return self.num_shots
+
+
+    def __getitem__(self, key):
+        """
+        Slice the shotset into a smaller shotset.
+        """
+        if type(key) not in [np.ndarray, int]:
+            raise TypeError('Only int or np.ndarray:dtype int can slice a Shot')
+        if self.is_sparse:
+            new_i = self._intensities[key]
+        elif type(key) == int:
+            new_i = np.array(self._intensities[key,:])
+        else:
+            new_i = _read_rows(self._intensities, key)
+        return Shotset(self._corrected(new_i), self.detector, self.mask,
+                       memory_budget=self.memory_budget)
+
+
+    def _chunk_size(self):
+        """
+        The number of shots that fit in `memory_budget`.
+        """
+        if self.is_sparse:
+            # sparse rows cost their stored values + column indices
+            nnz_per_row = max(1, self._intensities.nnz // max(1, self.num_shots))
+            row_bytes = nnz_per_row * (self._intensities.dtype.itemsize + 4)
+        else:
+            row_bytes = self.num_pixels * self._intensities.dtype.itemsize
+        return max(1, int(self.memory_budget) // row_bytes)
+
+
+    def _iter_chunks(self, n=None, shots=None):
+        """
+        Iterate over the shots in blocks of `n`, by default as many as fit in
+        `memory_budget`.
+
+        Optional Parameters
+        -------------------
+        n : int
+            The number of shots per block.
+
+        shots : ndarray, int
+            Iterate over only these shots (e.g. the output of `screen`). Only
+            the selected shots are read.
+
+        Yields
+        ------
+        slc : slice
+            The shots in the current block -- positions in `shots`, if passed.
+
+        intensities : ndarray
+            An in-memory (n, num_pixels) array of the block's intensities. For
+            sparse shotsets, a sparse (CSR) matrix.
+        """
+        if n == None:
+            n = self._chunk_size()
+        n = max(1, int(n))
+
+        if shots == None:
+            num_shots = self.num_shots
+        else:
+            shots = np.array(shots, dtype=np.int).flatten()
+            num_shots = len(shots)
+
+        for start in range(0, num_shots, n):
+            slc = slice(start, min(start + n, num_shots))
+            if shots == None:
+                key = slc
+            else:
+                key = shots[slc]
+            if self.is_sparse:
+                yield slc, self._intensities[key]
+            elif shots == None:
+                yield slc, self._corrected(np.asarray(self._intensities[key]))
+            else:
+                yield slc, self._corrected(_read_rows(self._intensities, key))
+
+
+    def iter_chunks(self, n=None):
+        """
+        Iterate over the shotset in blocks of shots. Only one block is held in
+        memory at a time, so this can be used to process shotsets that are
+        larger than memory (see `Shotset.load(..., in_memory=False)`).
+
+        Optional Parameters
+        -------------------
+        n : int
+            The number of shots per block. By default, as many shots as fit in
+            `memory_budget`.
+
+        Yields
+        ------
+        block : odin.xray.Shotset
+            An in-memory shotset of (up to) `n` consecutive shots, sharing
+            this shotset's detector and mask.
+        """
+        for slc, chunk in self._iter_chunks(n):
+            yield Shotset(chunk, self.detector, self.mask,
+                          memory_budget=self.memory_budget)
+
+
+    def __add__(self, other):
+        if not isinstance(other, Shotset):
+            raise TypeError('Cannot add types: %s and Shotset' % type(other))
+        if not self.detector == other.detector:
+            raise RuntimeError('shotset objects must share the same detector to add')
+        if not np.all(self.mask == other.mask):
+            raise RuntimeError('shotset objects must share the same mask to add')
+        if (self._correction != None) or (other._correction != None):
+            raise RuntimeError('cannot add shotsets with corrections pending, '
+                               'add them before calling `correct`')
+        if self.is_sparse or other.is_sparse:
+            new_i = sparse.vstack([ sparse.csr_matrix(x) for x in
+                                    [self._intensities, other._intensities] ])
+        else:
+            new_i = ArrayBlocks([self._intensities, other._intensities])
+        return Shotset(new_i, self.detector, self.mask,
+                       memory_budget=self.memory_budget)
+
+
+    @property
+    def average_intensity(self):
+        total = np.zeros(self.num_pixels)
+        for slc, chunk in self._iter_chunks():
+            total += np.asarray(chunk.sum(0, dtype=np.float64)).flatten()
+        return total / float(self.num_shots) # average over shots
+
+
+    def statistics(self):
+        """
+        Compute per-pixel statistics (mean, variance, min, max) across all
+        shots, in a single pass over the data. Masked pixels are excluded.
+
+        Returns
+        -------
+        stats : odin.xray.PixelStatistics
+            An accumulator holding the statistics. More shots can be added to
+            it later, or it can be merged with others.
+        """
+        stats = PixelStatistics(self.num_pixels)
+        for slc, chunk in self._iter_chunks():
+            stats.add(_dense(chunk), mask=self.mask)
+        return stats
+
+
+    def shot_quality(self, q_spacing=0.05, hit_threshold=0.0, saturation=None,
+                     profiles=True):
+        """
+        Compute per-shot quality metrics, for rejecting misses, saturated
+        frames and detector glitches. Masked pixels are excluded. All metrics
+        are computed in a single pass over the data.
+
+        Optional Parameters
+        -------------------
+        q_spacing : float
+            The |q| resolution of the intensity profiles used to compute the
+            `profile_deviation`.
+
+        hit_threshold : float
+            Pixels brighter than this count as "lit" for the `hit_score`.
+
+        saturation : float
+            The value at which a pixel is saturated. Defaults to the largest
+            value of the intensity dtype for integer data; for floating point
+            data, no pixels are considered saturated by default.
+
+        profiles : bool
+            Whether to compute the `profile_deviation`, which azimuthally
+            integrates every shot. If False, it is left out of `quality`.
+
+        Returns
+        -------
+        quality : dict
+            A dictionary of (num_shots,) arrays, with keys
+
+              'intensity'          : the integrated intensity of each shot
+              'hit_score'          : the fraction of pixels above `hit_threshold`
+              'saturated_fraction' : the fraction of pixels at `saturation`
+              'profile_deviation'  : how far the shape of each shot's intensity
+                                     profile is from the median shot, as the
+                                     root-mean-square over |q| of a robust
+                                     (median absolute deviation) z-score --
+                                     about 1 for typical shots, independent
+                                     of the number of |q| bins
+                                     (only if `profiles` is True)
+
+        See Also
+        --------
+        screen
+        """
+
+        if saturation == None and np.issubdtype(self.dtype, np.integer):
+            saturation = np.iinfo(self.dtype).max
+
+        if self.mask == None:
+            weights = np.ones(self.num_pixels)
+        else:
+            weights = self.mask.astype(np.float64)
+        num_kept = weights.sum()
+
+        if profiles:
+            q_vals, integrator = self.detector.azimuthal_integrator(q_spacing,
+                                                                    mask=self.mask)
+            profile = np.zeros((self.num_shots, len(q_vals)))
+
+        quality = {}
+        for key in ['intensity', 'hit_score', 'saturated_fraction']:
+            quality[key] = np.zeros(self.num_shots)
+
+        for slc, chunk in self._iter_chunks():
+            quality['intensity'][slc] = _dense(chunk.dot(weights)).flatten()
+            lit = (chunk > hit_threshold).astype(np.float64)
+            quality['hit_score'][slc] = _dense(lit.dot(weights)).flatten() / num_kept
+            if saturation != None:
+                sat = (chunk >= saturation).astype(np.float64)
+                quality['saturated_fraction'][slc] = \
+                    _dense(sat.dot(weights)).flatten() / num_kept
+            if profiles:
+                profile[slc] = _dense(integrator.dot(chunk.T.astype(np.float64))).T
+
+        if not profiles:
+            return quality
+
+        # compare the *shape* of each profile to the median profile
+        scale = profile.mean(1)
+        empty = (scale <= 0.0)
+        scale[empty] = 1.0
+        profile /= scale[:,None]
+
+        median = np.median(profile, axis=0)
+        mad = 1.4826 * np.median(np.abs(profile - median), axis=0)
+        spread = (mad > 0.0)
+
+        # the RMS, not the max, over |q| -- the max of many noisy z-scores
+        # grows with the number of bins, even for clean data
+        deviation = np.zeros(self.num_shots)
+        if np.any(spread):
+            z = (profile[:,spread] - median[spread]) / mad[spread]
+            deviation = np.sqrt(np.mean(z**2, axis=1))
+        deviation[empty] = np.inf
+        quality['profile_deviation'] = deviation
+
+        return quality
+
+
+    def screen(self, min_intensity=None, max_intensity=None, min_hit_score=None,
+               max_saturated_fraction=None, max_profile_deviation=None,
+               q_spacing=0.05, hit_threshold=0.0, saturation=None):
+        """
+        Screen the shotset for bad shots, returning the indices of those that
+        pass all the requested cuts. Pass the result as `shots` to
+        `to_rings`, `interpolate_to_polar` or `rebin_to_polar` to convert only
+        the accepted shots.
+
+        Optional Parameters
+        -------------------
+        min_intensity, max_intensity : float
+            Bounds on the integrated intensity of each shot.
+
+        min_hit_score : float
+            The minimum fraction of pixels above `hit_threshold`. Rejects
+            misses.
+
+        max_saturated_fraction : float
+            The maximum fraction of saturated pixels.
+
+        max_profile_deviation : float
+            The maximum RMS robust z-score of the shot's intensity profile
+            with respect to the median shot (see `shot_quality`). Rejects
+            glitches and outliers; typical shots score about 1, so a value of
+            about 5 is a reasonable starting point. The intensity profiles
+            are only computed if this cut is requested.
+
+        q_spacing, hit_threshold, saturation : float
+            Passed to `shot_quality`.
+
+        Returns
+        -------
+        accepted : ndarray, int
+            The (sorted) indices of the shots that passed.
+
+        See Also
+        --------
+        shot_quality
+        """
+
+        quality = self.shot_quality(q_spacing=q_spacing,
+                                    hit_threshold=hit_threshold,
+                                    saturation=saturation,
+                                    profiles=(max_profile_deviation != None))
+
+        cuts = [('intensity', min_intensity, np.greater_equal),
+                ('intensity', max_intensity, np.less_equal),
+                ('hit_score', min_hit_score, np.greater_equal),
+                ('saturated_fraction', max_saturated_fraction, np.less_equal),
+                ('profile_deviation', max_profile_deviation, np.less_equal)]
+
+        keep = np.ones(self.num_shots, dtype=np.bool)
+        for key, threshold, op in cuts:
+            if threshold != None:
+                passed = op(quality[key], threshold)
+                logger.debug('%s cut rejects %d shots' % (key, np.sum(~passed)))
+                keep *= passed
+
+        accepted = np.where(keep)[0]
+        logger.info('Screening accepted %d of %d shots' % (len(accepted),
+                                                           self.num_shots))
+
+        return accepted
+
+
+    def correct(self, dark=None, gain=None, polarization=None,
+                solid_angle=False):
+        """
+        Apply per-pixel corrections to every shot: subtract a dark image, then
+        divide by the pixel gain, polarization factor and relative solid
+        angle. The multiplicative corrections are combined into a single map
+        (cached on the detector, see Detector.correction_map), and everything
+        is applied in one pass over the data.
+
+        In-memory floating point intensities are corrected in place (so the
+        array the shotset was built from is modified). Integer intensities are
+        first converted to floating point. Intensities stored on disk are never
+        modified -- instead, the correction is applied to each block of shots
+        as it is read.
+
+        Optional Parameters
+        -------------------
+        dark : ndarray, float
+            A `num_pixels` dark (background) image to subtract.
+
+        gain : ndarray, float
+            The gain of each pixel. Pixels with zero gain are set to zero.
+
+        polarization : float
+            If passed, correct for polarization, with this fraction of the beam
+            polarization out of the synchrotron plane.
+
+        solid_angle : bool
+            If True, correct for the solid angle subtended by each pixel.
+
+        See Also
+        --------
+        Detector.correction_map
+        """
+
+        if self._correction != None:
+            raise RuntimeError('Shotset has already been corrected')
+
+        factor = self.detector.correction_map(polarization=polarization,
+                                              solid_angle=solid_angle,
+                                              gain=gain)
+        if dark != None:
+            dark = np.asarray(dark, dtype=np.float64).flatten()
+            if len(dark) != self.num_pixels:
+                raise ValueError('`dark` must be a len `num_pixels` array')
+
+        if self.on_disk:
+            self._correction = (factor, dark)
+
+        elif isinstance(self._intensities, ArrayBlocks):
+            blocks = [ _apply_correction(np.asarray(b), factor, dark) for b \
+                       in self._intensities._blocks ]
+            self._intensities = ArrayBlocks(blocks)
+
+        elif self.is_sparse:
+            self._intensities = _apply_correction(self._intensities, factor, dark)
+
+        else:
+            self._intensities = _apply_correction(self._intensities, factor, dark)
+
+        return
+
+
+    def _corrected(self, x):
+        """
+        Apply any correction pending for on-disk data to the block `x`, which
+        has been read into memory.
+        """
+        if self._correction == None:
+            return x
+        if not x.flags.owndata:
+            x = np.array(x)
+        return _apply_correction(x, *self._correction)
+
+
+    @staticmethod
+    def num_phi_to_values(num_phi):
+        """
+        Converts `phi_spacing` to the explicit values, all in RADIANS.
+        """
+        phi_values = np.arange(0, 2.0*np.pi, 2.0*np.pi/float(num_phi))
+        return phi_values
+
+
+    @staticmethod
+    def num_phi_to_spacing(num_phi):
+        return 2.0*np.pi / float(num_phi)
+
+
+    def assemble_image(self, shot_index=None, num_x=None, num_y=None,
+                       binning=1):
+        """
+        Assembles the Shot object into a real-space image.
+
+        Parameters
+        ----------
+        shot_index : int or list of ints
+            The shot inside the Shotset to assemble. If `None`, will assemble
+            an average image. If a list of indices (or slice), will assemble
+            each of those shots.
+
+        num_x,num_y : int
+            The number of pixels in the x/y direction that will comprise the final
+            grid.
+
+        binning : int
+            Downsample the default image by this factor in each direction, by
+            averaging. Useful for fast previews.
+
+        Returns
+        -------
+        grid_z : ndarray, float
+            A 2d array representing the image one would see when viewing the
+            shot in real space. E.g., to visualize w/matplotlib:
+
+            >>> imshow(grid_z.T)
+            >>> show()
+            ...
+
+            If multiple shots are requested, a 3d array whose first dimension
+            indexes shots.
+
+        See Also
+        --------
+        Detector.image_assembler
+        """
+
+        assembler, shape = self.detector.image_assembler(num_x=num_x,
+                                                         num_y=num_y,
+                                                         binning=binning)
+
+        if shot_index == None:
+            grid_z = assembler.dot(self.average_intensity).reshape(shape)
+        elif type(shot_index) in [int, np.int, np.int32, np.int64]:
+            inten = _dense(self._intensities[shot_index,:]).flatten()
+            grid_z = assembler.dot(self._corrected(inten)).reshape(shape)
+        else:
+            if self.is_sparse:
+                inten = _dense(self._intensities[shot_index])
+            elif type(shot_index) == slice:
+                inten = np.asarray(self._intensities[shot_index])
+            else:
+                inten = _read_rows(self._intensities, shot_index)
+            inten = self._corrected(inten)
+            grid_z = assembler.dot(inten.T).T.reshape((inten.shape[0],) + shape)
+
+        return grid_z
+
+
+    def polar_grid(self, q_values, num_phi):
+        """
+        Return the pixels that comprise the polar grid in (q, phi) space.
+        """
+
+        phi_values = self.num_phi_to_values(num_phi)
+        num_q = len(q_values)
+
+        polar_grid = np.zeros((num_q * num_phi, 2))
+        polar_grid[:,0] = np.repeat(q_values, num_phi)
+        polar_grid[:,1] = np.tile(phi_values, num_q)
+
+        return polar_grid
+
+
+    def polar_grid_as_cart(self, q_values, num_phi):
+        """
+        Returns the pixels that comprise the polar grid in q-cartesian space,
+        (q_x, q_y, q_z)
+        """
+
+        phi_values = self.num_phi_to_values(num_phi)
+        num_q = len(q_values)
+
+        pg_real = np.zeros((num_q * num_phi, 3))
+        phis = np.tile(phi_values, num_q)
+        pg_real[:,0] = np.repeat(q_values, num_phi) * np.cos( phis )
+        pg_real[:,1] = np.repeat(q_values, num_phi) * np.sin( phis )
+
+        return pg_real
+
+
+    def interpolate_to_polar(self, q_values=None, num_phi=360, q_spacing=0.02,
+                             shots=None):
+        """
+        Interpolate our cartesian-based measurements into a polar coordiante
+        system.
+
+        Parameters
+        ----------
+        q_values : ndarray OR list OF floats
+            If supplied, the interpolation will only be performed at these
+            values of |q|, and the `q_spacing` parameter will be ignored.
+
+        num_phi : int
+            The number of equally-spaced points around the azimuth to
+            interpolate (e.g. `num_phi`=360 means points at 1 deg spacing).
+
+        q_spacing : float
+            The q-vector spacing, in inverse angstroms.
+
+        shots : ndarray, int
+            Interpolate only these shots, e.g. those accepted by `screen`.
+
+        Returns
+        -------
+        interpolated_intensities : ndarray, float
+            The interpolated values. A three-D array, (shots, q_values, phis)
+
+        polar_mask : ndarray, bool
+            A mask of ones and zeros. Ones are kept, zeros masked. Shape and
+            pixels correspond to `interpolated_intensities`.
+        """
+
+        # compute q_values if need be
+        if q_values != None:
+            q_values = np.array(q_values)
+        else:
+            q_min     = q_spacing
+            q_max     = self.detector.q_max
+            q_values  = np.arange(q_min, q_max, q_spacing)
+
+        # out-of-core and sparse shotsets, and subsets of shots, are
+        # interpolated one block of shots at a time
+        if self.on_disk or self.is_sparse or (shots != None):
+            num_shots = self.num_shots if shots == None else len(shots)
+            polar_intensities = np.zeros((num_shots, len(q_values), num_phi),
+                                         dtype=_compute_dtype(self.dtype))
+            polar_mask = None
+            for slc, chunk in self._iter_chunks(shots=shots):
+                block = Shotset(_dense(chunk), self.detector, self.mask)
+                pi, polar_mask = block.interpolate_to_polar(q_values, num_phi)
+                polar_intensities[slc] = pi
+            return polar_intensities, polar_mask
+
+
+        # check to see what method we want to use to interpolate. Here,
+        # `unstructured` is more general, but slower; implicit/structured assume
+        # the detectors are grids, and are therefore faster but specific
+
+        if self.detector.xyz_type == 'explicit':
+            polar_intensities, polar_mask = self._explicit_interpolation(q_values, num_phi)
+        elif self.detector.xyz_type == 'implicit':
+            polar_intensities, polar_mask = self._implicit_interpolation(q_values, num_phi)
+        else:
+            raise RuntimeError('Invalid detector passed to Shot(), must be of '
+                               'xyz_type {explicit, implicit}')
+
+        return polar_intensities, polar_mask
+
+
+    def _implicit_interpolation(self, q_values, num_phi):
+        """
+        Interpolate onto a polar grid from an `implicit` detector geometry.
+
+        This detector geometry is specified by the x and y pixel spacing,
+        the number of pixels in the x/y direction, and the top-left corner
+        position.
+
+        Notes
+        -----
+        --  The interpolation is performed in real space in basis vector (s/f)
+            units
+        --  The returned polar intensities are flattened, but each grid has data
+            laid out as (q_values [slow], phi [fast])
+        """
+
+        # initialize output space for the polar data and mask
+        num_q = len(q_values)
+        dtype = _compute_dtype(self.dtype)
+        polar_intensities = np.zeros((self.num_shots, num_q, num_phi), dtype=dtype)
+        polar_mask        = np.zeros((num_q * num_phi), dtype=np.bool) # reshaped later
+        plan              = self.detector._interpolation_plan(q_values, num_phi)
+
+
+        # --- loop over all the arrays that comprise the detector ---
+        #     use grid interpolation on each
+
+        int_start = 0 # start of intensity array correpsonding to `grid`
+        int_end   = 0 # end of intensity array correpsonding to `grid`
+
+        for g in range(self.detector._basis_grid.num_grids):
+
+            p, s, f, size = self.detector._basis_grid.get_grid(g)
+
+            # compute how many pixels this grid has
+            n_int = int( np.product(size) )
+            int_end += n_int
+            
+            assert not int_end > self.num_pixels
+
+            # where the scattering vectors intersect the detector
+            pix_n, intersect = plan[g]
+
+            if np.sum(intersect) == 0:
+                logger.debug('Detector array (%d) had no pixels inside the '
+                'interpolation area!' % g)
+                int_start += n_int # increment
+                continue
+
+            # --- loop over shots
+            for i in range(self.num_shots):
+
+                # interpolate onto the polar grid & update the inverse mask
+                # --> perform the interpolation in pixel units, and then convert
+                #     evaluated values to pixel units before evalutating
+
+                # corner: (0,0); x/y size: 1.0; x is fast, y slow
+                shot_pi = np.zeros(num_q * num_phi, dtype=dtype)
+                interp = Bcinterp(self.intensities[i,int_start:int_end],
+                                  1.0, 1.0, size[1], size[0], 0.0, 0.0)
+
+                shot_pi[intersect] = interp.evaluate(pix_n[:,1], pix_n[:,0])
+                polar_intensities[i,:,:] += shot_pi.reshape(num_q, num_phi)
+                
+
+            # unmask points that we have data for
+            polar_mask[intersect] = np.bool(True)
+
+            # next, mask any points that should be masked by the real mask
+            if self.mask == None:
+                pass # if we have no work to do, skip this step...
+            else:
+
+                # to get the bicubic interpolation right, need to mask 16-px box
+                # around any masked pixel. To do this, loop over masked px and
+                # mask any polar pixel within 2-pixel units in either x or y dim
+
+                assert self.mask.dtype == np.bool
+                sub_mask = self.mask[int_start:int_end].reshape(size)
+                sixteen_mask = filters.minimum_filter(sub_mask, size=(4,4),
+                                                      mode='nearest')
+                assert sixteen_mask.dtype == np.bool
+                
+                # copy the mask values from in sixteen_mask -- which is expanded
+                # from the original mask to include an area of 16 px around each
+                # originally masked px -- into the polar mask. False is masked.
+                mp = np.floor(pix_n).astype(np.int)
+                polar_mask[intersect] = sixteen_mask[mp[:,0],mp[:,1]]
+
+            # increment index for self.intensities -- the real/measured intst.
+            int_start += n_int
+
+        polar_mask = polar_mask.reshape(num_q, num_phi)
+
+        return polar_intensities, polar_mask
+
+
+    def _explicit_interpolation(self, q_values, num_phi):
+        """
+        Perform an interpolation to polar coordinates assuming that the detector
+        pixels do not form a rectangular grid.
+
+        NOTE: The interpolation is performed in polar momentum (q) space.
+        """
+
+        # initialize output space for the polar data and mask
+        num_q = len(q_values)
+        polar_intensities = np.zeros((self.num_shots, num_q, num_phi),
+                                     dtype=_compute_dtype(self.dtype))
+        polar_mask        = np.zeros(num_q * num_phi, dtype=np.bool)
+        xy = self.detector.recpolar[:,[0,2]]
+
+        # because we're using a "square" interplation method, wrap around one
+        # set of polar coordinates to capture the periodic nature of polar coords
+        add = ( xy[:,1] == xy[:,1].min() )
+        xy_add = xy[add]
+        xy_add[:,1] += 2.0 * np.pi
+        aug_xy = np.concatenate(( xy, xy_add ))
+
+        if self.mask != None:
+            aug_mask = np.concatenate(( self.mask, self.mask[add] ))
+        else:
+            # slice all
+            aug_mask = slice(0, self.detector.num_pixels + len(add))
+
+        for i in range(self.num_shots):
+
+            aug_int = np.concatenate(( self.intensities[i,:],
+                                       self.intensities[i,add] ))
+
+            # do the interpolation
+            z_interp = interpolate.griddata( aug_xy[aug_mask], aug_int[aug_mask],
+                                             self.polar_grid(q_values, num_phi),
+                                             method='linear', fill_value=np.nan)
+
+            polar_intensities[i,:,:] = z_interp.reshape(num_q, num_phi)
+
+            # mask missing pixels (outside convex hull)
+            nans = np.isnan(z_interp)
+            polar_intensities[i,nans.reshape(num_q, num_phi)] = 0.0
+            polar_mask[np.logical_not(nans)] = np.bool(True)
+
+        polar_mask = polar_mask.reshape(num_q, num_phi)
+
+        return polar_intensities, polar_mask
+
+
+    def intensity_profile(self, q_spacing=0.05, per_shot=False,
+                          solid_angle=False):
+        """
+        Averages over the azimuth phi to obtain an intensity profile. Masked
+        pixels are excluded from the average.
+
+        Optional Parameters
+        -------------------
+        q_spacing : float
+            The resolution of the |q|-axis
+
+        per_shot : bool
+            If True, return a separate profile for each shot, rather than the
+            profile of `average_intensity`.
+
+        solid_angle : bool
+            If True, correct each pixel's intensity for the solid angle it
+            subtends before averaging. See Detector.solid_angle.
+
+        Returns
+        -------
+        intensity_profile : ndarray, float
+            An n x 2 array, where the first dimension is the magnitude |q| and
+            the second is the average intensity at that point < I(|q|) >_phi.
+
+        OR, if `per_shot` is True,
+
+        q_values : ndarray, float
+            The magnitudes |q| of the n bins.
+
+        profiles : ndarray, float
+            An (n_shots, n) array of the intensity profile of each shot.
+
+        See Also
+        --------
+        Detector.azimuthal_integrator
+        """
+
+        q_vals, integrator = self.detector.azimuthal_integrator(q_spacing,
+                                                   mask=self.mask,
+                                                   solid_angle=solid_angle)
+
+        if per_shot:
+            dtype = _compute_dtype(self.dtype)
+            integrator = integrator.astype(dtype)
+            profiles = np.zeros((self.num_shots, len(q_vals)), dtype=dtype)
+            for slc, chunk in self._iter_chunks():
+                profiles[slc] = _dense(integrator.dot(chunk.T.astype(dtype))).T
+            return q_vals, profiles
+
+        avg = integrator.dot(self.average_intensity)
+        intensity_profile = np.vstack( (q_vals, avg) ).T
+
+        return intensity_profile
+
+
+    def intensity_maxima(self, smooth_strength=10.0):
+        """
+        Find the positions where the intensity profile is maximized.
+
+        Parameters
+        ----------
+        smooth_strength : float
+            Controls the strength of the smoothing function used to make sure
+            that noise is not picked up as a local maxima. Increase this value
+            if you're picking up noise as maxima, decrease it if you're missing
+            maxima.
+
+        Returns
+        -------
+        maxima : list of floats
+            A list of the |q| positions where the intensity is maximized.
+        """
+
+        # first, smooth; then, find local maxima based on neighbors
+        intensity = self.intensity_profile()
+        m = maxima( smooth(intensity[:,1], beta=smooth_strength) )
+        return m
+
+
+    @classmethod
+    def simulate(cls, traj, detector, num_molecules, num_shots, traj_weights=None,
+                 finite_photon=False, force_no_gpu=False, device_id=0,
+                 dtype=np.float64, sparse_storage=False):
+        """
+        Simulate a scattering 'shot', i.e. one exposure of x-rays to a sample, and
+        return that as a Shot object (factory function).
+
+        Assumes we have a Boltzmann distribution of `num_molecules` identical
+        molecules (`trajectory`), exposed to a beam defined by `beam` and projected
+        onto `detector`.
+
+        Each conformation is randomly rotated before the scattering simulation is
+        performed. Atomic form factors from X, finite photon statistics, and the
+        dilute-sample (no scattering interference from adjacent molecules)
+        approximation are employed.
+
+        Parameters
+        ----------
+        traj : mdtraj.trajectory
+            A trajectory object that contains a set of structures, representing
+            the Boltzmann ensemble of the sample. If len(traj) == 1, then we assume
+            the sample consists of a single homogenous structure, replecated
+            `num_molecules` times.
+
+        detector : odin.xray.Detector
+            A detector object the shot will be projected onto.
+
+        num_molecules : int
+            The number of molecules estimated to be in the `beam`'s focus.
+
+        num_shots : int
+            The number of shots to simulate.
+
+        Optional Parameters
+        -------------------
+        traj_weights : ndarray, float
+            If `traj` contains many structures, an array that provides the Boltzmann
+            weight of each structure. Default: if traj_weights == None, weights
+            each structure equally.
+
+        finite_photon : bool
+            Use finite photon statistics in the simulation.
+
+        force_no_gpu : bool
+            Run the (slow) CPU version of this function.
+
+        device_id : int
+            The index of the GPU to run on.
+
+        dtype : np.dtype
+            The type to store the simulated intensities as.
+
+        sparse_storage : bool
+            Store the shots as a sparse matrix, so that memory use scales with
+            the number of photons rather than pixels. Use with `finite_photon`.
+
+        Returns
+        -------
+        shotset : odin.xray.Shotset
+            A Shotset instance, containing the simulated shots.
+        """
+
+        if sparse_storage:
+            I = []
+        else:
+            I = np.zeros((num_shots, detector.num_pixels), dtype=dtype)
+
+        for i in range(num_shots):
+            shot = scatter.simulate_shot(traj, num_molecules, detector,
+                                         traj_weights=traj_weights,
+                                         finite_photon=finite_photon,
+                                         force_no_gpu=force_no_gpu,
+                                         device_id=device_id)
+            if sparse_storage:
+                I.append( sparse.csr_matrix(shot.astype(dtype)[None,:]) )
+            else:
+                I[i,:] = shot
+
+        if sparse_storage:
+            I = sparse.vstack(I)
+
+        ss = cls(I, detector)
+
+        return ss
+
+
+    def rebin_to_polar(self, q_values, num_phi=360, q_width=None, shots=None):
+        """
+        Rebin the intensities onto a polar grid, splitting each pixel's area
+        across the (|q|, phi) bins it overlaps. An alternative to
+        `interpolate_to_polar` -- see Detector.polar_rebinner.
+
+        Parameters
+        ----------
+        q_values : ndarray/list, float
+            The values of |q| at the center of each ring (in Ang^{-1}).
+
+        Optional Parameters
+        -------------------
+        num_phi : int
+            The number of equally spaced bins around the azimuth.
+
+        q_width : float
+            The radial width of each ring. Defaults to the smallest spacing
+            between `q_values`.
+
+        shots : ndarray, int
+            Rebin only these shots, e.g. those accepted by `screen`.
+
+        Returns
+        -------
+        polar_intensities : ndarray, float
+            An array of the intensities I(|q|, phi), shape
+            (num_shots, num_q, num_phi).
+
+        coverage : ndarray, float
+            The (fractional) number of pixels in each polar bin, shape
+            (num_q, num_phi). Zero where there are no data.
+        """
+
+        rebinner, coverage = self.detector.polar_rebinner(q_values, num_phi,
+                                                          q_width=q_width,
+                                                          mask=self.mask)
+
+        # single precision data are rebinned in single precision
+        dtype = _compute_dtype(self.dtype)
+        rebinner = rebinner.astype(dtype)
+
+        num_shots = self.num_shots if shots == None else len(shots)
+        polar_intensities = np.zeros((num_shots, len(q_values), num_phi),
+                                     dtype=dtype)
+        for slc, chunk in self._iter_chunks(shots=shots):
+            pi = _dense(rebinner.dot(chunk.T.astype(dtype))).T
+            polar_intensities[slc] = pi.reshape(-1, len(q_values), num_phi)
+
+        return polar_intensities, coverage
+
+
+    def to_rings(self, q_values, num_phi=360, method='interpolate', q_width=None,
+                 shots=None, n_workers=1):
+        """
+        Convert the shot to an xray.Rings object, for computing correlation
+        functions and other properties in polar space.
+
+        This automatically maps the dataset onto a polar grid and then
+        converts those polar values into a class that facilitates computation
+        in that space. See odin.xray.Rings for more info.
+
+        Parameters
+        ----------
+        q_values : ndarray/list, float
+            The values of |q| to extract rings at (in Ang^{-1}).
+
+        num_phi : int
+            The number of equally spaced points around the azimuth to
+            interpolate onto (e.g. `num_phi`=360 means 1 deg spacing).
+
+        Optional Parameters
+        -------------------
+        method : str
+            Either 'interpolate', to bicubically interpolate onto the polar
+            grid, or 'rebin', to split pixels across polar bins. Rebinning uses
+            all the data and is faster for many shots.
+
+        q_width : float
+            The radial width of each ring (method='rebin' only). Defaults to
+            the smallest spacing between `q_values`.
+
+        shots : ndarray, int
+            Convert only these shots, e.g. those accepted by `screen`. The
+            rejected shots are never read or processed.
+
+        n_workers : int
+            The number of processes to convert shots with. The shots are split
+            evenly between the workers, which write straight into a shared
+            output array, and together stay within `memory_budget`. Results
+            are identical to the serial conversion.
+        """
+
+        num_shots = self.num_shots if shots == None else len(shots)
+        logger.info('Converting %d shots to polar space (Rings)' % num_shots)
+
+        if method not in ['interpolate', 'rebin']:
+            raise ValueError("`method` must be one of {'interpolate', 'rebin'}")
+
+        if n_workers > 1:
+            pi, pm = self._parallel_to_polar(q_values, num_phi, method,
+                                             q_width=q_width, shots=shots,
+                                             n_workers=n_workers)
+        elif method == 'interpolate':
+            pi, pm = self.interpolate_to_polar(q_values=q_values, num_phi=num_phi,
+                                               shots=shots)
+        elif method == 'rebin':
+            pi, coverage = self.rebin_to_polar(q_values, num_phi=num_phi,
+                                               q_width=q_width, shots=shots)
+            pm = (coverage > 0.0)
+
+        r = Rings(q_values, pi, self.detector.k, pm,
+                  memory_budget=self.memory_budget)
+
+        return r
+
+
+    def _parallel_to_polar(self, q_values, num_phi, method, q_width=None,
+                           shots=None, n_workers=2):
+        """
+        Map shots onto a polar grid using a pool of forked worker processes.
+
+        The polar operator (or interpolation plan) is built once, here, and
+        cached on the detector -- the workers inherit it, along with the
+        shotset, when they are forked, so nothing is pickled. Each worker
+        converts a contiguous range of shots, one block at a time, and writes
+        the result into an output array in shared memory. The memory budget
+        is split evenly between the workers.
 
-        if (num_x == None) or (num_y == None):
-            # todo : better performance if needed (implicit detector)
-            num_x = len(self.detector.xyz[:,0])
-            num_y = len(self.detector.xyz[:,1])
+        Returns
+        -------
+        polar_intensities : ndarray, float
+            The (num_shots, num_q, num_phi) polar intensities.
 
-        points = self.detector.xyz[:,:2] # ignore z-comp. of detector
+        polar_mask : ndarray, bool
+            The (num_q, num_phi) polar mask -- True where there are data.
+        """
 
-        x = np.linspace(points[:,0].min(), points[:,0].max(), num_x)
-        y = np.linspace(points[:,1].min(), points[:,1].max(), num_y)
-        grid_x, grid_y = np.meshgrid(x,y)
+        q_values = np.array(q_values)
+        num_q = len(q_values)
 
-        grid_z = interpolate.griddata(points, inten,
-                                      (grid_x,grid_y), method='nearest',
-                                      fill_value=0.0)
+        if shots == None:
+            shots = np.arange(self.num_shots)
+        shots = np.array(shots, dtype=np.int).flatten()
+        num_shots = len(shots)
+        n_workers = max(1, min(int(n_workers), num_shots))
+
+        # build operators in the parent process, so workers share them
+        if method == 'rebin':
+            rebinner, coverage = self.detector.polar_rebinner(q_values, num_phi,
+                                                              q_width=q_width,
+                                                              mask=self.mask)
+        elif self.detector.xyz_type == 'implicit':
+            self.detector._interpolation_plan(q_values, num_phi)
+
+        dtype = np.dtype(_compute_dtype(self.dtype))
+        pi_buffer = multiprocessing.RawArray(dtype.char, num_shots * num_q * num_phi)
+        pm_buffer = multiprocessing.RawArray('b', n_workers * num_q * num_phi)
+
+        polar_intensities = np.frombuffer(pi_buffer, dtype=dtype)
+        polar_intensities = polar_intensities.reshape(num_shots, num_q, num_phi)
+        polar_masks = np.frombuffer(pm_buffer, dtype=np.int8)
+        polar_masks = polar_masks.reshape(n_workers, num_q, num_phi)
+
+        bounds = np.linspace(0, num_shots, n_workers + 1).astype(np.int)
+
+        # the workers share the memory budget
+        block = max(1, self._chunk_size() // n_workers)
+
+        def work(w):
+            for start in range(bounds[w], bounds[w+1], block):
+                stop = min(start + block, bounds[w+1])
+                if method == 'rebin':
+                    pi, pm = self.rebin_to_polar(q_values, num_phi=num_phi,
+                                                 q_width=q_width,
+                                                 shots=shots[start:stop])
+                else:
+                    pi, pm = self.interpolate_to_polar(q_values, num_phi=num_phi,
+                                                       shots=shots[start:stop])
+                    polar_masks[w] |= pm
+                polar_intensities[start:stop] = pi
+            return
+
+        workers = [ multiprocessing.Process(target=work, args=(w,)) for w \
+                    in range(n_workers) ]
+        for p in workers:
+            p.start()
+        for p in workers:
+            p.join()
+
+        failed = [ w for w, p in enumerate(workers) if not p.exitcode == 0 ]
+        if len(failed) > 0:
+            raise RuntimeError('Polar conversion failed in worker(s): %s' % failed)
+
+        if method == 'rebin':
+            polar_mask = (coverage > 0.0)
+        else:
+            polar_mask = polar_masks.any(0)
 
-        return grid_z
+        return polar_intensities, polar_mask
 
 
-    def polar_grid(self, q_values, num_phi):
-        """
-        Return the pixels that comprise the polar grid in (q, phi) space.
+    def photon_correlation(self, q_values, num_phi=360, q_width=None,
+                           self_pairs=False, shots=None):
         """
+        Compute the mean intra-shot angular correlation between every pair of
+        rings directly from the photons on each shot, without going through a
+        dense polar grid. Intended for very sparse (low count) shots, where
+        the cost, O(photons^2) per shot, is far below that of interpolating &
+        FFT-correlating num_q x num_phi points per shot.
 
-        phi_values = self.num_phi_to_values(num_phi)
-        num_q = len(q_values)
+        Every non-zero pixel is a photon (or, for counts > 1, that many
+        photons) at the polar bin containing the pixel center (see
+        Detector.photon_binner). Pairs are histogrammed by (q1, q2, delta-phi)
+        in native code, and normalized by the pair histogram expected for
+        photons spread uniformly over the unmasked pixels of each ring.
 
-        polar_grid = np.zeros((num_q * num_phi, 2))
-        polar_grid[:,0] = np.repeat(q_values, num_phi)
-        polar_grid[:,1] = np.tile(phi_values, num_q)
+        Parameters
+        ----------
+        q_values : ndarray/list, float
+            The values of |q| at the center of each ring (in Ang^{-1}).
 
-        return polar_grid
+        Optional Parameters
+        -------------------
+        num_phi : int
+            The number of equally spaced bins around the azimuth.
 
+        q_width : float
+            The radial width of each ring. Defaults to the smallest spacing
+            between `q_values`.
 
-    def polar_grid_as_cart(self, q_values, num_phi):
-        """
-        Returns the pixels that comprise the polar grid in q-cartesian space,
-        (q_x, q_y, q_z)
+        self_pairs : bool
+            Pair each photon with itself. This adds the shot noise at zero
+            lag that a dense correlation of the photon counts includes.
+
+        shots : ndarray, int
+            Correlate only these shots.
+
+        Returns
+        -------
+        corr : ndarray, float
+            A (num_q, num_q, num_phi) array, where corr[i,j] is the correlation
+            between rings q_values[i] and q_values[j] -- the same form as
+            Rings.correlate_all, i.e. < dI(q1, phi) dI(q2, phi - delta) > /
+            (< I(q1) > < I(q2) >).
         """
 
-        phi_values = self.num_phi_to_values(num_phi)
+        q_values = np.array(q_values, dtype=np.float).flatten()
         num_q = len(q_values)
 
-        pg_real = np.zeros((num_q * num_phi, 3))
-        phis = np.tile(phi_values, num_q)
-        pg_real[:,0] = np.repeat(q_values, num_phi) * np.cos( phis )
-        pg_real[:,1] = np.repeat(q_values, num_phi) * np.sin( phis )
+        q_bin, phi_bin, coverage = self.detector.photon_binner(q_values, num_phi,
+                                                               q_width=q_width,
+                                                               mask=self.mask)
+
+        hist  = np.zeros((num_q, num_q, num_phi))
+        count = np.zeros((num_q, num_q))
+
+        for slc, chunk in self._iter_chunks(shots=shots):
+            photons = sparse.csr_matrix(chunk)
+            num_shots = photons.shape[0]
+
+            # keep only photons that fall in a ring
+            keep = (photons.data > 0) & (q_bin[photons.indices] >= 0)
+            shot = np.repeat(np.arange(num_shots), np.diff(photons.indptr))
+            kept = np.bincount(shot[keep], minlength=num_shots)
+            shot_ptr = np.append(0, np.cumsum(kept))
+
+            pixels = photons.indices[keep]
+            h, c = photon_pairs(shot_ptr, q_bin[pixels], phi_bin[pixels],
+                                photons.data[keep], num_q, num_phi,
+                                self_pairs=self_pairs)
+            hist  += h
+            count += c
+
+        # the number of pixel pairs at each lag, and so the fraction of all
+        # pairs between the two rings expected for uniformly spread photons
+        C = np.fft.rfft(coverage, axis=-1)
+        pairs = np.fft.irfft(C[:,None,:] * np.conjugate(C[None,:,:]),
+                             n=num_phi, axis=-1)
+        pairs = np.round(pairs)
+        n_pixels = coverage.sum(axis=1)
+
+        # zero where either the data or the pixel pairs are missing
+        corr = np.zeros((num_q, num_q, num_phi))
+        good = (count[:,:,None] > 0) & (pairs > 0)
+        norm = count[:,:,None] * pairs / \
+               (n_pixels[:,None] * n_pixels[None,:])[:,:,None]
+        corr[good] = hist[good] / norm[good] - 1.0
 
-        return pg_real
+        return corr
 
 
-    def interpolate_to_polar(self, q_values=None, num_phi=360, q_spacing=0.02):
+    def photon_legendre_matrix(self, q_values, order, num_phi=360, q_width=None,
+                               even_only=False, shots=None):
         """
-        Interpolate our cartesian-based measurements into a polar coordiante
-        system.
+        Project the photon-pair correlations (see photon_correlation) onto a
+        set of Legendre polynomials, as Rings.legendre_matrix.
 
         Parameters
         ----------
-        q_values : ndarray OR list OF floats
-            If supplied, the interpolation will only be performed at these
-            values of |q|, and the `q_spacing` parameter will be ignored.
+        q_values : ndarray/list, float
+            The values of |q| at the center of each ring (in Ang^{-1}).
 
+        order : int
+            The order at which to truncate the polynomial expansion.
+
+        Optional Parameters
+        -------------------
         num_phi : int
-            The number of equally-spaced points around the azimuth to
-            interpolate (e.g. `num_phi`=360 means points at 1 deg spacing).
+            The number of equally spaced bins around the azimuth.
 
-        q_spacing : float
-            The q-vector spacing, in inverse angstroms.
+        q_width : float
+            The radial width of each ring.
+
+        even_only : bool
+            Fit only the even Legendre polynomials.
+
+        shots : ndarray, int
+            Correlate only these shots.
 
         Returns
         -------
-        interpolated_intensities : ndarray, float
-            The interpolated values. A three-D array, (shots, q_values, phis)
-
-        polar_mask : ndarray, bool
-            A mask of ones and zeros. Ones are kept, zeros masked. Shape and
-            pixels correspond to `interpolated_intensities`.
+        Cl : np.ndarray, float
+            A (order, num_q, num_q) array of the legendre coefficients.
         """
 
-        # compute q_values if need be
-        if q_values != None:
-            q_values = np.array(q_values)
-        else:
-            q_min     = q_spacing
-            q_max     = self.detector.q_max
-            q_values  = np.arange(q_min, q_max, q_spacing)
+        q_values = np.array(q_values, dtype=np.float).flatten()
+        corr = self.photon_correlation(q_values, num_phi=num_phi,
+                                       q_width=q_width, shots=shots)
 
+        return _legendre_matrix(corr, q_values, self.detector.k, order,
+                                even_only=even_only)
 
-        # check to see what method we want to use to interpolate. Here,
-        # `unstructured` is more general, but slower; implicit/structured assume
-        # the detectors are grids, and are therefore faster but specific
 
-        if self.detector.xyz_type == 'explicit':
-            polar_intensities, polar_mask = self._explicit_interpolation(q_values, num_phi)
-        elif self.detector.xyz_type == 'implicit':
-            polar_intensities, polar_mask = self._implicit_interpolation(q_values, num_phi)
-        else:
-            raise RuntimeError('Invalid detector passed to Shot(), must be of '
-                               'xyz_type {explicit, implicit}')
+    def save(self, filename, complib='blosc', complevel=5):
+        """
+        Writes the current Shotset data to disk.
 
-        return polar_intensities, polar_mask
+        The intensities are stored as a single (num_shots, num_pixels) array,
+        chunked by rows and compressed, so that individual shots can be read
+        back without loading the whole file.
+
+        Parameters
+        ----------
+        filename : str
+            The path to the shotset file to save.
 
+        Optional Parameters
+        -------------------
+        complib : str
+            The compression library to use, one of 'zlib', 'lzo', 'bzip2' or
+            'blosc'.
 
-    def _implicit_interpolation(self, q_values, num_phi):
+        complevel : int
+            The compression level, 0-9. Zero disables compression.
         """
-        Interpolate onto a polar grid from an `implicit` detector geometry.
 
-        This detector geometry is specified by the x and y pixel spacing,
-        the number of pixels in the x/y direction, and the top-left corner
-        position.
+        if not filename.endswith('.shot'):
+            filename += '.shot'
 
-        Notes
-        -----
-        --  The interpolation is performed in real space in basis vector (s/f)
-            units
-        --  The returned polar intensities are flattened, but each grid has data
-            laid out as (q_values [slow], phi [fast])
-        """
+        for b in _disk_blocks(self._intensities):
+            if os.path.abspath(filename) == os.path.abspath(b.filename):
+                raise IOError('Cannot overwrite the file backing an on-disk '
+                              'shotset: %s' % filename)
+        self.detector._detach(filename)
 
-        # initialize output space for the polar data and mask
-        num_q = len(q_values)
-        polar_intensities = np.zeros((self.num_shots, num_q, num_phi))
-        polar_mask        = np.zeros((num_q * num_phi), dtype=np.bool) # reshaped later
-        q_vectors         = _q_grid_as_xyz(q_values, num_phi, self.detector.k)
+        # if we don't have a mask, just save a single zero
+        if self.mask == None:
+            mask = np.array([0])
+        else:
+            mask = self.mask
 
+        h5 = tables.openFile(filename, mode='w')
 
-        # --- loop over all the arrays that comprise the detector ---
-        #     use grid interpolation on each
+        try:
+            h5.createArray('/', 'num_shots', np.array([self.num_shots]))
+            h5.createArray('/', 'mask', mask)
 
-        int_start = 0 # start of intensity array correpsonding to `grid`
-        int_end   = 0 # end of intensity array correpsonding to `grid`
+            filters = tables.Filters(complib=complib, complevel=complevel,
+                                     shuffle=True)
+            atom = tables.Atom.from_dtype(self.dtype)
 
-        for g in range(self.detector._basis_grid.num_grids):
+            if self.is_sparse:
+                self._save_sparse(h5, atom, filters)
+            else:
+                rows = _chunk_rows(self.num_pixels, self.dtype.itemsize)
+                ds = h5.createEArray('/', 'intensities', atom,
+                                     shape=(0, self.num_pixels), filters=filters,
+                                     chunkshape=(rows, self.num_pixels),
+                                     expectedrows=self.num_shots)
+                for slc, chunk in self._iter_chunks():
+                    ds.append(chunk)
 
-            p, s, f, size = self.detector._basis_grid.get_grid(g)
+        finally:
+            h5.close()
 
-            # compute how many pixels this grid has
-            n_int = int( np.product(size) )
-            int_end += n_int
-            
-            assert not int_end > self.num_pixels
+        self.detector._to_hdf(filename)
 
-            # compute where the scattering vectors intersect the detector
-            pix_n, intersect = self.detector._compute_intersections(q_vectors, g)
+        logger.info('Wrote %s to disk.' % filename)
 
-            if np.sum(intersect) == 0:
-                logger.debug('Detector array (%d) had no pixels inside the '
-                'interpolation area!' % g)
-                int_start += n_int # increment
-                continue
+        return
 
-            # --- loop over shots
-            for i in range(self.num_shots):
 
-                # interpolate onto the polar grid & update the inverse mask
-                # --> perform the interpolation in pixel units, and then convert
-                #     evaluated values to pixel units before evalutating
+    def _save_sparse(self, h5, atom, filters):
+        """
+        Write sparse intensities into the open file `h5`, as the three arrays
+        of a CSR matrix in the group /sparse_intensities.
+        """
 
-                # corner: (0,0); x/y size: 1.0; x is fast, y slow
-                shot_pi = np.zeros(num_q * num_phi)
-                interp = Bcinterp(self.intensities[i,int_start:int_end],
-                                  1.0, 1.0, size[1], size[0], 0.0, 0.0)
+        x = self._intensities
+        g = h5.createGroup('/', 'sparse_intensities')
+        g._v_attrs.shape = np.array(x.shape)
 
-                shot_pi[intersect] = interp.evaluate(pix_n[:,1], pix_n[:,0])
-                polar_intensities[i,:,:] += shot_pi.reshape(num_q, num_phi)
-                
+        for name, a, at in [('data', x.data, atom),
+                            ('indices', x.indices, tables.Int64Atom()),
+                            ('indptr', x.indptr, tables.Int64Atom())]:
+            ds = h5.createEArray(g, name, at, shape=(0,), filters=filters,
+                                 expectedrows=max(1, len(a)))
+            ds.append(a)
 
-            # unmask points that we have data for
-            polar_mask[intersect] = np.bool(True)
+        return
 
-            # next, mask any points that should be masked by the real mask
-            if self.mask == None:
-                pass # if we have no work to do, skip this step...
-            else:
 
-                # to get the bicubic interpolation right, need to mask 16-px box
-                # around any masked pixel. To do this, loop over masked px and
-                # mask any polar pixel within 2-pixel units in either x or y dim
+    @staticmethod
+    def _load_sparse(group, to_load=None):
+        """
+        Read sparse intensities written by `_save_sparse`, reading only the
+        rows in `to_load` (default: all).
+        """
 
-                assert self.mask.dtype == np.bool
-                sub_mask = self.mask[int_start:int_end].reshape(size)
-                sixteen_mask = filters.minimum_filter(sub_mask, size=(4,4),
-                                                      mode='nearest')
-                assert sixteen_mask.dtype == np.bool
-                
-                # copy the mask values from in sixteen_mask -- which is expanded
-                # from the original mask to include an area of 16 px around each
-                # originally masked px -- into the polar mask. False is masked.
-                mp = np.floor(pix_n).astype(np.int)
-                polar_mask[intersect] = sixteen_mask[mp[:,0],mp[:,1]]
+        num_shots, num_pixels = [ int(x) for x in group._v_attrs.shape ]
+        indptr = group.indptr.read()
 
-            # increment index for self.intensities -- the real/measured intst.
-            int_start += n_int
+        if to_load == None:
+            return sparse.csr_matrix((group.data.read(), group.indices.read(),
+                                      indptr), shape=(num_shots, num_pixels))
 
-        polar_mask = polar_mask.reshape(num_q, num_phi)
+        rows = []
+        for i in to_load:
+            a, b = indptr[i], indptr[i+1]
+            rows.append( sparse.csr_matrix((group.data[a:b], group.indices[a:b],
+                                            np.array([0, b - a])),
+                                           shape=(1, num_pixels)) )
 
-        return polar_intensities, polar_mask
+        return sparse.vstack(rows).tocsr()
 
 
-    def _explicit_interpolation(self, q_values, num_phi):
+    @classmethod
+    def load(cls, filename, to_load=None, in_memory=True, memory_budget=None):
         """
-        Perform an interpolation to polar coordinates assuming that the detector
-        pixels do not form a rectangular grid.
+        Loads the a Shotset from disk. Must be `.shot` or `.cxi` format.
 
-        NOTE: The interpolation is performed in polar momentum (q) space.
+        Parameters
+        ----------
+        filename : str
+            The path to the shotset file.
+
+        to_load : ndarray/list, ints
+            The indices of the shots in `filename` to load. Can be used to sub-
+            sample the shotset. Only these shots are read from disk.
+
+        in_memory : bool
+            If False, leave the intensities on disk and stream them through
+            memory as needed, so that shotsets larger than memory can be
+            analyzed. Ignored if `to_load` is passed, for sparse shotsets, and
+            for files in the legacy (one array per shot) layout.
+
+        memory_budget : int
+            The approximate number of bytes of intensities to hold in memory at
+            once when streaming over an on-disk shotset. See Shotset.
+
+        Returns
+        -------
+        shotset : odin.xray.Shotset
+            A shotset object
         """
 
-        # initialize output space for the polar data and mask
-        num_q = len(q_values)
-        polar_intensities = np.zeros((self.num_shots, num_q, num_phi))
-        polar_mask        = np.zeros(num_q * num_phi, dtype=np.bool)
-        xy = self.detector.recpolar[:,[0,2]]
 
-        # because we're using a "square" interplation method, wrap around one
-        # set of polar coordinates to capture the periodic nature of polar coords
-        add = ( xy[:,1] == xy[:,1].min() )
-        xy_add = xy[add]
-        xy_add[:,1] += 2.0 * np.pi
-        aug_xy = np.concatenate(( xy, xy_add ))
+        # load from a shot file
+        if filename.endswith('.shot'):
+
+            if to_load != None:
+                try:
+                    to_load = np.array(to_load).astype(np.int).flatten()
+                except:
+                    raise TypeError('`to_load` must be a ndarry/list of ints')
+
+            # a file of links to other shotset files (see Shotset.save_virtual)
+            sources = _read_sources(filename)
+            if sources != None:
+                ss = cls.load_many(sources, in_memory=((to_load == None) and
+                                                       in_memory),
+                                   memory_budget=memory_budget)
+                if to_load != None:
+                    ss = cls(_read_rows(ss._intensities, to_load), ss.detector,
+                             ss.mask, memory_budget=memory_budget)
+                return ss
+
+            d = Detector._from_hdf(filename)
+
+            h5 = tables.openFile(filename, mode='r')
+            try:
+                mask = h5.root.mask.read()
+
+                # sparse shots, stored as a CSR matrix
+                if '/sparse_intensities' in h5:
+                    intensities = cls._load_sparse(h5.root.sparse_intensities,
+                                                   to_load)
+
+                # current format -- one (num_shots, num_pixels) array
+                elif '/intensities' in h5:
+                    ds = h5.root.intensities
+                    if (to_load == None) and (not in_memory):
+                        intensities = DiskArray(filename, '/intensities')
+                    elif to_load == None:
+                        intensities = ds.read()
+                    else:
+                        intensities = _read_rows(ds, to_load)
+
+                # legacy format -- one array per shot
+                else:
+                    num_shots = int(h5.root.num_shots.read()[0])
+                    if to_load == None:
+                        to_load = range(num_shots)
+                    intensities = [ h5.getNode('/shot%d' % int(i)).read()
+                                    for i in to_load ]
+
+            finally:
+                h5.close()
+
+            # check for our flag that there is no mask
+            if np.all(mask == np.array([0])):
+                mask = None
+
+        elif filename.endswith('.cxi'):
+            raise NotImplementedError() # todo
 
-        if self.mask != None:
-            aug_mask = np.concatenate(( self.mask, self.mask[add] ))
         else:
-            # slice all
-            aug_mask = slice(0, self.detector.num_pixels + len(add))
+            raise ValueError('Must load a shotset file [.shot, .cxi]')
 
-        for i in range(self.num_shots):
 
-            aug_int = np.concatenate(( self.intensities[i,:],
-                                       self.intensities[i,add] ))
+        return cls(intensities, d, mask, memory_budget=memory_budget)
 
-            # do the interpolation
-            z_interp = interpolate.griddata( aug_xy[aug_mask], aug_int[aug_mask],
-                                             self.polar_grid(q_values, num_phi),
-                                             method='linear', fill_value=np.nan)
 
-            polar_intensities[i,:,:] = z_interp.reshape(num_q, num_phi)
+    @classmethod
+    def load_many(cls, filenames, in_memory=False, memory_budget=None):
+        """
+        Present many shotset files -- e.g. all the runs of an experiment -- as
+        a single Shotset, with the shots of each file in turn, without copying
+        them into one array. Every file must share the same detector and mask.
 
-            # mask missing pixels (outside convex hull)
-            nans = np.isnan(z_interp)
-            polar_intensities[i,nans.reshape(num_q, num_phi)] = 0.0
-            polar_mask[np.logical_not(nans)] = np.bool(True)
+        Parameters
+        ----------
+        filenames : list of str
+            The shotset files (.shot) to concatenate.
 
-        polar_mask = polar_mask.reshape(num_q, num_phi)
+        Optional Parameters
+        -------------------
+        in_memory : bool
+            If False (default), dense intensities are left on disk, and each
+            read is dispatched to the file(s) holding the shots asked for.
+            Sparse intensities are always read into memory, and if any file is
+            sparse, the dense files are read and converted to sparse too.
 
-        return polar_intensities, polar_mask
+        memory_budget : int
+            The approximate number of bytes of intensities to hold in memory at
+            once when streaming over an on-disk shotset. See Shotset.
+
+        Returns
+        -------
+        shotset : odin.xray.Shotset
+            The concatenated shotset.
+        """
+
+        if len(filenames) == 0:
+            raise ValueError('No files to load')
+
+        parts = [ cls.load(fn, in_memory=in_memory, memory_budget=memory_budget)
+                  for fn in filenames ]
+        first = parts[0]
+
+        for fn, ss in zip(filenames[1:], parts[1:]):
+            if not _same_detector(ss.detector, first.detector):
+                raise RuntimeError('%s has a different detector than %s'
+                                   % (fn, filenames[0]))
+            if not np.all(ss.mask == first.mask):
+                raise RuntimeError('%s has a different mask than %s'
+                                   % (fn, filenames[0]))
+
+        # if any file is sparse, so is the result -- dense files are then read
+        # and converted one block of shots at a time
+        if any([ ss.is_sparse for ss in parts ]):
+            blocks = []
+            for ss in parts:
+                if ss.is_sparse:
+                    blocks.append(ss._intensities)
+                else:
+                    blocks.extend([ sparse.csr_matrix(chunk) for slc, chunk
+                                    in ss._iter_chunks() ])
+            new_i = sparse.vstack(blocks).tocsr()
+        else:
+            new_i = ArrayBlocks([ ss._intensities for ss in parts ])
+
+        return cls(new_i, first.detector, first.mask,
+                   memory_budget=memory_budget)
 
 
-    def intensity_profile(self, q_spacing=0.05):
+    def save_virtual(self, filename):
+        """
+        Write a small shotset file that links to the files holding these
+        (on-disk) shots, rather than copying them. Loading it with
+        Shotset.load gives back the concatenated shotset.
+
+        The links are HDF5 external links to each file's intensities, so
+        other HDF5 tools can follow them too. (pytables, which ODIN uses,
+        cannot write HDF5 virtual datasets.)
+
+        Parameters
+        ----------
+        filename : str
+            The path to the shotset file to save.
         """
-        Averages over the azimuth phi to obtain an intensity profile.
 
-        Optional Parameters
-        -------------------
-        q_spacing : float
-            The resolution of the |q|-axis
+        if not filename.endswith('.shot'):
+            filename += '.shot'
 
-        Returns
-        -------
-        intensity_profile : ndarray, float
-            An n x 2 array, where the first dimension is the magnitude |q| and
-            the second is the average intensity at that point < I(|q|) >_phi.
-        """
+        if self._correction != None:
+            raise RuntimeError('cannot link to shots with corrections pending, '
+                               'save them with `save` instead')
+
+        if self.mask == None:
+            mask = np.array([0])
+        else:
+            mask = self.mask
 
-        q = self.detector.recpolar[:,0]
-        q_vals = np.arange(q_spacing, q.max(), q_spacing)
+        _write_sources(filename, self._intensities, mask=mask,
+                       num_shots=np.array([self.num_shots]))
+        self.detector._to_hdf(filename)
 
-        ind = np.digitize(q, q_vals)
+        logger.info('Wrote %s to disk.' % filename)
 
-        avg = np.zeros(len(q_vals))
-        for i in range(ind.max()):
-            x = (ind == i)
-            if np.sum(x) > 0:
-                avg[i] = np.mean( self.average_intensity[x] )
-            else:
-                avg[i] = 0.0
+        return
 
-        intensity_profile = np.vstack( (q_vals, avg) ).T
 
-        return intensity_profile
+class PixelStatistics(object):
+    """
+    Accumulates per-pixel statistics -- mean, variance, min and max -- over a
+    stream of shots, without keeping the shots in memory. Shots can be added
+    one or many at a time, and accumulators built separately (e.g. by
+    different workers) can be merged.
 
+    The mean and variance are updated using the numerically stable parallel
+    algorithm of Chan, Golub & LeVeque (a batched form of Welford's method).
+    """
 
-    def intensity_maxima(self, smooth_strength=10.0):
+    def __init__(self, num_pixels):
         """
-        Find the positions where the intensity profile is maximized.
+        Instantiate an empty accumulator.
 
         Parameters
         ----------
-        smooth_strength : float
-            Controls the strength of the smoothing function used to make sure
-            that noise is not picked up as a local maxima. Increase this value
-            if you're picking up noise as maxima, decrease it if you're missing
-            maxima.
-
-        Returns
-        -------
-        maxima : list of floats
-            A list of the |q| positions where the intensity is maximized.
+        num_pixels : int
+            The number of pixels in each shot.
         """
 
-        # first, smooth; then, find local maxima based on neighbors
-        intensity = self.intensity_profile()
-        m = maxima( smooth(intensity[:,1], beta=smooth_strength) )
+        self.num_pixels = int(num_pixels)
+
+        self.count = np.zeros(self.num_pixels, dtype=np.int64)
+        self._mean = np.zeros(self.num_pixels)
+        self._m2   = np.zeros(self.num_pixels) # sum of squared deviations
+        self.min   = np.zeros(self.num_pixels) + np.inf
+        self.max   = np.zeros(self.num_pixels) - np.inf
+
+        return
+
+
+    @property
+    def mean(self):
+        m = self._mean.copy()
+        m[self.count == 0] = np.nan
         return m
 
 
-    @classmethod
-    def simulate(cls, traj, detector, num_molecules, num_shots, traj_weights=None,
-                 finite_photon=False, force_no_gpu=False, device_id=0):
+    @property
+    def variance(self):
         """
-        Simulate a scattering 'shot', i.e. one exposure of x-rays to a sample, and
-        return that as a Shot object (factory function).
+        The (population) variance of each pixel. NaN where no data.
+        """
+        v = np.zeros(self.num_pixels) + np.nan
+        nz = (self.count > 0)
+        v[nz] = self._m2[nz] / self.count[nz]
+        return v
 
-        Assumes we have a Boltzmann distribution of `num_molecules` identical
-        molecules (`trajectory`), exposed to a beam defined by `beam` and projected
-        onto `detector`.
 
-        Each conformation is randomly rotated before the scattering simulation is
-        performed. Atomic form factors from X, finite photon statistics, and the
-        dilute-sample (no scattering interference from adjacent molecules)
-        approximation are employed.
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
 
-        Parameters
-        ----------
-        traj : mdtraj.trajectory
-            A trajectory object that contains a set of structures, representing
-            the Boltzmann ensemble of the sample. If len(traj) == 1, then we assume
-            the sample consists of a single homogenous structure, replecated
-            `num_molecules` times.
 
-        detector : odin.xray.Detector
-            A detector object the shot will be projected onto.
+    def _combine(self, count, mean, m2, minimum, maximum):
+        """
+        Merge the statistics of another set of observations into this one.
+        """
 
-        num_molecules : int
-            The number of molecules estimated to be in the `beam`'s focus.
+        n = self.count + count
+        nz = (n > 0)
 
-        num_shots : int
-            The number of shots to simulate.
+        delta = mean - self._mean
+        w = np.zeros(self.num_pixels)
+        w[nz] = count[nz] / n[nz].astype(np.float)
 
-        Optional Parameters
-        -------------------
-        traj_weights : ndarray, float
-            If `traj` contains many structures, an array that provides the Boltzmann
-            weight of each structure. Default: if traj_weights == None, weights
-            each structure equally.
+        self._m2   += m2 + delta**2 * self.count * w
+        self._mean += delta * w
+        self.count  = n
 
-        finite_photon : bool
-            Use finite photon statistics in the simulation.
+        self.min = np.minimum(self.min, minimum)
+        self.max = np.maximum(self.max, maximum)
 
-        force_no_gpu : bool
-            Run the (slow) CPU version of this function.
+        return
 
-        device_id : int
-            The index of the GPU to run on.
 
-        Returns
-        -------
-        shotset : odin.xray.Shotset
-            A Shotset instance, containing the simulated shots.
+    def add(self, intensities, mask=None):
         """
+        Add one or more shots to the accumulator.
 
-        I = np.zeros((num_shots, detector.num_pixels))
+        Parameters
+        ----------
+        intensities : ndarray, float
+            Either a single shot (len num_pixels), or a (num_shots, num_pixels)
+            array of shots.
 
-        for i in range(num_shots):
-            I[i,:] = scatter.simulate_shot(traj, num_molecules, detector,
-                                           traj_weights=traj_weights,
-                                           finite_photon=finite_photon,
-                                           force_no_gpu=force_no_gpu,
-                                           device_id=device_id)
+        Optional Parameters
+        -------------------
+        mask : ndarray, bool
+            A len num_pixels array, True for pixels to keep and False for pixels
+            to ignore.
+        """
 
-        ss = cls(I, detector)
+        x = np.asarray(intensities, dtype=np.float)
+        if len(x.shape) == 1:
+            x = x[None,:]
+        if not x.shape[1] == self.num_pixels:
+            raise ValueError('`intensities` must have %d pixels, got %d'
+                             % (self.num_pixels, x.shape[1]))
 
-        return ss
+        count = np.zeros(self.num_pixels, dtype=np.int64) + x.shape[0]
+        mean  = x.mean(axis=0)
+        m2    = np.sum((x - mean)**2, axis=0)
+        minimum = x.min(axis=0)
+        maximum = x.max(axis=0)
 
+        if mask != None:
+            mask = np.asarray(mask).flatten().astype(np.bool)
+            masked = np.logical_not(mask)
+            count[masked] = 0
+            mean[masked] = 0.0
+            m2[masked] = 0.0
+            minimum[masked] = np.inf
+            maximum[masked] = -np.inf
 
-    def to_rings(self, q_values, num_phi=360):
-        """
-        Convert the shot to an xray.Rings object, for computing correlation
-        functions and other properties in polar space.
+        self._combine(count, mean, m2, minimum, maximum)
 
-        This automatically interpolates the dataset onto a polar grid and then
-        converts those polar values into a class that facilitates computation
-        in that space. See odin.xray.Rings for more info.
+        return
 
-        Parameters
-        ----------
-        q_values : ndarray/list, float
-            The values of |q| to extract rings at (in Ang^{-1}).
 
-        num_phi : int
-            The number of equally spaced points around the azimuth to
-            interpolate onto (e.g. `num_phi`=360 means 1 deg spacing).
+    def merge(self, other):
         """
+        Merge the statistics accumulated by `other` into this accumulator.
 
-        logger.info('Converting %d shots to polar space (Rings)' % self.num_shots)
-        pi, pm = self.interpolate_to_polar(q_values=q_values, num_phi=num_phi)
-        r = Rings(q_values, pi, self.detector.k, pm)
+        Parameters
+        ----------
+        other : odin.xray.PixelStatistics
+            Another accumulator, over the same pixels.
+        """
+        if not isinstance(other, PixelStatistics):
+            raise TypeError('Can only merge PixelStatistics objects')
+        if not other.num_pixels == self.num_pixels:
+            raise ValueError('Cannot merge statistics over different numbers '
+                             'of pixels')
+        self._combine(other.count, other._mean, other._m2, other.min, other.max)
+        return
 
-        return r
+
+    def __add__(self, other):
+        new = PixelStatistics(self.num_pixels)
+        new.merge(self)
+        new.merge(other)
+        return new
 
 
     def save(self, filename):
         """
-        Writes the current Shotset data to disk.
+        Write the accumulator to disk.
 
         Parameters
         ----------
         filename : str
-            The path to the shotset file to save.
+            The path of the file to write.
         """
 
-        if not filename.endswith('.shot'):
-            filename += '.shot'
-
-        shotdata = {}
-        for i in range(self.num_shots):
-            shotdata[('shot%d' % i)] = self.intensities[i,:]
-
-        # if we don't have a mask, just save a single zero
-        if self.mask == None:
-            mask = np.array([0])
-        else:
-            mask = self.mask
-
         io.saveh(filename,
-                 num_shots = np.array([self.num_shots]),
-                 detector  = self.detector._to_serial(),
-                 mask      = mask,
-                 **shotdata)
-
+                 count = self.count,
+                 mean  = self._mean,
+                 m2    = self._m2,
+                 min   = self.min,
+                 max   = self.max)
         logger.info('Wrote %s to disk.' % filename)
 
         return
 
 
     @classmethod
-    def load(cls, filename, to_load=None):
+    def load(cls, filename):
         """
-        Loads the a Shotset from disk. Must be `.shot` or `.cxi` format.
+        Load an accumulator from disk.
 
         Parameters
         ----------
         filename : str
-            The path to the shotset file.
-
-        to_load : ndarray/list, ints
-            The indices of the shots in `filename` to load. Can be used to sub-
-            sample the shotset.
+            The path of the file to read.
 
         Returns
         -------
-        shotset : odin.xray.Shotset
-            A shotset object
+        stats : odin.xray.PixelStatistics
+            The accumulator.
         """
 
+        hdf = io.loadh(filename)
 
-        # load from a shot file
-        if filename.endswith('.shot'):
-            hdf = io.loadh(filename)
-
-            num_shots = int(hdf['num_shots'])
-
-            # figure out which shots to load
-            if to_load == None:
-                to_load = range(num_shots)
-            else:
-                try:
-                    to_load = np.array(to_load)
-                except:
-                    raise TypeError('`to_load` must be a ndarry/list of ints')
-
-            list_of_intensities = []
-            d = Detector._from_serial(hdf['detector'])
-            mask = hdf['mask']
-
-            # check for our flag that there is no mask
-            if np.all(mask == np.array([0])):
-                mask = None
-
-            for i in to_load:
-                i = int(i)
-                list_of_intensities.append( hdf[('shot%d' % i)] )
-
-            hdf.close()
-
-
-        elif filename.endswith('.cxi'):
-            raise NotImplementedError() # todo
-
-        else:
-            raise ValueError('Must load a shotset file [.shot, .cxi]')
+        stats = cls(len(hdf['count']))
+        stats.count = hdf['count']
+        stats._mean = hdf['mean']
+        stats._m2   = hdf['m2']
+        stats.min   = hdf['min']
+        stats.max   = hdf['max']
 
+        hdf.close()
 
-        return cls(list_of_intensities, d, mask)
+        return stats
 
 
-class Rings(object):
+class CorrelationAccumulator(object):
     """
-    Class to keep track of intensity data in a polar space.
+    Accumulates the angular correlation functions between every pair of rings
+    over a stream of shots, without keeping the shots in memory. Shots are
+    added one chunk at a time (as raw polar intensities or as Rings objects),
+    and accumulators built separately (e.g. by different workers, over
+    consecutive blocks of shots) can be merged.
+
+    The state is a running sum of the cross-spectra of the normalized rings,
+    for pairs of rings within each shot (intra) and, optionally, between every
+    pair of different shots (inter), so memory scales as num_q^2 x num_phi
+    independent of the number of shots.
+
+    If a `block_size` is given, the partial sums over each consecutive block
+    of shots are kept too, and jackknife or bootstrap estimates of the error
+    are computed by recombining those blocks, rather than the shots.
     """
 
-    def __init__(self, q_values, polar_intensities, k, polar_mask=None):
+    def __init__(self, q_values, num_phi, k, polar_mask=None, inter=True,
+                 block_size=None):
         """
-        Interpolate our cartesian-based measurements into a polar coordiante
-        system.
+        Instantiate an empty accumulator.
 
         Parameters
         ----------
-        q_values : ndarray OR list OF floats
-            The values of |q| in `polar_intensities`, in inverse Angstroms.
-
-        polar_intensities : ndarray, float
-            Intensities in polar space. Should be shape:
-
-                N x len(`q_values`) x num_phi
+        q_values : ndarray, float
+            The |q| values of the rings to be correlated.
 
-            with N the number of shots (any value) and `num_phi` the number of
-            points (equally spaced) around the azimuth.
+        num_phi : int
+            The number of points around each ring.
 
         k : float
-            The wavenumber of the energy used to acquire the data.
+            The wavenumber of the beam, used to convert to cos(psi).
 
+        Optional Parameters
+        -------------------
         polar_mask : ndarray, bool
-            A mask of ones and zeros. Ones are kept, zeros masked. Should be the
-            same shape as `polar_intensities`, but LESS THE FRIST DIMENSION.
-            That is, the polar mask is the same for all shots. Can also be
-            `None`, meaning no masked pixels
-        """
-
-        if not polar_intensities.shape[1] == len(q_values):
-            raise ValueError('`polar_intensities` must have same len as '
-                             '`q_values` in its second dimension.')
-
-        if polar_mask == None:
-            self.polar_mask = None
-        elif type(polar_mask) == np.ndarray:
-            if not polar_mask.shape == polar_intensities.shape[1:]:
-                raise ValueError('`polar_mask` must have same shape as '
-                                 '`polar_intensities[0,:,:]`,')
-            if not polar_mask.dtype == np.bool:
-                self.polar_mask = polar_mask.astype(np.bool)
-            else:
-                self.polar_mask = polar_mask
+            A (num_q, num_phi) mask, False for points to ignore, shared by all
+            shots added (as for Rings).
+
+        inter : bool
+            Whether to also accumulate inter-shot statistics, which costs a
+            second num_q^2 x num_phi sum.
+
+        block_size : int
+            Keep the partial sums over each block of `block_size` consecutive
+            shots, for error estimation. Costs (2 or 3) x num_q^2 x num_phi
+            per block.
+        """
+
+        self.q_values = np.array(q_values, dtype=np.float)
+        self.num_q    = len(self.q_values)
+        self.num_phi  = int(num_phi)
+        self.k        = float(k)
+        self.inter    = bool(inter)
+
+        if polar_mask != None:
+            polar_mask = np.asarray(polar_mask, dtype=np.bool)
+            if not polar_mask.shape == (self.num_q, self.num_phi):
+                raise ValueError('`polar_mask` must be shape (num_q, num_phi)')
+        self.polar_mask = polar_mask
+
+        self.num_shots = 0
+
+        shp = (self.num_q, self.num_q, self.num_freq)
+        self._intra = np.zeros(shp, dtype=np.complex128)
+        self._sum   = np.zeros((self.num_q, self.num_freq), dtype=np.complex128)
+        if self.inter:
+            self._inter = np.zeros(shp, dtype=np.complex128)
         else:
-            raise TypeError('`polar_mask` must be np.ndarray or None')
+            self._inter = None
 
-        self._q_values         = np.array(q_values)           # q values of the ring data
-        self.polar_intensities = np.copy(polar_intensities)   # copy data so don't over-write
-        self.k                 = k                            # wave number
+        # per-block partial sums: shot counts, intra sums, spectral sums, and
+        # inter sums over pairs of shots within each block
+        if block_size != None:
+            block_size = int(block_size)
+            if block_size < 1:
+                raise ValueError('`block_size` must be positive')
+            self._blocks = {'count' : [], 'intra' : [], 'sum' : [], 'inter' : []}
+        self.block_size = block_size
 
         return
 
 
     @property
-    def num_shots(self):
-        return self.polar_intensities.shape[0]
+    def num_freq(self):
+        return self.num_phi / 2 + 1
 
 
     @property
-    def phi_values(self):
-        return np.arange(0, 2.0*np.pi, 2.0*np.pi/float(self.num_phi))
+    def num_inter_pairs(self):
+        return self.num_shots * (self.num_shots - 1) / 2
 
 
     @property
-    def q_values(self):
-        return self._q_values
+    def num_blocks(self):
+        if self.block_size == None:
+            return 0
+        return len(self._blocks['count'])
+
+
+    def _new_block(self):
+        shp = (self.num_q, self.num_q, self.num_freq)
+        self._blocks['count'].append(0)
+        self._blocks['intra'].append(np.zeros(shp, dtype=np.complex128))
+        self._blocks['sum'].append(np.zeros(shp[1:], dtype=np.complex128))
+        if self.inter:
+            self._blocks['inter'].append(np.zeros(shp, dtype=np.complex128))
+        return
 
 
-    @property
-    def num_phi(self):
-        return self.polar_intensities.shape[2]
+    def add(self, polar_intensities):
+        """
+        Add one or more shots to the accumulator. Shots must be added in order
+        (inter-shot statistics are accumulated over pairs i < j).
 
+        Parameters
+        ----------
+        polar_intensities : ndarray, float OR odin.xray.Rings
+            Either a single shot (num_q, num_phi), a (num_shots, num_q, num_phi)
+            array of shots, or a Rings object with the same q_values & num_phi.
+        """
+
+        if isinstance(polar_intensities, Rings):
+            if not polar_intensities.num_phi == self.num_phi:
+                raise ValueError('Rings have %d points around each ring, '
+                                 'expected %d' % (polar_intensities.num_phi,
+                                                  self.num_phi))
+            if not np.allclose(polar_intensities.q_values, self.q_values):
+                raise ValueError('Rings q_values do not match the accumulator')
+            for slc, chunk in polar_intensities._iter_chunks():
+                self.add(chunk)
+            return
+
+        x = np.asarray(polar_intensities)
+        if len(x.shape) == 2:
+            x = x[None,:,:]
+        if not x.shape[1:] == (self.num_q, self.num_phi):
+            raise ValueError('`polar_intensities` must be shape (num_shots, %d, '
+                             '%d), got %s' % (self.num_q, self.num_phi, x.shape))
+
+        X = Rings._normalized_spectra(x, self.polar_mask)
+
+        if self.block_size == None:
+            self._add_spectra(X)
+        else:
+            # split the shots at block boundaries
+            start = 0
+            while start < X.shape[0]:
+                if self.num_blocks == 0 or \
+                   self._blocks['count'][-1] == self.block_size:
+                    self._new_block()
+                stop = start + self.block_size - self._blocks['count'][-1]
+                self._add_spectra(X[start:stop], block=-1)
+                start = stop
 
-    @property
-    def num_q(self):
-        return len(self._q_values)
+        return
 
 
-    @property
-    def num_datapoints(self):
-        return self.num_phi * self.num_q
-    
-        
-    def _cospsi(self, q1, q2):
+    def _add_spectra(self, X, block=None):
         """
-        For each value if phi, compute the cosine of the angle between the
-        reciprocal scattering vectors q1/q2 at angular separation phi.
-        
-        cos(psi) = f[phi, q1, q2]
-        
-        Parameters
-        ----------
-        q1/q2 : float
-            The |q| values, in inv. ang.
-            
-        Returns
-        -------
-        cospsi : ndarray, float
-            The cosine of psi, the angle between the scattering vectors.
+        Add the (num_shots, num_q, num_freq) normalized spectra `X` to the
+        running sums, and to those of block `block`.
         """
-        
-        # this function was formerly: get_cos_psi_vals
-        
-        t1     = np.pi/2. + np.arcsin( q1 / (2.*self.k) ) # theta 1 in spherical coor
-        t2     = np.pi/2. + np.arcsin( q2 / (2.*self.k) ) # theta 2 in spherical coor
-        cospsi = np.cos(t1)*np.cos(t2) + np.sin(t1)*np.sin(t2) *\
-                 np.cos( self.phi_values )
-              
-        return cospsi
-    
 
-    def q_index(self, q, tolerance=1e-4):
+        intra = np.einsum('siw,sjw->ijw', X, np.conjugate(X))
+
+        if block == None:
+            if self.inter:
+                # the sum of the spectra of all preceeding shots
+                prefix = self._sum + np.cumsum(X, axis=0, dtype=np.complex128) - X
+                self._inter += np.einsum('siw,sjw->ijw', prefix, np.conjugate(X))
+
+        else:
+            self._blocks['intra'][block] += intra
+            if self.inter:
+                # pairs within the block, then with all preceeding blocks
+                b_sum = self._blocks['sum'][block]
+                prefix = b_sum + np.cumsum(X, axis=0, dtype=np.complex128) - X
+                b_inter = np.einsum('siw,sjw->ijw', prefix, np.conjugate(X))
+                self._blocks['inter'][block] += b_inter
+                self._inter += b_inter + np.einsum('iw,jw->ijw', self._sum - b_sum,
+                                                   np.conjugate(X.sum(axis=0)))
+            self._blocks['sum'][block] += X.sum(axis=0, dtype=np.complex128)
+            self._blocks['count'][block] += X.shape[0]
+
+        self._intra += intra
+        self._sum   += X.sum(axis=0, dtype=np.complex128)
+        self.num_shots += X.shape[0]
+
+        return
+
+
+    def merge(self, other):
         """
-        Convert value of |q| (in inverse Angstroms) into the index used to
-        slice `polar_intensities`.
+        Merge the statistics accumulated by `other` into this accumulator. The
+        shots of `other` are taken to follow those already added here.
 
         Parameters
         ----------
-        q : float
-            The value of |q| in inv Angstroms
+        other : odin.xray.CorrelationAccumulator
+            Another accumulator, over the same rings.
+        """
+
+        if not isinstance(other, CorrelationAccumulator):
+            raise TypeError('Can only merge CorrelationAccumulator objects')
+        if not (other.num_phi == self.num_phi and
+                other.num_q == self.num_q and
+                np.allclose(other.q_values, self.q_values)):
+            raise ValueError('Cannot merge accumulators over different rings')
+        if (self.polar_mask == None) != (other.polar_mask == None) or \
+           (self.polar_mask != None and
+            not np.all(self.polar_mask == other.polar_mask)):
+            raise ValueError('Cannot merge accumulators with different masks')
+        if self.inter and not other.inter:
+            raise ValueError('`other` does not have inter-shot statistics')
+        if self.block_size != None and other.block_size == None:
+            raise ValueError('`other` does not have per-block statistics')
+
+        if self.inter:
+            self._inter += other._inter + \
+                np.einsum('iw,jw->ijw', self._sum, np.conjugate(other._sum))
+
+        self._intra += other._intra
+        self._sum   += other._sum
+        self.num_shots += other.num_shots
+
+        # the blocks of `other` follow ours -- a partial last block stays short
+        if self.block_size != None:
+            self._blocks['count'].extend(other._blocks['count'])
+            keys = ['intra', 'sum'] + (['inter'] if self.inter else [])
+            for key in keys:
+                self._blocks[key].extend([ b.copy() for b in other._blocks[key] ])
 
-        tolerance : float
-            The tolerance in |q|. Will return values of q that are within this
-            tolerance.
+        return
 
-        Returns
-        -------
-        q_ind : int
-            The index to slice `polar_intensities` at to get |q|.
-        """
-	
-        # check if there are rings at q
-        q_ind = np.where( np.abs(self.q_values - q) < tolerance )[0]
-        
-        if len(q_ind) == 0:
-            raise ValueError("No ring data at q="+str(q) +" inv ang. " \
-                             "There are only data for q="+", ".join(np.char.mod("%.2f",self.q_values) )  )
-        elif len(q_ind) > 1:
-            raise ValueError("Multiple q-values found! Try decreasing the value"
-                             "of the `tolerance` parameter.")
-        
-        return int(q_ind)
+
+    def __add__(self, other):
+        if self.block_size != None and other.block_size != None:
+            block_size = self.block_size
+        else:
+            block_size = None
+        new = CorrelationAccumulator(self.q_values, self.num_phi, self.k,
+                                     polar_mask=self.polar_mask,
+                                     inter=(self.inter and other.inter),
+                                     block_size=block_size)
+        new.merge(self)
+        new.merge(other)
+        return new
 
 
-    def normalize(self):
+    def _to_correlation(self, spectra):
         """
-        Normalizes the intensitues of each ring-shot by the average value around the ring.
-        Parameters
-        ----------
-        None : void
+        Inverse transform mean cross-spectra into correlation functions,
+        normalizing each lag by the number of unmasked pairs.
         """
-        
-        I      = self.polar_intensities
-        mask   = self.polar_mask
-         
-#       give each shot unit mean 
-        I_mean = np.sum( I * mask, axis=2 ) / np.sum( mask,axis=1)
-        I     /= I_mean[:,:,None]
-        
-#       divide each polar pixel by its mean across the shot set, normalzes out some detector artifacts
-        I_mean = np.sum( I*mask, axis=0 ) / self.num_shots
-        I     /= I_mean
-        
-#       This doesn;t matter since only masked pixels become nans in this normalization
-        I      = np.nan_to_num( I )
-        
-#       consider re-scaling the intensity in |q|
-        
-        return
+        corr = np.fft.irfft(spectra, n=self.num_phi, axis=-1)
+        if self.polar_mask == None:
+            return corr / float(self.num_phi)
+        m = self.polar_mask
+        return corr / Rings._mask_overlap(m[:,None,:], m[None,:,:])
 
 
-    def dePolarize(self, outOfPlane=0.99):
+    def correlation(self, inter=False):
+        """
+        The mean correlation function between every pair of rings.
+
+        Optional Parameters
+        -------------------
+        inter : bool
+            Return the mean correlation between rings on different shots,
+            rather than on the same shot.
+
+        Returns
+        -------
+        corr : ndarray, float
+            A (num_q, num_q, num_phi) array, where corr[i,j] is the correlation
+            between rings q_values[i] and q_values[j] (as Rings.correlate).
+        """
+
+        if inter:
+            if not self.inter:
+                raise ValueError('Inter-shot statistics were not accumulated')
+            if self.num_shots < 2:
+                raise ValueError('Need at least two shots for inter-shot '
+                                 'correlations')
+            spectra = self._inter / float(self.num_inter_pairs)
+        else:
+            if self.num_shots < 1:
+                raise ValueError('No shots have been added')
+            spectra = self._intra / float(self.num_shots)
+
+        return self._to_correlation(spectra)
+
+
+    def legendre_matrix(self, order, use_inter_statistics=False, even_only=False):
         """
-        Applies a polarization correction to the rings.
+        Project the correlation functions onto a set of legendre polynomials,
+        and return the coefficients of that projection (as
+        Rings.legendre_matrix).
+
         Parameters
         ----------
-        outOfPlane : float
-            The fraction of the beam polarization out of the synchrotron plane (between 0 and 1)
-        """
-        qs   = self.q_values
-        wave = 2. * np.pi / self.k
-        I    = self.polar_intensities
-        phis = self.phi_values
-        
-        for i in xrange( len ( qs ) ):
-            q         = qs[i]
-            theta     = np.arcsin( q*wave / 4./ np.pi)
-            SinTheta  = np.sin( 2 * theta )
-            correctn  = outOfPlane      * ( 1. - SinTheta**2 * np.cos( phis )**2 )
-            correctn += (1.-outOfPlane) * ( 1. - SinTheta**2 * np.sin( phis )**2 )
-            I[:,i,:]  /= correctn
+        order : int
+            The order at which to truncate the polynomial expansion.
 
-        return 
-    
+        Optional Parameters
+        -------------------
+        use_inter_statistics : bool
+            Whether or not to subtract inter-shot statistics from the
+            correlation function before projecting it.
 
-    def intensity_profile(self):
-        """
-        Averages over the azimuth phi to obtain an intensity profile.
+        even_only : bool
+            Fit only the even Legendre polynomials.
 
         Returns
         -------
-        intensity_profile : ndarray, float
-            An n x 2 array, where the first dimension is the magnitude |q| and
-            the second is the average intensity at that point < I(|q|) >_phi.
+        Cl: np.ndarray, float
+            A (order, num_q, num_q) array of the legendre coefficients.
         """
 
-        intensity_profile      = np.zeros( (self.num_q, 2), dtype=np.float )
-        intensity_profile[:,0] = self._q_values.copy()
+        corr = self.correlation()
+        if use_inter_statistics:
+            corr -= self.correlation(inter=True)
 
-        # average over shots, phi
-        if self.polar_mask != None:
-            i = self.polar_intensities * self.polar_mask.astype(np.float)
-        else:
-            i = self.polar_intensities
+        return _legendre_matrix(corr, self.q_values, self.k, order,
+                                even_only=even_only)
 
-        intensity_profile[:,1] = np.mean( np.mean(i, axis=2), axis=0)
 
-        return intensity_profile
+    def _resampled_correlation(self, weights, use_inter_statistics=False):
+        """
+        The (intra - inter, if `use_inter_statistics`) correlation over a
+        resampling of the blocks, where block b is taken `weights[b]` times
+        (0 to leave it out). Inter-shot pairs are counted between all shots of
+        the resample, with copies of a block taken as distinct blocks.
+        """
 
+        w = np.asarray(weights, dtype=np.float)
+        counts = np.array(self._blocks['count'], dtype=np.float)
+        num_shots = np.sum(w * counts)
 
-    def correlate_intra(self, q1, q2, num_shots=0, mean_only=False):
+        intra = np.einsum('b,bijw->ijw', w, np.array(self._blocks['intra']))
+        corr = self._to_correlation(intra / num_shots)
+
+        if use_inter_statistics:
+            S = np.array(self._blocks['sum']) * w[:,None,None]
+            prefix = np.cumsum(S, axis=0) - S
+            inter = np.einsum('b,bijw->ijw', w, np.array(self._blocks['inter'])) + \
+                    np.einsum('biw,bjw->ijw', prefix, np.conjugate(S))
+            # pairs between copies of the same block
+            copies = w * (w - 1.0) / 2.0
+            nz = (copies > 0)
+            if np.any(nz):
+                S_nz = S[nz] / w[nz,None,None]
+                inter += np.einsum('b,biw,bjw->ijw', copies[nz], S_nz,
+                                   np.conjugate(S_nz))
+            num_pairs = num_shots * (num_shots - 1.0) / 2.0
+            corr -= self._to_correlation(inter / num_pairs)
+
+        return corr
+
+
+    def legendre_replicates(self, order, use_inter_statistics=False,
+                            even_only=False, method='jackknife',
+                            num_samples=200, seed=None):
         """
-        Does intRA-shot correlations for many shots.
+        Resampled replicates of the Legendre coefficients (as from
+        legendre_matrix), each recombined from the per-block partial sums.
 
         Parameters
         ----------
-        q1 : float
-            The |q| value of the first ring
-        q2 : float
-            The |q| value of the second ring
+        order : int
+            The order at which to truncate the polynomial expansion.
 
         Optional Parameters
         -------------------
-        num_shots : int
-            number of shots to compute correlators for
-        mean_only : bool
-            whether or not to return every correlation, or the average
+        use_inter_statistics : bool
+            Whether or not to subtract inter-shot statistics from the
+            correlation function before projecting it.
 
-        Returns
-        -------
-        intra : ndarray, float
-            Either the average correlation, or every correlation as a 2d array
-        """
-        logger.debug("Correlating rings at %f / %f" % (q1, q2))
+        even_only : bool
+            Fit only the even Legendre polynomials.
 
-        q_ind1 = self.q_index(q1)
-        q_ind2 = self.q_index(q2)
+        method : str
+            Either 'jackknife' (leave out each block in turn) or 'bootstrap'
+            (draw blocks with replacement).
 
-        if num_shots == 0: # then do correlation for all shots
-            num_shots = self.num_shots
+        num_samples : int
+            The number of bootstrap replicates to draw.
 
-        rings1 = self.polar_intensities[:num_shots,q_ind1,:] # shots at ring1
-        rings2 = self.polar_intensities[:num_shots,q_ind2,:] # shots at ring2
+        seed : int
+            A seed for the bootstrap random number generator.
 
-        # Check if mask exists
-        if self.polar_mask != None:
-            mask1 = self.polar_mask[q_ind1,:]
-            mask2 = self.polar_mask[q_ind2,:]
+        Returns
+        -------
+        replicates : ndarray, float
+            An (num_replicates, order, num_q, num_q) array of coefficients.
+        """
+
+        if self.block_size == None:
+            raise ValueError('Per-block statistics were not accumulated, pass '
+                             '`block_size` to the accumulator')
+        if use_inter_statistics and not self.inter:
+            raise ValueError('Inter-shot statistics were not accumulated')
+
+        nb = self.num_blocks
+        if nb < 2:
+            raise ValueError('Need at least two blocks to resample, got %d' % nb)
+
+        if method == 'jackknife':
+            weights = 1.0 - np.eye(nb)
+        elif method == 'bootstrap':
+            rng = np.random.RandomState(seed)
+            weights = rng.multinomial(nb, np.ones(nb) / float(nb),
+                                      size=int(num_samples))
         else:
-            mask1 = None
-            mask2 = None     
+            raise ValueError("`method` must be one of 'jackknife', 'bootstrap'"
+                             ", got: %s" % method)
 
-        return self._correlate_rows(rings1, rings2, mask1, mask2, mean_only)
-    
+        replicates = np.zeros((len(weights), order, self.num_q, self.num_q))
+        for r, w in enumerate(weights):
+            corr = self._resampled_correlation(w, use_inter_statistics)
+            replicates[r] = _legendre_matrix(corr, self.q_values, self.k,
+                                             order, even_only=even_only)
 
-    def correlate_inter(self, q1, q2, num_pairs=0, mean_only=False):
+        return replicates
+
+
+    def legendre_errors(self, order, use_inter_statistics=False, even_only=False,
+                        method='jackknife', num_samples=200, seed=None):
         """
-        Does intER-shot correlations for many shots.
+        The Legendre coefficients, with standard errors estimated by resampling
+        blocks of shots (see legendre_replicates). For the full covariance,
+        use the replicates directly.
 
         Parameters
         ----------
-        q1 : float
-            The |q| value of the first ring
-        q2 : float
-            The |q| value of the second ring
+        order : int
+            The order at which to truncate the polynomial expansion.
 
         Optional Parameters
         -------------------
-        num_pairs : int
-            number of pairs of shots to compute correlators for
-        mean_only : bool
-            whether or not to return every correlation, or the average
+        use_inter_statistics : bool
+            Whether or not to subtract inter-shot statistics from the
+            correlation function before projecting it.
 
-        to_load : ndarray/list, ints
-            The indices of the shots in `filename` to load. Can be used to sub-
-            sample the shotset.
+        even_only : bool
+            Fit only the even Legendre polynomials.
+
+        method : str
+            Either 'jackknife' or 'bootstrap'.
+
+        num_samples : int
+            The number of bootstrap replicates to draw.
+
+        seed : int
+            A seed for the bootstrap random number generator.
 
         Returns
         -------
-        shotset : odin.xray.Shotset
-            A shotset object
+        Cl : np.ndarray, float
+            A (order, num_q, num_q) array of the legendre coefficients.
+
+        Cl_err : np.ndarray, float
+            The standard error of each coefficient.
         """
 
+        Cl = self.legendre_matrix(order, use_inter_statistics=use_inter_statistics,
+                                  even_only=even_only)
+        reps = self.legendre_replicates(order,
+                                        use_inter_statistics=use_inter_statistics,
+                                        even_only=even_only, method=method,
+                                        num_samples=num_samples, seed=seed)
 
-        # load from a shot file
-        if filename.endswith('.shot'):
-            hdf = io.loadh(filename)
+        if method == 'jackknife':
+            n = float(reps.shape[0])
+            Cl_err = np.sqrt( (n - 1.0) / n * \
+                              np.sum((reps - reps.mean(axis=0))**2, axis=0) )
+        else:
+            Cl_err = reps.std(axis=0, ddof=1)
 
-            num_shots = int(hdf['num_shots'])
+        return Cl, Cl_err
 
-            # figure out which shots to load
-            if to_load == None:
-                to_load = range(num_shots)
-            else:
-                try:
-                    to_load = np.array(to_load)
-                except:
-                    raise TypeError('`to_load` must be a ndarry/list of ints')
 
-            list_of_intensities = []
-            d = Detector._from_serial(hdf['detector'])
-            mask = hdf['mask']
+    def save(self, filename):
+        """
+        Write the accumulator to disk.
 
-            # check for our flag that there is no mask
-            if np.all(mask == np.array([0])):
-                mask = None
+        Parameters
+        ----------
+        filename : str
+            The path of the file to write.
+        """
+
+        # if self.polar_mask == None, then save a single 0
+        if self.polar_mask == None:
+            pm = np.array([0])
+        else:
+            pm = self.polar_mask
+
+        if self.inter:
+            inter = self._inter
+        else:
+            inter = np.array([0])
+
+        io.saveh(filename,
+                 q_values  = self.q_values,
+                 num_phi   = np.array([self.num_phi]),
+                 k         = np.array([self.k]),
+                 polar_mask = pm,
+                 num_shots = np.array([self.num_shots]),
+                 intra     = self._intra,
+                 inter     = inter,
+                 sum       = self._sum,
+                 **self._block_arrays())
+        logger.info('Wrote %s to disk.' % filename)
 
-            for i in to_load:
-                i = int(i)
-                list_of_intensities.append( hdf[('shot%d' % i)] )
+        return
 
-            hdf.close()
 
+    @classmethod
+    def load(cls, filename):
+        """
+        Load an accumulator from disk.
 
-        elif filename.endswith('.cxi'):
-            raise NotImplementedError() # todo
+        Parameters
+        ----------
+        filename : str
+            The path of the file to read.
+
+        Returns
+        -------
+        acc : odin.xray.CorrelationAccumulator
+            The accumulator.
+        """
+
+        hdf = io.loadh(filename)
 
+        if np.all(hdf['polar_mask'] == np.array([0])):
+            pm = None
         else:
-            raise ValueError('Must load a shotset file [.shot, .cxi]')
+            pm = hdf['polar_mask']
+        inter = not np.all(hdf['inter'] == np.array([0]))
+
+        acc = cls(hdf['q_values'], int(hdf['num_phi'][0]), float(hdf['k'][0]),
+                  polar_mask=pm, inter=inter)
+        acc.num_shots = int(hdf['num_shots'][0])
+        acc._intra = hdf['intra']
+        acc._sum   = hdf['sum']
+        if inter:
+            acc._inter = hdf['inter']
+
+        # a block size of 0 codes for no blocks, a count of [0] for none yet
+        if hdf['block_size'][0] > 0:
+            acc.block_size = int(hdf['block_size'][0])
+            acc._blocks = {'count' : [], 'intra' : [], 'sum' : [], 'inter' : []}
+            if not np.all(hdf['block_count'] == np.array([0])):
+                acc._blocks['count'] = [ int(c) for c in hdf['block_count'] ]
+                acc._blocks['intra'] = list(hdf['block_intra'])
+                acc._blocks['sum']   = list(hdf['block_sum'])
+                if inter:
+                    acc._blocks['inter'] = list(hdf['block_inter'])
+
+        hdf.close()
+
+        return acc
 
 
-        return cls(list_of_intensities, d, mask)
+    def _block_arrays(self):
+        """
+        The per-block partial sums, stacked for writing to disk.
+        """
+        if self.num_blocks == 0:
+            return {'block_size'  : np.array([self.block_size or 0]),
+                    'block_count' : np.array([0])}
+        arrays = {'block_size'  : np.array([self.block_size]),
+                  'block_count' : np.array(self._blocks['count']),
+                  'block_intra' : np.array(self._blocks['intra']),
+                  'block_sum'   : np.array(self._blocks['sum'])}
+        if self.inter:
+            arrays['block_inter'] = np.array(self._blocks['inter'])
+        return arrays
 
 
 class Rings(object):
@@ -1902,7 +4533,8 @@ class Rings(object):
     Class to keep track of intensity data in a polar space.
     """
 
-    def __init__(self, q_values, polar_intensities, k, polar_mask=None):
+    def __init__(self, q_values, polar_intensities, k, polar_mask=None,
+                 dtype=None, memory_budget=None):
         """
         Interpolate our cartesian-based measurements into a polar coordiante
         system.
@@ -1928,6 +4560,15 @@ class Rings(object):
             same shape as `polar_intensities`, but LESS THE FRIST DIMENSION.
             That is, the polar mask is the same for all shots. Can also be
             `None`, meaning no masked pixels
+
+        dtype : np.dtype
+            The type to store the polar intensities as. By default, the type of
+            `polar_intensities` is kept. Cannot be changed for intensities kept
+            on disk.
+
+        memory_budget : int
+            The number of bytes of polar intensities to hold in memory at once
+            when streaming over shots. Defaults to MEMORY_BUDGET.
         """
 
         if not polar_intensities.shape[1] == len(q_values):
@@ -1948,15 +4589,129 @@ class Rings(object):
             raise TypeError('`polar_mask` must be np.ndarray or None')
 
         self._q_values         = np.array(q_values)           # q values of the ring data
-        self.polar_intensities = np.copy(polar_intensities)   # copy data so don't over-write
         self.k                 = k                            # wave number
 
+        if memory_budget == None:
+            memory_budget = MEMORY_BUDGET
+        self.memory_budget = memory_budget
+
+        if isinstance(polar_intensities, (ArrayBlocks, DiskArray)):
+            if (dtype != None) and \
+               (not np.dtype(dtype) == polar_intensities.dtype):
+                raise TypeError('Cannot change the dtype of polar intensities '
+                                'stored on disk or in blocks')
+            self._polar_intensities = polar_intensities
+        else:
+            # copy data so don't over-write
+            self._polar_intensities = np.array(polar_intensities, dtype=dtype)
+
         return
 
 
+    @property
+    def polar_intensities(self):
+        # appended blocks are concatenated on first access, then kept -- an
+        # on-disk array stays on disk, and is read as it is sliced
+        if isinstance(self._polar_intensities, ArrayBlocks) and \
+           self._polar_intensities.in_memory:
+            self._polar_intensities = np.array(self._polar_intensities)
+        return self._polar_intensities
+
+
+    @property
+    def on_disk(self):
+        """
+        True if the polar intensities are left on disk (see Rings.load), and
+        read ring by ring as they are needed.
+        """
+        if isinstance(self._polar_intensities, ArrayBlocks):
+            return not self._polar_intensities.in_memory
+        return isinstance(self._polar_intensities, DiskArray)
+
+
+    @polar_intensities.setter
+    def polar_intensities(self, value):
+        self._polar_intensities = value
+
+
+    def _check_writable(self, operation):
+        """
+        Raise a TypeError if the polar intensities are on disk, where an
+        in-place `operation` cannot be applied.
+        """
+        if self.on_disk:
+            raise TypeError('Cannot %s rings stored on disk in place -- load '
+                            'them with in_memory=True first' % operation)
+
+
     @property
     def num_shots(self):
-        return self.polar_intensities.shape[0]
+        return self._polar_intensities.shape[0]
+
+
+    def _iter_chunks(self, n=None, num_shots=None, q_inds=None):
+        """
+        Iterate over the first `num_shots` shots (default: all) in blocks of
+        `n`, by default as many as fit in `memory_budget`. If `q_inds` is passed,
+        only those rings are read.
+
+        Yields
+        ------
+        slc : slice
+            The shots in the current block.
+
+        polar_intensities : ndarray
+            The (n, num_q, num_phi) block of polar intensities, or
+            (n, len(q_inds), num_phi) if `q_inds` is passed.
+        """
+        if q_inds == None:
+            num_q = self.num_q
+        else:
+            num_q = len(q_inds)
+        if n == None:
+            n = self.memory_budget // (num_q * self.num_phi *
+                                       self._polar_intensities.itemsize)
+        n = max(1, int(n))
+        if num_shots == None:
+            num_shots = self.num_shots
+        for start in range(0, num_shots, n):
+            slc = slice(start, min(start + n, num_shots))
+            if q_inds == None:
+                yield slc, np.asarray(self._polar_intensities[slc])
+            else:
+                rings = [ self._polar_intensities[slc,q,:] for q in q_inds ]
+                yield slc, np.asarray(rings).transpose(1, 0, 2)
+
+
+    def _read_ring(self, shots, q_ind):
+        """
+        Read the ring `q_ind` of the shots `shots` (in that order, repeats
+        allowed), touching only that ring if the data are on disk.
+        """
+        if isinstance(self._polar_intensities, np.ndarray):
+            return self._polar_intensities[shots,q_ind,:]
+        return _read_rows(self._polar_intensities, shots, (q_ind, slice(None)))
+
+
+    def iter_chunks(self, n=None):
+        """
+        Iterate over the rings in blocks of shots.
+
+        Optional Parameters
+        -------------------
+        n : int
+            The number of shots per block. By default, as many shots as fit in
+            `memory_budget`.
+
+        Yields
+        ------
+        block : odin.xray.Rings
+            A Rings object holding (up to) `n` consecutive shots, with the same
+            q-values, wavenumber and mask as this one.
+        """
+        for slc, chunk in self._iter_chunks(n):
+            yield Rings(self.q_values, chunk, self.k, self.polar_mask,
+                        memory_budget=self.memory_budget)
 
 
     @property
@@ -1971,7 +4726,7 @@ class Rings(object):
 
     @property
     def num_phi(self):
-        return self.polar_intensities.shape[2]
+        return self._polar_intensities.shape[2]
 
 
     @property
@@ -2003,13 +4758,7 @@ class Rings(object):
         """
         
         # this function was formerly: get_cos_psi_vals
-        
-        t1     = np.pi/2. + np.arcsin( q1 / (2.*self.k) ) # theta 1 in spherical coor
-        t2     = np.pi/2. + np.arcsin( q2 / (2.*self.k) ) # theta 2 in spherical coor
-        cospsi = np.cos(t1)*np.cos(t2) + np.sin(t1)*np.sin(t2) *\
-                 np.cos( self.phi_values )
-              
-        return cospsi
+        return _cospsi(q1, q2, self.k, self.num_phi)
     
 
     def q_index(self, q, tolerance=1e-4):
@@ -2048,11 +4797,13 @@ class Rings(object):
     def normalize(self):
         """
         Normalizes the intensitues of each ring-shot by the average value around the ring.
+        Works in place, so the rings must be in memory (see Rings.load).
         Parameters
         ----------
         None : void
         """
         
+        self._check_writable('normalize')
         I      = self.polar_intensities
         mask   = self.polar_mask
          
@@ -2074,24 +4825,25 @@ class Rings(object):
 
     def dePolarize(self, outOfPlane=0.99):
         """
-        Applies a polarization correction to the rings.
+        Applies a polarization correction to the rings, in place -- the rings
+        must be in memory (see Rings.load).
         Parameters
         ----------
         outOfPlane : float
             The fraction of the beam polarization out of the synchrotron plane (between 0 and 1)
         """
+        self._check_writable('depolarize')
         qs   = self.q_values
         wave = 2. * np.pi / self.k
         I    = self.polar_intensities
         phis = self.phi_values
         
-        for i in xrange( len ( qs ) ):
-            q         = qs[i]
-            theta     = np.arcsin( q*wave / 4./ np.pi)
-            SinTheta  = np.sin( 2 * theta )
-            correctn  = outOfPlane      * ( 1. - SinTheta**2 * np.cos( phis )**2 )
-            correctn += (1.-outOfPlane) * ( 1. - SinTheta**2 * np.sin( phis )**2 )
-            I[:,i,:]  /= correctn
+        # the (num_q, num_phi) correction, applied to all shots in one pass
+        theta     = np.arcsin( qs*wave / 4./ np.pi)
+        SinTheta  = np.sin( 2 * theta )[:,None]
+        correctn  = outOfPlane      * ( 1. - SinTheta**2 * np.cos( phis )**2 )
+        correctn += (1.-outOfPlane) * ( 1. - SinTheta**2 * np.sin( phis )**2 )
+        I /= correctn[None,:,:]
 
         return 
     
@@ -2110,13 +4862,14 @@ class Rings(object):
         intensity_profile      = np.zeros( (self.num_q, 2), dtype=np.float )
         intensity_profile[:,0] = self._q_values.copy()
 
-        # average over shots, phi
-        if self.polar_mask != None:
-            i = self.polar_intensities * self.polar_mask.astype(np.float)
-        else:
-            i = self.polar_intensities
+        # average over shots, phi -- summing over blocks of shots
+        total = np.zeros(self.num_q)
+        for slc, i in self._iter_chunks():
+            if self.polar_mask != None:
+                i = i * self.polar_mask.astype(np.float)
+            total += np.mean(i, axis=2).sum(axis=0)
 
-        intensity_profile[:,1] = np.mean( np.mean(i, axis=2), axis=0)
+        intensity_profile[:,1] = total / float(self.num_shots)
 
         return intensity_profile
 
@@ -2153,9 +4906,6 @@ class Rings(object):
         if num_shots == 0: # then do correlation for all shots
             num_shots = self.num_shots
 
-        rings1 = self.polar_intensities[:num_shots,q_ind1,:] # shots at ring1
-        rings2 = self.polar_intensities[:num_shots,q_ind2,:] # shots at ring2
-
         # Check if mask exists
         if self.polar_mask != None:
             mask1 = self.polar_mask[q_ind1,:]
@@ -2164,6 +4914,18 @@ class Rings(object):
             mask1 = None
             mask2 = None     
 
+        # the mean is accumulated over blocks of shots, to bound memory use
+        if mean_only:
+            corr = np.zeros(self.num_phi)
+            for slc, chunk in self._iter_chunks(num_shots=num_shots,
+                                                q_inds=[q_ind1, q_ind2]):
+                corr += self._correlate_rows(chunk[:,0,:], chunk[:,1,:],
+                                             mask1, mask2).sum(axis=0)
+            return corr / float(num_shots)
+
+        rings1 = self._polar_intensities[:num_shots,q_ind1,:] # shots at ring1
+        rings2 = self._polar_intensities[:num_shots,q_ind2,:] # shots at ring2
+
         return self._correlate_rows(rings1, rings2, mask1, mask2, mean_only)
     
 
@@ -2181,7 +4943,8 @@ class Rings(object):
         Optional Parameters
         -------------------
         num_pairs : int
-            number of pairs of shots to compute correlators for
+            number of pairs of shots to compute correlators for, chosen at
+            random. By default (0), use all pairs.
         mean_only : bool
             whether or not to return every correlation, or the average
 
@@ -2189,6 +4952,12 @@ class Rings(object):
         -------
         inter : ndarray, float
             Either the average correlation, or every correlation as a 2d array
+
+        Notes
+        -----
+        The average over all pairs of shots is computed exactly in a single
+        pass over the shots (see `correlate_all`), rather than by correlating
+        each of the N(N-1)/2 pairs.
         """
 
         logger.debug("Correlating rings at %f / %f" % (q1, q2))
@@ -2197,8 +4966,13 @@ class Rings(object):
         q_ind2 = self.q_index(q2)
 
         max_pairs = self.num_shots * (self.num_shots - 1) / 2
-        
-        if (num_pairs == 0) or (num_pairs > max_pairs):
+        all_pairs = (num_pairs == 0) or (num_pairs >= max_pairs)
+
+        if mean_only and all_pairs:
+            acc = self._accumulate(q_inds=[q_ind1, q_ind2], inter=True)
+            return acc.correlation(inter=True)[0,1]
+
+        if all_pairs:
             inter_pairs = []
             for i in range(self.num_shots):
                 for j in range(i+1, self.num_shots):
@@ -2219,20 +4993,134 @@ class Rings(object):
         # todo : run in real life and see what works
         if mean_only:
             corr = np.zeros(self.num_phi)
-            for i in xrange( inter_pairs.shape[0] ):
-                x = self.polar_intensities[inter_pairs[i,0],q_ind1,:] # shots at ring1
-                y = self.polar_intensities[inter_pairs[i,1],q_ind2,:] # shots at ring2
-                corr += self._correlate_rows(x, y, mask1, mask2, mean_only=True)
+            n = self.memory_budget // (2 * self.num_phi *
+                                       self._polar_intensities.itemsize)
+            n = max(1, int(n))
+            for start in range(0, inter_pairs.shape[0], n):
+                pairs = inter_pairs[start:start+n]
+                x = self._read_ring(pairs[:,0], q_ind1) # shots at ring1
+                y = self._read_ring(pairs[:,1], q_ind2) # shots at ring2
+                corr += self._correlate_rows(x, y, mask1, mask2).sum(axis=0)
             corr /= float(inter_pairs.shape[0])
             
         else:
-            x = self.polar_intensities[inter_pairs[:,0],q_ind1,:] # shots at ring1
-            y = self.polar_intensities[inter_pairs[:,1],q_ind2,:] # shots at ring2
+            x = self._read_ring(inter_pairs[:,0], q_ind1) # shots at ring1
+            y = self._read_ring(inter_pairs[:,1], q_ind2) # shots at ring2
             corr = self._correlate_rows(x, y, mask1, mask2)
 
         return corr
-        
-        
+
+
+    def correlate_all(self, num_shots=0, inter=False):
+        """
+        Compute the mean intRA-shot correlation between every pair of rings at
+        once. Each ring of each shot is Fourier transformed only once, and the
+        cross-spectra of all (q1, q2) pairs are formed in a single batched
+        product -- much faster than calling `correlate_intra` for every pair.
+
+        Optional Parameters
+        -------------------
+        num_shots : int
+            The number of shots to average over (default: all).
+
+        inter : bool
+            If True, compute the mean intER-shot correlation over all pairs of
+            (different) shots instead, as `correlate_inter` does. This also
+            takes a single pass over the shots.
+
+        Returns
+        -------
+        corr : ndarray, float
+            A (num_q, num_q, num_phi) array, where corr[i,j] is the average
+            correlation between the rings at q_values[i] and q_values[j], i.e.
+            `correlate_intra(q_values[i], q_values[j], mean_only=True)`.
+        """
+
+        if num_shots == 0: # then do correlation for all shots
+            num_shots = self.num_shots
+
+        acc = self._accumulate(num_shots=num_shots, inter=inter)
+
+        return acc.correlation(inter=inter)
+
+
+    def _accumulate(self, num_shots=0, q_inds=None, inter=False):
+        """
+        Stream the first `num_shots` shots (default: all) of the rings
+        `q_inds` (default: all) through a CorrelationAccumulator.
+        """
+
+        if num_shots == 0:
+            num_shots = self.num_shots
+        if q_inds == None:
+            q_inds = range(self.num_q)
+
+        if self.polar_mask != None:
+            mask = self.polar_mask[q_inds]
+        else:
+            mask = None
+
+        acc = CorrelationAccumulator(self.q_values[q_inds], self.num_phi, self.k,
+                                     polar_mask=mask, inter=inter)
+        for slc, chunk in self._iter_chunks(num_shots=num_shots, q_inds=q_inds):
+            acc.add(chunk)
+
+        return acc
+
+
+    @staticmethod
+    def _normalized_spectra(x, mask=None):
+        """
+        Compute the normalized spectrum of each ring, fft(x - <x>) / <x>, from
+        which correlation functions are formed. Single precision data are
+        transformed in single precision.
+
+        Parameters
+        ----------
+        x : ndarray, float
+            An (..., num_phi) array of rings.
+
+        Optional Parameters
+        -------------------
+        mask : ndarray, bool
+            An array broadcastable to `x`, True for points to keep. Masked
+            points are excluded from the mean, and set to zero (after the mean
+            is subtracted) before transforming.
+
+        Returns
+        -------
+        X : ndarray, complex
+            The (..., num_phi/2 + 1) real-input FFT of each ring.
+        """
+        x = x.astype(_compute_dtype(x.dtype))
+        if mask == None:
+            x_bar = x.mean(axis=-1)[...,None]
+            X = np.fft.rfft(x - x_bar, axis=-1) / x_bar
+        else:
+            m = np.broadcast_to(np.asarray(mask).astype(x.dtype), x.shape)
+            x_bar = (x * m).sum(axis=-1)[...,None] / m.sum(axis=-1)[...,None]
+            X = np.fft.rfft((x - x_bar) * m, axis=-1) / x_bar
+        if x.dtype == np.float32:
+            X = X.astype(np.complex64)
+        return X
+
+
+    @staticmethod
+    def _mask_overlap(x_mask, y_mask):
+        """
+        The number of unmasked pairs at each lag of a circular correlation of
+        rings masked by `x_mask` and `y_mask` (both (..., num_phi) arrays),
+        computed by FFT. Lags with no unmasked pairs are returned as inf, so
+        that dividing by the overlap zeros them.
+        """
+        n = np.asarray(x_mask).shape[-1]
+        fx = np.fft.rfft(np.asarray(x_mask).astype(np.float64), axis=-1)
+        fy = np.fft.rfft(np.asarray(y_mask).astype(np.float64), axis=-1)
+        counts = np.round(np.fft.irfft(fx * np.conjugate(fy), n=n, axis=-1))
+        counts[counts <= 0.0] = np.inf
+        return counts
+
+
     @staticmethod
     def _correlate_rows(x, y, x_mask=None, y_mask=None, mean_only=False):
         """
@@ -2240,6 +5128,8 @@ class Rings(object):
         that *all* ODIN correlation functions are defined as:
         
                     C(x,y) = < (x - <x>) (y - <y>) > / <x><y>
+
+        where, at lag k, x[phi] is paired with y[phi - k].
         
         Parameters
         ----------
@@ -2282,6 +5172,11 @@ class Rings(object):
         n_row = x.shape[0]
         n_col = x.shape[1]
 
+        # single precision data are correlated in single precision
+        dtype = _compute_dtype(np.result_type(x.dtype, y.dtype))
+        x = x.astype(dtype)
+        y = y.astype(dtype)
+
         if x_mask != None: 
             assert len(x_mask) == n_col
             x_mask = x_mask.astype(np.bool)
@@ -2307,11 +5202,18 @@ class Rings(object):
             # normalize
             corr = corr / ( float(n_col) * x_bar * y_bar )
                     
-        # if using mask
+        # if using mask -- correlate the masked data, and normalize each lag
+        # by the number of unmasked pairs (the correlation of the masks)
         else:
-            corr = np.zeros((n_row, n_col))
-            for i in range(n_row):
-                corr[i,:] = gap_correlate(x[i,:] * x_mask[:], y[i,:] * y_mask[:])
+            if x_mask == None:
+                x_mask = np.ones(n_col, dtype=np.bool)
+            if y_mask == None:
+                y_mask = np.ones(n_col, dtype=np.bool)
+
+            ffx = Rings._normalized_spectra(x, x_mask)
+            ffy = Rings._normalized_spectra(y, y_mask)
+            corr = np.fft.irfft(ffx * np.conjugate(ffy), n=n_col, axis=1)
+            corr = (corr / Rings._mask_overlap(x_mask, y_mask)).astype(dtype)
 
         if mean_only:
             corr = corr.mean(axis=0) # average all shots
@@ -2341,17 +5243,11 @@ class Rings(object):
         if not len(corr.shape) == 1:
             raise ValueError('`corr` must be a one-dimensional array')
         
-        cosPsi  = self._cospsi(q1,q2)           # azimuathal to cos(psi)
-        cosPsi  = np.append( cosPsi, -cosPsi )  # Adding the Friedel pairs...
-        newCor  = np.append( corr, corr )       # C [cos(psi) ] = C [cos(-psi)]
-        
-        kam_corr = np.vstack((cosPsi, newCor)).T
-        kam_corr = kam_corr[ np.argsort(kam_corr[:,0]) ] # sort ascending angle
-        
-        return kam_corr
+        return _kam_correlation(q1, q2, self.k, corr)
 
 
-    def legendre(self, q1, q2, order, use_inter_statistics=False):
+    def legendre(self, q1, q2, order, use_inter_statistics=False,
+                 even_only=False):
         """
         Project the correlation functions onto a set of legendre polynomials,
         and return the coefficients of that projection.
@@ -2369,6 +5265,10 @@ class Rings(object):
             correlation function before projecting it. This can help remove
             detector artifacts at the cost of a small computational overhead.
 
+        even_only : bool
+            Fit only the even Legendre polynomials. The odd coefficients,
+            which vanish for the Friedel-symmetrized data, are returned as 0.
+
         Returns
         -------
         c: np.ndarray, float
@@ -2385,14 +5285,14 @@ class Rings(object):
         else:
             corr = self.correlate_intra(q1, q2, mean_only=True)
         
-        corr = self._convert_to_kam( q1, q2, corr )
+        # a cached least-squares projection, equivalent to legfit on the
+        # output of self._convert_to_kam
+        P = _legendre_projector(q1, q2, self.k, self.num_phi, order, even_only)
+        return P.dot(corr)
 
-        # tests indicate this is a good numerical projection
-        c = np.polynomial.legendre.legfit(corr[:,0], corr[:,1], order-1)
-        return c
 
-
-    def legendre_matrix(self, order, use_inter_statistics=False):
+    def legendre_matrix(self, order, use_inter_statistics=False,
+                        even_only=False):
         """
         Project the correlation functions onto a set of legendre polynomials,
         and return the coefficients of that projection.
@@ -2410,6 +5310,10 @@ class Rings(object):
             correlation function before projecting it. This can help remove
             detector artifacts at the cost of a small computational overhead.
 
+        even_only : bool
+            Fit only the even Legendre polynomials. The odd coefficients,
+            which vanish for the Friedel-symmetrized data, are returned as 0.
+
         Returns
         -------
         Cl: np.ndarray, float
@@ -2422,22 +5326,10 @@ class Rings(object):
             where the q_ind values are the indices that map onto self.q_values.
         """
 
-        # initialize space for coefficients
-        Cl = np.zeros( (order, self.num_q, self.num_q) )
-
-        # iterate over each pair of rings in the collection and project the
-        # correlation between those two rings into the Legendre basis
-
-        for i in range(self.num_q):
-            q1 = self.q_values[i]
-            for j in range(i,self.num_q):
-                q2 = self.q_values[j]
-                c  = self.legendre(q1, q2, order=order, 
-                                   use_inter_statistics=use_inter_statistics)
-                Cl[:,i,j] = c
-                Cl[:,j,i] = c  # copy it to the lower triangle too
+        acc = self._accumulate(inter=use_inter_statistics)
 
-        return Cl
+        return acc.legendre_matrix(order, use_inter_statistics=use_inter_statistics,
+                                   even_only=even_only)
 
 
     @classmethod
@@ -2527,31 +5419,67 @@ class Rings(object):
         return cls(q_values, polar_intensities, k, polar_mask=None)
 
 
-    def save(self, filename):
+    def save(self, filename, complib='blosc', complevel=5):
         """
         Saves the Rings object to disk.
 
+        The polar intensities are stored as a single (num_shots, num_q,
+        num_phi) array, chunked by blocks of shots and by ring, so that a
+        ring can be read back without reading the others (see Rings.load).
+
         Parameters
         ----------
         filename : str
             The name of the file to write to disk. Must end in '.ring' -- if you
             don't put this, it will be automatically added.
+
+        Optional Parameters
+        -------------------
+        complib : str
+            The compression library to use, one of 'zlib', 'lzo', 'bzip2' or
+            'blosc'.
+
+        complevel : int
+            The compression level, 0-9. Zero disables compression.
         """
 
         if not filename.endswith('.ring'):
             filename += '.ring'
 
+        for b in _disk_blocks(self._polar_intensities):
+            if os.path.abspath(filename) == os.path.abspath(b.filename):
+                raise IOError('Cannot overwrite the file backing an on-disk '
+                              'Rings: %s' % filename)
+
         # if self.polar_mask == None, then save a single 0
         if self.polar_mask == None:
             pm = np.array([0])
         else:
             pm = self.polar_mask
 
-        io.saveh( filename,
-                  q_values = self._q_values,
-                  polar_intensities = self.polar_intensities,
-                  k = np.array([self.k]),
-                  polar_mask = pm )
+        dtype = np.dtype(self._polar_intensities.dtype)
+
+        h5 = tables.openFile(filename, mode='w')
+
+        try:
+            h5.createArray('/', 'q_values', np.array(self._q_values))
+            h5.createArray('/', 'k', np.array([self.k]))
+            h5.createArray('/', 'polar_mask', pm)
+
+            filters = tables.Filters(complib=complib, complevel=complevel,
+                                     shuffle=True)
+            rows = _chunk_rows(self.num_phi, dtype.itemsize)
+            ds = h5.createEArray('/', 'polar_intensities',
+                                 tables.Atom.from_dtype(dtype),
+                                 shape=(0, self.num_q, self.num_phi),
+                                 filters=filters,
+                                 chunkshape=(rows, 1, self.num_phi),
+                                 expectedrows=self.num_shots)
+            for slc, chunk in self._iter_chunks():
+                ds.append(chunk)
+
+        finally:
+            h5.close()
 
         logger.info('Wrote %s to disk.' % filename)
 
@@ -2559,7 +5487,7 @@ class Rings(object):
     
 
     @classmethod
-    def load(cls, filename):
+    def load(cls, filename, in_memory=True, memory_budget=None):
         """
         Load a Rings object from disk.
 
@@ -2567,26 +5495,149 @@ class Rings(object):
         ----------
         filename : str
             The name of the file to write to disk. Must end in '.ring'.
+
+        Optional Parameters
+        -------------------
+        in_memory : bool
+            If False, leave the polar intensities on disk, and read them as
+            they are needed -- e.g. correlating two rings reads only those two
+            rings. On-disk Rings are read-only.
+
+        memory_budget : int
+            The number of bytes of polar intensities to hold in memory at once
+            when streaming over shots. Defaults to MEMORY_BUDGET.
         """
 
-        if filename.endswith('.ring'):
-            hdf = io.loadh(filename)
-        else:
+        if not filename.endswith('.ring'):
             raise ValueError('Must load a rings file (.ring)')
 
+        # a file of links to other rings files (see Rings.save_virtual)
+        sources = _read_sources(filename)
+        if sources != None:
+            return cls.load_many(sources, in_memory=in_memory,
+                                 memory_budget=memory_budget)
+
+        h5 = tables.openFile(filename, mode='r')
+        try:
+            q_values = h5.root.q_values.read()
+            k        = float(h5.root.k.read()[0])
+            pm       = h5.root.polar_mask.read()
+            if in_memory:
+                pi = h5.root.polar_intensities.read()
+        finally:
+            h5.close()
+
+        if not in_memory:
+            pi = DiskArray(filename, '/polar_intensities')
+
         # deal with our codified polar mask
-        if np.all(hdf['polar_mask'] == np.array([0])):
+        if np.all(pm == np.array([0])):
             pm = None
-        else:
-            pm = hdf['polar_mask']
 
-        rings_obj = cls(hdf['q_values'], hdf['polar_intensities'],
-                        float(hdf['k'][0]), polar_mask=pm)
-        hdf.close()
+        rings_obj = cls(q_values, pi, k, polar_mask=pm,
+                        memory_budget=memory_budget)
 
         return rings_obj
         
         
+    @classmethod
+    def load_many(cls, filenames, in_memory=False, memory_budget=None):
+        """
+        Present many rings files -- e.g. all the runs of an experiment -- as a
+        single Rings object, with the shots of each file in turn, without
+        copying them into one array. The q_values, wavenumber and number of
+        points in phi of each file are checked once, here. The polar masks
+        are combined: a point masked in any file is masked.
+
+        Parameters
+        ----------
+        filenames : list of str
+            The rings files (.ring) to concatenate.
+
+        Optional Parameters
+        -------------------
+        in_memory : bool
+            If False (default), the polar intensities are left on disk, and
+            each read is dispatched to the file(s) holding the shots asked for.
+            If True, every file is read into memory.
+
+        memory_budget : int
+            The number of bytes of polar intensities to hold in memory at once
+            when streaming over shots. Defaults to MEMORY_BUDGET.
+
+        Returns
+        -------
+        rings : odin.xray.Rings
+            The concatenated rings.
+        """
+
+        if len(filenames) == 0:
+            raise ValueError('No files to load')
+
+        parts = [ cls.load(fn, in_memory=in_memory, memory_budget=memory_budget)
+                  for fn in filenames ]
+        first = parts[0]
+
+        polar_mask = first.polar_mask
+        for fn, r in zip(filenames[1:], parts[1:]):
+            if not (r.num_q == first.num_q and
+                    np.allclose(r.q_values, first.q_values)):
+                raise ValueError('%s has different q_values than %s'
+                                 % (fn, filenames[0]))
+            if not r.k == first.k:
+                raise ValueError('%s has a different wavenumber (k) than %s'
+                                 % (fn, filenames[0]))
+            if not r.num_phi == first.num_phi:
+                raise ValueError('%s has a different num_phi than %s'
+                                 % (fn, filenames[0]))
+            if r.polar_mask != None:
+                if polar_mask == None:
+                    polar_mask = r.polar_mask
+                elif not np.all(r.polar_mask == polar_mask):
+                    logger.warning('Polar mask of %s differs, combining masks' % fn)
+                    polar_mask = polar_mask & r.polar_mask
+
+        pi = ArrayBlocks([ r._polar_intensities for r in parts ])
+
+        return cls(first.q_values, pi, first.k, polar_mask=polar_mask,
+                   memory_budget=memory_budget)
+
+
+    def save_virtual(self, filename):
+        """
+        Write a small rings file that links to the files holding these
+        (on-disk) rings, rather than copying their data. Loading it with
+        Rings.load gives back the concatenated rings.
+
+        The links are HDF5 external links to each file's polar intensities,
+        so other HDF5 tools can follow them too. (pytables, which ODIN uses,
+        cannot write HDF5 virtual datasets.)
+
+        Parameters
+        ----------
+        filename : str
+            The name of the file to write to disk. Must end in '.ring' -- if you
+            don't put this, it will be automatically added.
+        """
+
+        if not filename.endswith('.ring'):
+            filename += '.ring'
+
+        # if self.polar_mask == None, then save a single 0
+        if self.polar_mask == None:
+            pm = np.array([0])
+        else:
+            pm = self.polar_mask
+
+        _write_sources(filename, self._polar_intensities,
+                       q_values=np.array(self._q_values),
+                       k=np.array([self.k]), polar_mask=pm)
+
+        logger.info('Wrote %s to disk.' % filename)
+
+        return
+
+
     def append(self, other_rings):
         """
         Combine a two rings objects. We keep the mask from the current Rings.
@@ -2606,8 +5657,21 @@ class Rings(object):
         if not other_rings.k == self.k:
             raise ValueError('Two rings must have exactly the same wavenumber (k)')
             
-        combined_pi = np.vstack( (self.polar_intensities, other_rings.polar_intensities) )
-        self.polar_intensities = combined_pi
+        # store the shots as a list of blocks, so that appending is cheap --
+        # in-memory shots are copied, on-disk shots stay on disk
+        if not isinstance(self._polar_intensities, ArrayBlocks):
+            self._polar_intensities = ArrayBlocks([self._polar_intensities])
+
+        other = other_rings._polar_intensities
+        if isinstance(other, ArrayBlocks):
+            blocks = other._blocks
+        else:
+            blocks = [other]
+        for b in blocks:
+            if isinstance(b, DiskArray):
+                self._polar_intensities.append(b)
+            else:
+                self._polar_intensities.append(np.array(b))
 
         # TJL changed call signature to be like List.append()
         #combined = Rings(self.q_values, combined_pi, self.k, polar_mask=self.polar_mask)
@@ -2638,6 +5702,7 @@ class Rings(object):
         
         copy: bool
             Whether or not to modify current ring or produce a new copied version.
+            Rings stored on disk can only be smoothed into a copy.
 
         Returns
         -------
@@ -2664,6 +5729,7 @@ class Rings(object):
         
         if copy == False:
 
+            self._check_writable('smooth')
             rp = self.polar_intensities 
             n_shot = rp.shape[0]
 
@@ -2714,6 +5780,387 @@ def _q_grid_as_xyz(q_values, num_phi, k):
     return qxyz
 
 
+def _cospsi(q1, q2, k, num_phi):
+    """
+    The cosine of the angle psi between two scattering vectors of magnitude
+    `q1` and `q2`, separated by each of `num_phi` equally spaced azimuthal
+    angles, at wavenumber `k`.
+    """
+
+    phi_values = np.arange(0, 2.0*np.pi, 2.0*np.pi/float(num_phi))
+
+    t1     = np.pi/2. + np.arcsin( q1 / (2.*k) ) # theta 1 in spherical coor
+    t2     = np.pi/2. + np.arcsin( q2 / (2.*k) ) # theta 2 in spherical coor
+    cospsi = np.cos(t1)*np.cos(t2) + np.sin(t1)*np.sin(t2) *\
+             np.cos( phi_values )
+
+    return cospsi
+
+
+def _kam_correlation(q1, q2, k, corr):
+    """
+    Convert the 1-D azimuthal correlation `corr` between rings `q1` and `q2`
+    into a (2*num_phi, 2) array of (cos(psi), correlation), sorted by
+    cos(psi). See Rings._convert_to_kam.
+    """
+
+    cosPsi  = _cospsi(q1, q2, k, len(corr)) # azimuathal to cos(psi)
+    cosPsi  = np.append( cosPsi, -cosPsi )  # Adding the Friedel pairs...
+    newCor  = np.append( corr, corr )       # C [cos(psi) ] = C [cos(-psi)]
+
+    kam_corr = np.vstack((cosPsi, newCor)).T
+    kam_corr = kam_corr[ np.argsort(kam_corr[:,0]) ] # sort ascending angle
+
+    return kam_corr
+
+
+_legendre_projector_cache = {}
+
+def _legendre_projector(q1, q2, k, num_phi, order, even_only=False):
+    """
+    The least-squares projector taking the azimuthal correlation between
+    rings `q1` and `q2` onto the first `order` Legendre polynomials in
+    cos(psi), i.e. an (order, num_phi) matrix P such that P.dot(corr) equals
+    legfit on the output of _kam_correlation. If `even_only`, fit only the
+    even polynomials (the odd rows of P are zero).
+
+    The cos(psi) sample points depend only on (q1, q2, k, num_phi), so the
+    projectors are cached, up to MEMORY_BUDGET bytes of them.
+    """
+
+    key = (float(q1), float(q2), float(k), int(num_phi), int(order),
+           bool(even_only))
+    if key in _legendre_projector_cache:
+        return _legendre_projector_cache[key]
+
+    cospsi = _cospsi(q1, q2, k, num_phi)
+    x = np.append( cospsi, -cospsi ) # with the Friedel pairs
+
+    V = np.polynomial.legendre.legvander(x, order-1)
+    if even_only:
+        V = V[:,::2]
+
+    # solve as legfit does: scale the columns, cut small singular values
+    scl = np.sqrt(np.square(V).sum(axis=0))
+    scl[scl == 0] = 1.0
+    pinv = np.linalg.pinv(V / scl, rcond=len(x)*np.finfo(x.dtype).eps)
+    pinv /= scl[:,None]
+
+    # the fit data are (corr, corr), so fold the Friedel half back over
+    P = np.zeros((order, num_phi))
+    if even_only:
+        P[::2] = pinv[:,:num_phi] + pinv[:,num_phi:]
+    else:
+        P[:] = pinv[:,:num_phi] + pinv[:,num_phi:]
+
+    if len(_legendre_projector_cache) * P.nbytes > MEMORY_BUDGET:
+        _legendre_projector_cache.clear()
+    _legendre_projector_cache[key] = P
+
+    return P
+
+
+def _legendre_matrix(corr, q_values, k, order, even_only=False):
+    """
+    Project a (num_q, num_q, num_phi) tensor of correlation functions onto the
+    first `order` Legendre polynomials, returning an (order, num_q, num_q)
+    array of coefficients. See Rings.legendre_matrix.
+    """
+
+    num_q   = len(q_values)
+    num_phi = corr.shape[-1]
+
+    # initialize space for coefficients
+    Cl = np.zeros( (order, num_q, num_q) )
+
+    # project the correlation between each pair of rings into the Legendre
+    # basis, as a batched matrix product over blocks of pairs (i <= j)
+    pairs = np.array([ (i,j) for i in range(num_q) for j in range(i,num_q) ])
+    block = max(1, MEMORY_BUDGET // (order * num_phi * 8))
+
+    for start in range(0, len(pairs), block):
+        i, j = pairs[start:start+block].T
+        P = np.array([ _legendre_projector(q_values[a], q_values[b], k,
+                                           num_phi, order, even_only)
+                       for a, b in zip(i, j) ])
+        c = np.einsum('pln,pn->lp', P, corr[i,j])
+        Cl[:,i,j] = c
+        Cl[:,j,i] = c  # copy it to the lower triangle too
+
+    return Cl
+
+
+def _polygon_area(x, y):
+    """
+    The areas of the polygons with vertices (x[i], y[i]), each an (n, k)
+    array with the vertices in order around the polygon.
+    """
+    return 0.5 * np.abs(np.sum(x * np.roll(y, -1, axis=1) -
+                               np.roll(x, -1, axis=1) * y, axis=1))
+
+
+def _clipped_area(x, y, x_lo, x_hi, y_lo, y_hi):
+    """
+    The areas of the intersections of the convex polygons with vertices
+    (x[i], y[i]) -- (n, k) arrays, vertices in order -- with the rectangles
+    [x_lo, x_hi) x [y_lo, y_hi), by Sutherland-Hodgman clipping.
+    """
+
+    # a convex quadrilateral clipped by four edges has at most 8 vertices --
+    # unused slots repeat the first vertex, which adds no area
+    width = 8
+    n = x.shape[0]
+    pad = width - x.shape[1]
+    x = np.hstack([x, np.repeat(x[:,:1], pad, axis=1)])
+    y = np.hstack([y, np.repeat(y[:,:1], pad, axis=1)])
+    rows = np.arange(n)[:,None]
+
+    for v, sign, bound in [(0, 1.0, x_lo), (0, -1.0, x_hi),
+                           (1, 1.0, y_lo), (1, -1.0, y_hi)]:
+
+        d = sign * ((x, y)[v] - bound[:,None]) # >= 0 inside
+        xp, yp, dp = [ np.roll(a, 1, axis=1) for a in (x, y, d) ]
+        inside, prev_inside = (d >= 0.0), (dp >= 0.0)
+
+        # each edge (prev -> this) emits its crossing point, then this vertex
+        crossing = (inside != prev_inside)
+        t = np.where(crossing, dp / np.where(crossing, dp - d, 1.0), 0.0)
+        X = np.dstack([xp + t * (x - xp), x]).reshape(n, 2 * width)
+        Y = np.dstack([yp + t * (y - yp), y]).reshape(n, 2 * width)
+        valid = np.dstack([crossing, inside]).reshape(n, 2 * width)
+
+        # move the emitted points to the front, in order, and pad
+        order = np.argsort(~valid, axis=1, kind='mergesort')[:,:width]
+        x, y = X[rows, order], Y[rows, order]
+        unused = (np.arange(width)[None,:] >= valid.sum(1)[:,None])
+        x = np.where(unused, x[:,:1], x)
+        y = np.where(unused, y[:,:1], y)
+
+    return _polygon_area(x, y)
+
+
+def _compute_dtype(dtype):
+    """
+    The floating point type to compute in, for data stored as `dtype`: single
+    precision data stay in single precision, everything else (integer counts,
+    doubles) is computed in double precision.
+    """
+    if np.dtype(dtype) == np.float32:
+        return np.float32
+    return np.float64
+
+
+def _dense(x):
+    """
+    Return `x` as a dense array, converting it if it is a sparse matrix.
+    """
+    if sparse.issparse(x):
+        return x.toarray()
+    return np.asarray(x)
+
+
+def _apply_correction(x, factor, dark=None):
+    """
+    Apply the per-pixel correction (x - dark) * factor to a block of shots,
+    in place where `x` is a floating point array, in a single pass over the
+    data. Sparse (CSR) blocks are scaled by touching only the stored values.
+    Returns the corrected block.
+    """
+
+    if sparse.issparse(x):
+        if dark != None:
+            raise ValueError('Cannot dark-subtract sparse intensities')
+        if not np.issubdtype(x.dtype, np.floating):
+            x = x.astype(_compute_dtype(x.dtype))
+        x.data *= factor[x.indices].astype(x.dtype)
+        return x
+
+    if not np.issubdtype(x.dtype, np.floating):
+        x = x.astype(_compute_dtype(x.dtype))
+    factor = factor.astype(x.dtype)
+
+    # one row at a time, so each row is read from memory only once
+    for row in x.reshape(-1, x.shape[-1]):
+        if dark != None:
+            np.subtract(row, dark, out=row)
+        np.multiply(row, factor, out=row)
+
+    return x
+
+
+def _chunk_rows(row_length, itemsize, target_bytes=2**20):
+    """
+    The number of rows of an on-disk array to store per HDF5 chunk, such that
+    each chunk is about `target_bytes` (1 MB) -- but always at least one row.
+    """
+    return max(1, int(target_bytes) // (int(row_length) * int(itemsize)))
+
+
+def _read_rows(node, rows, index=()):
+    """
+    Read the rows `rows` (in that order, repeats allowed) from the array
+    `node`, which can be any object supporting slicing along its first axis,
+    e.g. a pytables array. Contiguous runs are read as single slices, so
+    that only the requested data are read. If passed, `index` selects within
+    each row, e.g. (q_ind, slice(None)) reads a single ring of polar data.
+    """
+
+    rows = np.array(rows, dtype=np.int).flatten()
+    if np.any(rows < 0):
+        rows = rows % node.shape[0]
+
+    index = (slice(None),) + tuple(index)
+    row_shape = np.empty((0,) + tuple(node.shape[1:]))[index].shape[1:]
+
+    unique = np.unique(rows)
+    out = np.zeros((len(unique),) + row_shape,
+                   dtype=node.atom.dtype if hasattr(node, 'atom') else node.dtype)
+
+    # break the sorted rows into runs of consecutive indices
+    breaks = np.where(np.diff(unique) != 1)[0] + 1
+    starts = np.concatenate([[0], breaks])
+    stops  = np.concatenate([breaks, [len(unique)]])
+    for a, b in zip(starts, stops):
+        out[a:b] = node[(slice(unique[a], unique[b-1]+1),) + index[1:]]
+
+    return out[np.searchsorted(unique, rows)]
+
+
+def _disk_blocks(x):
+    """
+    The DiskArrays backing the array `x` -- `x` itself, or the on-disk blocks
+    of an ArrayBlocks. Empty if `x` is held in memory.
+    """
+    if isinstance(x, ArrayBlocks):
+        return [ b for b in x._blocks if isinstance(b, DiskArray) ]
+    elif isinstance(x, DiskArray):
+        return [x]
+    else:
+        return []
+
+
+def _same_detector(d1, d2):
+    """
+    Whether the detectors `d1` and `d2` have the same geometry -- e.g. the
+    detectors read from different files of the same experiment. Implicit
+    detectors are compared by their basis grids, and explicit pixels are
+    compared a block at a time, so the full geometry is never built.
+    """
+
+    if d1 is d2:
+        return True
+
+    if not ((d1.xyz_type == d2.xyz_type) and (d1.num_pixels == d2.num_pixels)
+            and np.allclose(d1.k, d2.k)
+            and np.allclose(d1.beam_vector, d2.beam_vector)):
+        return False
+
+    if d1.xyz_type == 'implicit':
+        g1, g2 = d1._basis_grid, d2._basis_grid
+        if not g1.num_grids == g2.num_grids:
+            return False
+        for i in range(g1.num_grids):
+            if not (np.allclose(g1._ps[i], g2._ps[i]) and
+                    np.allclose(g1._ss[i], g2._ss[i]) and
+                    np.allclose(g1._fs[i], g2._fs[i]) and
+                    tuple(g1._shapes[i]) == tuple(g2._shapes[i])):
+                return False
+
+    else:
+        n = _chunk_rows(3, 8)
+        for start in range(0, d1.num_pixels, n):
+            if not np.allclose(np.asarray(d1._pixels[start:start+n]),
+                               np.asarray(d2._pixels[start:start+n])):
+                return False
+
+    return True
+
+
+def _write_sources(filename, x, **arrays):
+    """
+    Write the HDF5 file `filename`, holding `arrays` (name -> ndarray) and a
+    group /sources of external links, in order, to the on-disk blocks of
+    `x`. The links are stored relative to `filename`, so the files can be
+    moved together.
+    """
+
+    if isinstance(x, ArrayBlocks):
+        blocks = x._blocks
+    else:
+        blocks = [x]
+    if not all([ isinstance(b, DiskArray) for b in blocks ]):
+        raise ValueError('Can only link to data stored on disk -- save the '
+                         'data first, or load it with in_memory=False')
+
+    filename = os.path.abspath(filename)
+    for b in blocks:
+        if os.path.abspath(b.filename) == filename:
+            raise IOError('Cannot overwrite a linked file: %s' % filename)
+
+    h5 = tables.openFile(filename, mode='w')
+    try:
+        for name, a in arrays.items():
+            h5.createArray('/', name, a)
+        g = h5.createGroup('/', 'sources')
+        for i, b in enumerate(blocks):
+            target = os.path.relpath(os.path.abspath(b.filename),
+                                     os.path.dirname(filename))
+            h5.createExternalLink(g, 'source%06d' % i,
+                                  '%s:%s' % (target, b.where))
+    finally:
+        h5.close()
+
+    return
+
+
+def _read_sources(filename):
+    """
+    The files linked to by a file written with `_write_sources`, in order,
+    or None if `filename` holds its own data.
+    """
+
+    h5 = tables.openFile(filename, mode='r')
+    try:
+        if not '/sources' in h5:
+            return None
+        links = sorted(h5.root.sources._v_children.items())
+        targets = [ l.target.rsplit(':', 1)[0] for name, l in links ]
+    finally:
+        h5.close()
+
+    base = os.path.dirname(os.path.abspath(filename))
+    return [ os.path.join(base, t) for t in targets ]
+
+
+def upgrade_file(filename):
+    """
+    Convert a file written by an older version of ODIN, which stores its
+    detector as a pickled object, to the structured HDF5 detector layout.
+    Works on detector (.dtc) and shotset (.shot) files. The conversion is
+    done in place; files already in the new layout are left untouched.
+
+    Parameters
+    ----------
+    filename : str
+        The path to the file to convert.
+    """
+
+    h5 = tables.openFile(filename, mode='r')
+    try:
+        node = h5.getNode('/detector')
+        if isinstance(node, tables.Group):
+            logger.info('%s is already in the current format' % filename)
+            return
+        d = Detector._from_serial(node.read())
+    finally:
+        h5.close()
+
+    d._to_hdf(filename) # replaces the pickled detector
+    logger.info('Converted %s to the current detector format.' % filename)
+
+    return
+
+
 def load(filename):
     """
     Load a file from disk, into a format corresponding to an object in 
@@ -79,7 +79,9 @@ def simulate(n_molecules, np.ndarray qxyz, np.ndarray rxyz, np.ndarray atomic_nu
     rfloats : ndarray, float
         An `n_molecules` x 3 array of random floats uniform on [0,1]. If passed,
         these are used to randomly rotate the molecules. If not, new rands
-        are generated. This is for debugging only.
+        are generated. Passing the same `rfloats` to several calls reproduces
+        the same molecular orientations, e.g. when simulating a detector one
+        panel at a time.
 
     Returns
     -------
@@ -107,7 +109,6 @@ def simulate(n_molecules, np.ndarray qxyz, np.ndarray rxyz, np.ndarray atomic_nu
         c_rfloats = np.ascontiguousarray( np.random.rand(3, n_molecules), dtype=np.float32)
     else:
         c_rfloats = np.ascontiguousarray(rfloats.T, dtype=np.float32)
-        print "WARNING: employing fed random numbers -- this should be a test"
     
 
     # get the Cromer-Mann parameters
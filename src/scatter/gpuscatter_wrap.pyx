@@ -92,7 +92,9 @@ def simulate(n_molecules, qxyz, rxyz, atomic_numbers, poisson_parameter=0.0,
     rfloats : ndarray, float
         An `n_molecules` x 3 array of random floats uniform on [0,1]. If passed,
         these are used to randomly rotate the molecules. If not, new rands
-        are generated. This is for debugging only.
+        are generated. Passing the same `rfloats` to several calls reproduces
+        the same molecular orientations, e.g. when simulating a detector one
+        panel at a time.
 
     Returns
     -------
@@ -127,7 +129,6 @@ def simulate(n_molecules, qxyz, rxyz, atomic_numbers, poisson_parameter=0.0,
         c_rfloats = np.ascontiguousarray( np.random.rand(3, n_molecules), dtype=np.float32)
     else:
         c_rfloats = np.ascontiguousarray(rfloats.T, dtype=np.float32)
-        print "WARNING: employing fed random numbers -- this should be a test"
     
 
     # get the Cromer-Mann parameters
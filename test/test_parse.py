@@ -52,6 +52,24 @@ class TestCBF(object):
         s = self.cbf.as_shotset()
         assert isinstance(s, xray.Shotset)
         
+    def test_files_to_shotset_screen(self):
+        fn = ref_file('test_cbf.cbf')
+        ss = parse.CBF.files_to_shotset([fn, fn], screen={'min_intensity' : 0.0})
+        assert ss.num_shots == 2
+        try:
+            parse.CBF.files_to_shotset([fn, fn], screen={'min_hit_score' : 1.1})
+        except ValueError:
+            pass
+        else:
+            raise Exception('should have failed : no shots pass screening')
+        try:
+            parse.CBF.files_to_shotset([fn, fn],
+                                       screen={'max_profile_deviation' : 5.0})
+        except ValueError:
+            pass
+        else:
+            raise Exception('should have failed : cut compares shots')
+        
         
 class TestCXI(object):
     def setup(self):
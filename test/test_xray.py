@@ -7,7 +7,9 @@ import os, sys
 import warnings
 from nose import SkipTest
 
-from odin import xray, utils, parse, structure, math2, utils, _cpuscatter
+from odin import xray, utils, parse, structure, math2, utils, _cpuscatter, scatter
+from odin.corr import correlate as gap_correlate
+from odin.corr import photon_pairs
 from odin.testing import skip, ref_file, expected_failure, brute_force_masked_correlation
 from odin.refdata import cromer_mann_params
 from mdtraj import trajectory, io
@@ -19,6 +21,7 @@ except ImportError as e:
     GPU = False
 
 import numpy as np
+from scipy import sparse
 from numpy.testing import (assert_almost_equal, assert_array_almost_equal,
                            assert_allclose, assert_array_equal)
 
@@ -82,6 +85,12 @@ class TestBasisGrid(object):
         ref[:,2] = 1.0
         assert_array_almost_equal(self.bg.to_explicit(), ref)
 
+    def test_iter_explicit(self):
+        bg = xray.BasisGrid(self.grid_list * 2)
+        xyz = np.concatenate([ g for g in bg.iter_explicit() ])
+        assert_array_almost_equal(xyz, bg.to_explicit())
+        assert bg.grid_slices == [slice(0, 100), slice(100, 200)]
+
     def test_grid_as_explicit(self):
         ref = np.zeros((10,10,3))
         mg = np.mgrid[0:9:10j,0:18:10j]
@@ -221,6 +230,16 @@ class TestDetector(object):
         assert_array_almost_equal(intersect_ref, intersect)
         assert_array_almost_equal(pix_ref, pix)
 
+    def test_iter_panels(self):
+        d = xray.Detector.load(ref_file('lcls_test.dtc'))
+        assert d.num_panels == len(d.panel_slices)
+        for space in ['real', 'polar', 'reciprocal', 'recpolar']:
+            ref = getattr(d, space)
+            x = np.zeros_like(ref)
+            for slc, block in zip(d.panel_slices, getattr(d, 'iter_' + space)()):
+                x[slc] = block
+            assert_array_almost_equal(x, ref, err_msg=space)
+
     def test_serialization(self):
         s = self.d._to_serial()
         d2 = xray.Detector._from_serial(s)
@@ -232,6 +251,66 @@ class TestDetector(object):
         d = xray.Detector.load('r.dtc')
         if os.path.exists('r.dtc'): os.system('rm r.dtc')
         assert_array_almost_equal(d.xyz, self.d.xyz)
+        assert d.xyz_type == 'implicit'
+        assert_almost_equal(d.k, self.d.k)
+        assert_almost_equal(d.beam.energy, self.energy)
+        assert_array_almost_equal(d.beam_vector, self.d.beam_vector)
+
+    def test_io_explicit(self):
+        if os.path.exists('r.dtc'): os.remove('r.dtc')
+        self.d.implicit_to_explicit()
+        self.d.save('r.dtc')
+        d = xray.Detector.load('r.dtc')
+        assert d.xyz_type == 'explicit'
+        assert d.num_pixels == self.d.num_pixels
+        assert_array_almost_equal(d.recpolar, self.d.recpolar)
+
+        # saving back over the file the pixels are read from
+        xray.Detector.load('r.dtc').save('r.dtc')
+        assert_array_almost_equal(xray.Detector.load('r.dtc').xyz, self.d.xyz)
+        if os.path.exists('r.dtc'): os.remove('r.dtc')
+
+        if os.path.exists('r.shot'): os.remove('r.shot')
+        i = np.random.rand(2, self.d.num_pixels)
+        xray.Shotset(i, self.d).save('r.shot')
+        xray.Shotset.load('r.shot').save('r.shot')
+        s = xray.Shotset.load('r.shot')
+        assert_array_almost_equal(s.detector.xyz, self.d.xyz)
+        assert_array_equal(s.intensities, i)
+        if os.path.exists('r.shot'): os.remove('r.shot')
+
+    def test_upgrade_legacy(self):
+        legacy = xray.Detector.load(ref_file('lcls_test.dtc'))
+        if os.path.exists('r.dtc'): os.remove('r.dtc')
+        os.system('cp %s r.dtc' % ref_file('lcls_test.dtc'))
+        xray.upgrade_file('r.dtc')
+        d = xray.Detector.load('r.dtc')
+        if os.path.exists('r.dtc'): os.remove('r.dtc')
+        assert d.xyz_type == legacy.xyz_type
+        assert_array_almost_equal(d.xyz, legacy.xyz)
+        assert_almost_equal(d.k, legacy.k)
+
+    def test_solid_angle(self):
+        # the total solid angle of a square, centered on the beam
+        a = self.lim + self.spacing / 2.0
+        ref = 4.0 * np.arcsin( a**2 / (a**2 + self.l**2) )
+        assert_allclose(self.d.solid_angle.sum(), ref, rtol=1e-4)
+
+    def test_correction_map(self):
+        rp = self.d.recpolar
+        sin2 = np.sin(2.0 * np.arcsin(rp[:,0] / (2.0 * self.d.k)))**2
+        ref = 0.9 * (1.0 - sin2 * np.cos(rp[:,2])**2) + \
+              0.1 * (1.0 - sin2 * np.sin(rp[:,2])**2)
+        assert_allclose(self.d.polarization_factor(0.9), ref)
+
+        gain = np.random.rand(self.d.num_pixels) + 0.5
+        gain[0] = 0.0
+        omega = self.d.solid_angle / self.d.solid_angle.max()
+        f = self.d.correction_map(polarization=0.9, solid_angle=True, gain=gain)
+        assert f[0] == 0.0
+        assert_allclose(f[1:], 1.0 / (ref * omega * gain)[1:])
+        assert self.d.correction_map(polarization=0.9, solid_angle=True,
+                                     gain=gain) is f # cached
 
     def test_q_max(self):
         ref_q_max = np.max(self.d.recpolar[:,0])
@@ -257,7 +336,23 @@ class TestShotset(object):
         s = xray.Shotset(self.i, self.d, mask=mask)
         s.interpolate_to_polar()
 
-    # missing test: test_assemble (ok for now)
+    def test_assemble_image(self):
+        # generic detector is a regular grid -- one pixel per image cell
+        img = self.shot.assemble_image()
+        n = int(np.sqrt(self.d.num_pixels))
+        assert img.shape == (n, n)
+        assert_array_almost_equal(np.sort(img.flatten()), np.sort(self.i))
+
+        # the pixel at (x,y) lands at img[y,x]
+        xyz = self.d.xyz
+        assert_almost_equal(img[0,0], self.i[np.lexsort((xyz[:,0], xyz[:,1]))[0]])
+
+        # multi-shot + binned preview
+        s = xray.Shotset(np.vstack([self.i, 2.0 * self.i]), self.d)
+        imgs = s.assemble_image(shot_index=[0,1], binning=2)
+        assert imgs.shape == (2, (n+1)/2, (n+1)/2)
+        assert_array_almost_equal(imgs[1], 2.0 * imgs[0])
+        assert_almost_equal(imgs[0].mean(), self.i.mean(), decimal=1)
 
     def test_polar_grid(self):
         pg = self.shot.polar_grid([1.0], 360)
@@ -319,6 +414,38 @@ class TestShotset(object):
         m = s.intensity_maxima()
         assert np.any(np.abs(p[m,0] - 2.67) < 1e-1) # |q| = 2.67 is in {maxima}
 
+    def test_i_profile_per_shot(self):
+        i = np.abs( np.random.randn(3, self.d.num_pixels) )
+        mask = np.random.binomial(1, 0.9, size=self.d.num_pixels).astype(np.bool)
+        s = xray.Shotset(i, self.d, mask=mask)
+        q_values, profiles = s.intensity_profile(q_spacing=0.1, per_shot=True)
+        assert profiles.shape == (3, len(q_values))
+
+        # brute force reference
+        q = self.d.recpolar[:,0]
+        ind = np.digitize(q, q_values)
+        ref = np.zeros((3, len(q_values)))
+        for b in range(len(q_values)):
+            px = (ind == b) * mask
+            if np.sum(px) > 0:
+                ref[:,b] = i[:,px].mean(1)
+        assert_array_almost_equal(profiles, ref)
+
+        p = s.intensity_profile(q_spacing=0.1)
+        assert_array_almost_equal(p[:,0], q_values)
+        assert_array_almost_equal(p[:,1], profiles.mean(0))
+
+    def test_azimuthal_integrator_phi(self):
+        q_values, A = self.d.azimuthal_integrator(q_spacing=0.1, num_phi=36)
+        assert A.shape == (len(q_values) * 36, self.d.num_pixels)
+        
+        # a uniform image integrates to one in every populated bin
+        x = A.dot(np.ones(self.d.num_pixels))
+        assert_array_almost_equal(x[x > 0], 1.0)
+        
+        # operators are cached
+        assert self.d.azimuthal_integrator(q_spacing=0.1, num_phi=36)[1] is A
+
     def test_rotated_beam(self):
         # shift a detector up (in x) a bit and test to make sure there's no diff
         t = structure.load_coor(ref_file('gold1k.coor'))
@@ -384,6 +511,50 @@ class TestShotset(object):
         assert x < 0.2 # intensity mismatch
         assert_allclose(rings_ip[:,0], shot_ip[:,0], err_msg='test impl error')
 
+    def test_to_rings_rebin(self):
+        q_values = np.arange(0.5, 2.5, 0.1)
+        q = self.d.recpolar[:,0]
+
+        # a uniform image rebins to ones, and every pixel is split exactly
+        rebinner, coverage = self.d.polar_rebinner(q_values, 360)
+        x = rebinner.dot(np.ones(self.d.num_pixels))
+        assert_array_almost_equal(x[x > 0], 1.0)
+        n_px = np.sum((q >= 0.45) * (q < 2.45))
+        assert np.abs(coverage.sum() - n_px) < 0.01 * n_px
+
+        # a smooth image, I = |q|^2, is recovered on each ring
+        s = xray.Shotset(np.vstack([q**2, 2.0 * q**2]), self.d)
+        rings = s.to_rings(q_values, method='rebin')
+        assert rings.polar_intensities.shape == (2, len(q_values), 360)
+        assert np.all(rings.polar_mask)
+        assert_allclose(rings.polar_intensities[0].mean(1), q_values**2, atol=0.01)
+        assert_allclose(rings.polar_intensities[1], 2.0 * rings.polar_intensities[0])
+
+    def test_pixel_overlaps(self):
+        # the split of each pixel matches a fine sub-pixel sampling of it,
+        # including the pixels around the beam center
+        q_values = np.arange(0.0, 1.0, 0.1)
+        lo, hi, num_phi = q_values - 0.05, q_values + 0.05, 36
+        q = self.d.recpolar[:,0]
+        pixels = np.concatenate([ np.argsort(q)[:4],
+                                  np.where(q < 0.9)[0][::97] ])
+        pixels = np.sort(pixels)
+        ix, ring, phi_bin, frac = self.d._pixel_overlaps(pixels, lo, hi, num_phi)
+        split = np.zeros((len(pixels), len(q_values) * num_phi))
+        np.add.at(split, (ix, ring * num_phi + phi_bin), frac)
+
+        n = 64
+        u = (np.arange(n) + 0.5) / n - 0.5
+        s, f = self.d._basis_grid._ss[0], self.d._basis_grid._fs[0]
+        offsets = (u[:,None,None] * s + u[None,:,None] * f).reshape(-1, 3)
+        for j, p in enumerate(pixels):
+            rp = self.d._real_to_recpolar_pixels(self.d.xyz[p] + offsets)
+            qb = np.floor((rp[:,0] - lo[0]) / 0.1).astype(np.int)
+            pb = np.floor(rp[:,2] / (2.0 * np.pi / num_phi)).astype(np.int)
+            ref = np.bincount(qb * num_phi + pb % num_phi,
+                              minlength=split.shape[1]) / float(n**2)
+            assert_allclose(split[j], ref, atol=0.01)
+
     def test_multi_panel_interp(self):
         # regression test ensuring detectors w/multiple basisgrid panels
         # are handled correctly
@@ -433,6 +604,318 @@ class TestShotset(object):
         assert_array_almost_equal(s.intensity_profile(),
                                   self.shot.intensity_profile() )
 
+    def test_io_partial(self):
+        i = np.random.randn(10, self.d.num_pixels)
+        mask = np.random.binomial(1, 0.9, size=self.d.num_pixels)
+        ss = xray.Shotset(i, self.d, mask=mask)
+        if os.path.exists('test.shot'): os.remove('test.shot')
+        ss.save('test.shot', complevel=1)
+        s = xray.Shotset.load('test.shot', to_load=[7, 2, 3, 4, 2])
+        s_all = xray.Shotset.load('test.shot')
+        if os.path.exists('test.shot'): os.remove('test.shot')
+        assert_array_equal(s.intensities, i[[7, 2, 3, 4, 2]])
+        assert_array_equal(s_all.intensities, i)
+        assert_array_equal(s.mask, mask.astype(np.bool))
+
+    def test_out_of_core(self):
+        i = np.random.rand(10, self.d.num_pixels)
+        ss = xray.Shotset(i, self.d)
+        if os.path.exists('test.shot'): os.remove('test.shot')
+        ss.save('test.shot')
+        
+        # budget of 3 shots per chunk
+        s = xray.Shotset.load('test.shot', in_memory=False,
+                              memory_budget=3 * i[0].nbytes)
+        assert s.on_disk
+        assert s.num_shots == 10
+        assert_array_almost_equal(s.average_intensity, ss.average_intensity)
+        assert_array_almost_equal(s.intensity_profile(per_shot=True)[1],
+                                  ss.intensity_profile(per_shot=True)[1])
+        assert_array_equal(s[4].intensities, ss[4].intensities)
+        
+        q_values = np.array([1.0, 2.0])
+        r1 = s.to_rings(q_values, num_phi=90, method='rebin')
+        r2 = ss.to_rings(q_values, num_phi=90, method='rebin')
+        assert_array_almost_equal(r1.polar_intensities, r2.polar_intensities)
+        
+        if os.path.exists('test.shot'): os.remove('test.shot')
+
+    def test_virtual(self):
+        i = np.random.rand(7, self.d.num_pixels)
+        xray.Shotset(i[:4], self.d).save('test1.shot')
+        xray.Shotset(i[4:], self.d).save('test2.shot')
+        try:
+            s = xray.Shotset.load_many(['test1.shot', 'test2.shot'])
+            assert s.on_disk
+            assert s.num_shots == 7
+            assert_array_equal(s.intensities, i)
+
+            s.save_virtual('test.shot')
+            v = xray.Shotset.load('test.shot', in_memory=False)
+            assert v.on_disk
+            assert_array_equal(v[5].intensities, i[[5]])
+            assert_array_almost_equal(v.average_intensity, i.mean(0))
+            v = xray.Shotset.load('test.shot', to_load=[6, 1])
+            assert_array_equal(v.intensities, i[[6,1]])
+
+            xray.Shotset(i[:2], self.d, mask=(i[0] > 0.5)).save('test3.shot')
+            try:
+                xray.Shotset.load_many(['test1.shot', 'test3.shot'])
+            except RuntimeError:
+                pass
+            else:
+                raise AssertionError('concatenated shotsets with different masks')
+
+            # a mix of sparse and dense (on-disk) files
+            x = np.random.poisson(0.05, size=(3, self.d.num_pixels)).astype(np.float64)
+            xray.Shotset(sparse.csr_matrix(x), self.d).save('test3.shot')
+            s = xray.Shotset.load_many(['test1.shot', 'test3.shot'],
+                                       memory_budget=i[0].nbytes)
+            assert s.is_sparse
+            assert_array_equal(s.intensities, np.vstack([i[:4], x]))
+
+            # explicit detectors are compared without reading all the pixels
+            d = xray.Detector(self.d.xyz, self.d.k)
+            xray.Shotset(i[:4], d).save('test1.shot')
+            xray.Shotset(i[4:], d).save('test2.shot')
+            s = xray.Shotset.load_many(['test1.shot', 'test2.shot'])
+            assert isinstance(s.detector._pixels, xray.DiskArray)
+            assert_array_equal(s.intensities, i)
+        finally:
+            for fn in ['test.shot', 'test1.shot', 'test2.shot', 'test3.shot']:
+                if os.path.exists(fn): os.remove(fn)
+
+    def test_iter_chunks(self):
+        i = np.random.rand(5, self.d.num_pixels)
+        ss = xray.Shotset(i, self.d, memory_budget=2 * i[0].nbytes)
+        blocks = list(ss.iter_chunks())
+        assert [ b.num_shots for b in blocks ] == [2, 2, 1]
+        assert_array_equal(np.vstack([ b.intensities for b in blocks ]), i)
+        assert [ b.num_shots for b in ss.iter_chunks(4) ] == [4, 1]
+        assert_array_almost_equal(ss.average_intensity, i.mean(0))
+        assert ss[np.array([0, 2, 4])].memory_budget == ss.memory_budget
+        assert ss[1].memory_budget == ss.memory_budget
+
+    def test_statistics(self):
+        i = np.random.randn(9, self.d.num_pixels)
+        mask = np.random.binomial(1, 0.9, size=self.d.num_pixels).astype(np.bool)
+        ss = xray.Shotset(i, self.d, mask=mask, memory_budget=2 * i[0].nbytes)
+        stats = ss.statistics()
+        assert_array_almost_equal(stats.mean[mask], i.mean(0)[mask])
+        assert_array_almost_equal(stats.variance[mask], i.var(0)[mask])
+        assert_array_almost_equal(stats.min[mask], i.min(0)[mask])
+        assert_array_almost_equal(stats.max[mask], i.max(0)[mask])
+        assert np.all(stats.count[mask] == 9)
+        assert np.all(np.isnan(stats.mean[~mask]))
+
+        # merging accumulators of separate streams
+        a = xray.PixelStatistics(self.d.num_pixels)
+        b = xray.PixelStatistics(self.d.num_pixels)
+        a.add(i[:4])
+        for x in i[4:]:
+            b.add(x)
+        c = a + b
+        assert_array_almost_equal(c.mean, i.mean(0))
+        assert_array_almost_equal(c.variance, i.var(0))
+
+        if os.path.exists('test.stat'): os.remove('test.stat')
+        c.save('test.stat')
+        c2 = xray.PixelStatistics.load('test.stat')
+        if os.path.exists('test.stat'): os.remove('test.stat')
+        assert_array_almost_equal(c2.variance, c.variance)
+        assert_array_equal(c2.count, c.count)
+
+    def test_native_dtype(self):
+        i = np.random.poisson(10, size=(3, self.d.num_pixels)).astype(np.int32)
+        s = xray.Shotset(i, self.d)
+        if os.path.exists('test.shot'): os.remove('test.shot')
+        s.save('test.shot')
+        s2 = xray.Shotset.load('test.shot')
+        if os.path.exists('test.shot'): os.remove('test.shot')
+        assert s2.dtype == np.int32
+        assert_array_equal(s2.intensities, i)
+
+        # single precision stays single precision, and matches double
+        q_values = np.array([1.0, 2.0])
+        f = xray.Shotset(i, self.d, dtype=np.float32)
+        r32 = f.to_rings(q_values, num_phi=90, method='rebin')
+        r64 = s.to_rings(q_values, num_phi=90, method='rebin')
+        assert r32.polar_intensities.dtype == np.float32
+        assert r64.polar_intensities.dtype == np.float64
+        assert_allclose(r32.polar_intensities, r64.polar_intensities, rtol=1e-5)
+        c32 = r32.correlate_intra(1.0, 2.0)
+        assert c32.dtype == np.float32
+        assert_allclose(c32, r64.correlate_intra(1.0, 2.0), rtol=1e-3, atol=1e-6)
+
+    def test_photon_correlation(self):
+        i = np.random.poisson(0.02, size=(6, self.d.num_pixels)).astype(np.float32)
+        s = xray.Shotset(sparse.csr_matrix(i), self.d)
+        q_values = np.array([1.0, 1.5, 2.0])
+        corr = s.photon_correlation(q_values, num_phi=36, self_pairs=True)
+
+        # reference: correlate the photon counts binned on the polar grid,
+        # normalized by the pixel pairs at each lag
+        q_bin, phi_bin, coverage = self.d.photon_binner(q_values, 36)
+        inside = (q_bin >= 0)
+        x = np.array([ np.bincount(q_bin[inside] * 36 + phi_bin[inside], weights=y[inside],
+                                   minlength=3*36).reshape(3, 36) for y in i ])
+        n = x.sum(2)
+        X, C = np.fft.rfft(x), np.fft.rfft(coverage)
+        h = np.fft.irfft(np.einsum('siw,sjw->sijw', X, np.conjugate(X)), n=36)
+        h = (h / (n[:,:,None] * n[:,None,:])[:,:,:,None]).mean(0)
+        pairs = np.fft.irfft(C[:,None,:] * np.conjugate(C[None,:,:]), n=36)
+        N = coverage.sum(1)
+        ref = h * (N[:,None] * N[None,:])[:,:,None] / pairs - 1.0
+        assert_allclose(corr, ref, rtol=1e-6, atol=1e-8)
+
+        cl = s.photon_legendre_matrix(q_values, 6, num_phi=36)
+        assert cl.shape == (6, 3, 3)
+
+    def test_photon_binner(self):
+        q_values = np.array([1.0, 1.5, 2.0])
+        mask = np.random.rand(self.d.num_pixels) > 0.1
+        q_bin, phi_bin, coverage = self.d.photon_binner(q_values, 36, mask=mask)
+
+        # reference: bin every pixel center at once
+        rp = self.d.recpolar
+        ref_q = np.floor((rp[:,0] - 0.75) / 0.5).astype(np.int)
+        inside = (rp[:,0] >= 0.75) * (rp[:,0] < 2.25) * mask
+        assert_array_equal(q_bin[inside], ref_q[inside])
+        assert np.all(q_bin[~inside] == -1)
+        ref_phi = np.floor(rp[:,2] / (2.0 * np.pi / 36)).astype(np.int) % 36
+        assert_array_equal(phi_bin, ref_phi)
+        assert coverage.sum() == inside.sum()
+        assert self.d.photon_binner(q_values, 36, mask=mask)[0] is q_bin
+
+        try:
+            self.d.photon_binner(q_values, 36, mask=mask[1:])
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('accepted a mask of the wrong length')
+
+    def test_sparse(self):
+        i = np.random.poisson(0.05, size=(6, self.d.num_pixels)).astype(np.float64)
+        d = xray.Shotset(i, self.d)
+        s = xray.Shotset(sparse.csr_matrix(i), self.d, memory_budget=100)
+        assert s.is_sparse
+        assert_array_almost_equal(s.average_intensity, d.average_intensity)
+        assert_array_almost_equal(s.intensity_profile(per_shot=True)[1],
+                                  d.intensity_profile(per_shot=True)[1])
+
+        q_values = np.array([1.0, 2.0])
+        for method in ['rebin', 'interpolate']:
+            rs = s.to_rings(q_values, num_phi=90, method=method)
+            rd = d.to_rings(q_values, num_phi=90, method=method)
+            assert_array_almost_equal(rs.polar_intensities, rd.polar_intensities)
+
+        if os.path.exists('test.shot'): os.remove('test.shot')
+        s.save('test.shot')
+        s2 = xray.Shotset.load('test.shot')
+        s3 = xray.Shotset.load('test.shot', to_load=[4, 1])
+        if os.path.exists('test.shot'): os.remove('test.shot')
+        assert s2.is_sparse
+        assert_array_equal(s2.intensities, i)
+        assert_array_equal(s3.intensities, i[[4, 1]])
+        assert_array_equal((s + d).intensities, np.vstack([i, i]))
+
+    def test_screen(self):
+        np.random.seed(0)
+        i = np.random.poisson(10, size=(8, self.d.num_pixels)).astype(np.int16)
+        i[2] = 0                                   # a miss
+        i[5,:self.d.num_pixels/2] = 32767          # a saturated frame
+        i[6] *= 1 + 2 * (self.d.recpolar[:,0] > 2.0) # a glitch: bright rings
+        ss = xray.Shotset(i, self.d)
+
+        quality = ss.shot_quality()
+        assert_allclose(quality['intensity'], i.sum(1, dtype=np.float64))
+        assert_allclose(quality['saturated_fraction'][5], 0.5, atol=0.01)
+        assert np.all(quality['profile_deviation'][[0, 1, 3, 4, 7]] < 2.0)
+        accepted = ss.screen(min_hit_score=0.5, max_saturated_fraction=0.01,
+                             max_profile_deviation=5.0)
+        assert_array_equal(accepted, [0, 1, 3, 4, 7])
+        assert 'profile_deviation' not in ss.shot_quality(profiles=False)
+
+        q_values = np.array([1.0, 2.0])
+        r = ss.to_rings(q_values, num_phi=90, method='rebin', shots=accepted)
+        ref = xray.Shotset(i[accepted], self.d).to_rings(q_values, num_phi=90,
+                                                         method='rebin')
+        assert r.num_shots == 5
+        assert_array_almost_equal(r.polar_intensities, ref.polar_intensities)
+        r = ss.to_rings(q_values, num_phi=90, shots=accepted)
+        ref = xray.Shotset(i[accepted], self.d).to_rings(q_values, num_phi=90)
+        assert_array_almost_equal(r.polar_intensities, ref.polar_intensities)
+
+    def test_correct(self):
+        i = np.random.poisson(10, size=(4, self.d.num_pixels)).astype(np.int32)
+        dark = np.random.rand(self.d.num_pixels)
+        gain = np.random.rand(self.d.num_pixels) + 0.5
+        f = self.d.correction_map(polarization=0.99, gain=gain)
+        ref = (i - dark) * f
+
+        s = xray.Shotset(i, self.d)
+        s.correct(dark=dark, gain=gain, polarization=0.99)
+        assert_allclose(s.intensities, ref)
+
+        # floating point data are corrected in place
+        x = i.astype(np.float32)
+        xray.Shotset(x, self.d).correct(dark=dark, gain=gain, polarization=0.99)
+        assert_allclose(x, ref, rtol=1e-5)
+
+        # on-disk data are corrected as they are read, leaving the file alone
+        if os.path.exists('test.shot'): os.remove('test.shot')
+        xray.Shotset(i, self.d).save('test.shot')
+        s = xray.Shotset.load('test.shot', in_memory=False,
+                              memory_budget=i[0].nbytes)
+        s.correct(dark=dark, gain=gain, polarization=0.99)
+        assert_allclose(s.average_intensity, ref.mean(0))
+        assert_allclose(s.intensities, ref)
+        assert_array_equal(xray.Shotset.load('test.shot').intensities, i)
+        if os.path.exists('test.shot'): os.remove('test.shot')
+
+        # memory-mapped data are treated like on-disk data
+        mm = np.memmap('test.mmap', dtype=np.float64, mode='w+', shape=i.shape)
+        mm[:] = i
+        s = xray.Shotset(mm, self.d, memory_budget=i[0].nbytes)
+        assert s.on_disk
+        s.correct(dark=dark, gain=gain, polarization=0.99)
+        assert_allclose(s.intensities, ref)
+        assert_array_equal(mm, i)
+        q_values = np.array([1.0, 2.0])
+        r = s.to_rings(q_values, num_phi=90)
+        r_ref = xray.Shotset(ref, self.d).to_rings(q_values, num_phi=90)
+        assert_allclose(r.polar_intensities, r_ref.polar_intensities)
+        del s, mm
+        os.remove('test.mmap')
+
+        # sparse data -- only the stored values are touched
+        s = xray.Shotset(sparse.csr_matrix(i), self.d)
+        s.correct(gain=gain, polarization=0.99)
+        assert s.is_sparse
+        assert_allclose(s.intensities, i * f)
+
+    def test_parallel_to_rings(self):
+        i = np.random.rand(7, self.d.num_pixels).astype(np.float32)
+        mask = np.random.binomial(1, 0.95, size=self.d.num_pixels).astype(np.bool)
+        ss = xray.Shotset(i, self.d, mask=mask, memory_budget=2 * i[0].nbytes)
+        q_values = np.array([1.0, 2.0])
+        for method in ['interpolate', 'rebin']:
+            serial = ss.to_rings(q_values, num_phi=90, method=method)
+            parallel = ss.to_rings(q_values, num_phi=90, method=method,
+                                   n_workers=3)
+            assert_array_equal(parallel.polar_intensities, serial.polar_intensities)
+            assert_array_equal(parallel.polar_mask, serial.polar_mask)
+        r = ss.to_rings(q_values, num_phi=90, method='rebin',
+                        shots=np.array([5, 1]), n_workers=2)
+        assert_array_equal(r.polar_intensities, serial.polar_intensities[[5,1]])
+
+    def test_load_legacy(self):
+        s = xray.Shotset.load(ref_file('reference_shot.shot'))
+        s2 = xray.Shotset.load(ref_file('reference_shot.shot'), to_load=[0])
+        assert s.num_shots >= 1
+        assert s.num_pixels == s.detector.num_pixels
+        assert_array_equal(s2.intensities[0], s.intensities[0])
+
     def test_iter_n_slice(self):
         s = self.shot[0]
         assert len(s) == 1
@@ -441,6 +924,54 @@ class TestShotset(object):
         ss = self.shot + self.shot
         assert len(ss) == 2 * len(self.shot)
 
+    def test_add_blocks(self):
+        i = np.random.rand(5, self.d.num_pixels)
+        ss = xray.Shotset(i[:2], self.d) + xray.Shotset(i[2:3], self.d)
+        ss = ss + xray.Shotset(i[3:], self.d)
+        assert ss._intensities.num_blocks == 3 # no copies made
+        assert_array_equal(ss[3].intensities, i[3:4])
+        assert_array_almost_equal(ss.average_intensity, i.mean(0))
+        assert_array_equal(ss.intensities, i)
+
+
+class TestArrayBlocks(object):
+
+    def test_slicing(self):
+        x = np.random.randn(10, 3)
+        a = xray.ArrayBlocks([x[:4], x[4:5], x[5:]])
+        assert a.shape == (10, 3)
+        assert_array_equal(np.array(a), x)
+        for key in [3, -1, (4, 2), slice(2, 7), (slice(3, 9), 1),
+                    slice(None), np.array([9, 0, 4])]:
+            assert_array_equal(a[key], x[key])
+
+    def test_fancy_indexing(self):
+        x = np.random.randn(10, 3)
+        a = xray.ArrayBlocks([x[:4], x[4:5], x[5:]])
+        for key in [-10, long(2), np.int32(7), slice(None, None, 3),
+                    slice(8, 1, -2), [-1, 0, 5, 5], np.array([[1, 2], [8, -3]]),
+                    x[:,0] > 0, (np.array([9, 0, 4]), 2),
+                    (np.array([1, 6]), np.array([0, 2])), []]:
+            assert_array_equal(a[key], x[key])
+        for key in [10, -11, [3, 10]]:
+            try:
+                a[key]
+            except IndexError:
+                pass
+            else:
+                raise AssertionError('no IndexError for %s' % str(key))
+
+    def test_empty(self):
+        a = xray.ArrayBlocks()
+        assert a.shape == (0,)
+        assert len(a) == 0
+        assert a.dtype == np.float64
+        assert np.array(a).shape == (0,)
+        a.append(np.zeros((0, 3)))
+        assert len(a) == 0
+        a.append(np.ones((2, 3)))
+        assert_array_equal(np.array(a), np.ones((2, 3)))
+
 
 class TestRings(object):
 
@@ -472,6 +1003,40 @@ class TestRings(object):
     def test_depolarize(self):
         pass # todo
 
+    def test_append(self):
+        r = xray.Rings(self.q_values, self.rings.polar_intensities, self.rings.k)
+        for i in range(3):
+            r.append(self.rings)
+        assert r.num_shots == 4 * self.rings.num_shots
+        assert_array_equal(r.polar_intensities[-2:], self.rings.polar_intensities)
+        ref = self.rings.polar_intensities.copy()
+        r.polar_intensities[-1] *= 2.0 # check appended data are not shared
+        assert_array_equal(self.rings.polar_intensities, ref)
+
+    def test_iter_chunks(self):
+        i = np.abs(np.random.randn(7, len(self.q_values), self.num_phi))
+        mask = np.random.binomial(1, 0.9, size=i.shape[1:]).astype(np.bool)
+        r = xray.Rings(self.q_values, i, self.rings.k, mask)
+
+        blocks = list(r.iter_chunks(3))
+        assert [ b.num_shots for b in blocks ] == [3, 3, 1]
+        assert_array_equal(np.concatenate([ b.polar_intensities for b in blocks ]), i)
+
+        # reductions streamed in small blocks match the in-memory result
+        ip = r.intensity_profile()
+        c = r.correlate_intra(1.0, 2.0, mean_only=True)
+        ref_c = r.correlate_intra(1.0, 2.0).mean(0)
+        small = xray.Rings(self.q_values, i, self.rings.k, mask,
+                           memory_budget=i[0].nbytes * 2)
+        assert_array_almost_equal(small.intensity_profile(), ip)
+        assert_array_almost_equal(small.correlate_intra(1.0, 2.0, mean_only=True), c)
+        assert_array_almost_equal(c, ref_c)
+
+        # blocks inherit the budget
+        blocks = list(small.iter_chunks())
+        assert [ b.num_shots for b in blocks ] == [2, 2, 2, 1]
+        assert all([ b.memory_budget == small.memory_budget for b in blocks ])
+
     def test_intensity_profile(self):
         q_values = [2.4, 2.67, 3.0] # should be a peak at |q|=2.67
         t = structure.load_coor(ref_file('gold1k.coor'))
@@ -538,6 +1103,59 @@ class TestRings(object):
         assert_allclose(true_corr, corr, atol=0.1)
         assert_allclose(ref_corr, corr, rtol=1e-03)
         
+    def test_corr_rows_w_mask_fft(self):
+        # compare to the direct-sum kernel, for many rows & a cross correlation
+        x = np.random.rand(4, 90) + 0.5
+        y = np.random.rand(4, 90) + 0.5
+        x_mask = np.random.binomial(1, 0.8, size=90).astype(np.bool)
+        y_mask = np.random.binomial(1, 0.8, size=90).astype(np.bool)
+        corr = self.rings._correlate_rows(x, y, x_mask, y_mask)
+        for i in range(4):
+            ref = gap_correlate(y[i] * y_mask, x[i] * x_mask) # note lag convention
+            assert_allclose(corr[i], ref, rtol=1e-3, atol=1e-6)
+
+        # masked rings through the all-pairs correlators
+        pi = np.random.rand(5, 2, 90) + 0.5
+        mask = np.vstack([x_mask, y_mask])
+        r = xray.Rings([1.0, 2.0], pi, self.rings.k, mask)
+        ref = r._correlate_rows(pi[:,0,:], pi[:,1,:], x_mask, y_mask, mean_only=True)
+        assert_allclose(r.correlate_all()[0,1], ref, rtol=1e-6, atol=1e-12)
+        pairs = np.array([ [i,j] for i in range(5) for j in range(i+1, 5) ])
+        ref = r._correlate_rows(pi[pairs[:,0],0,:], pi[pairs[:,1],1,:], x_mask,
+                                y_mask, mean_only=True)
+        assert_allclose(r.correlate_inter(1.0, 2.0, mean_only=True), ref,
+                        rtol=1e-6, atol=1e-12)
+
+    def test_photon_pairs(self):
+        counts = np.random.poisson(0.3, size=(4, 2, 12))
+        counts[:,:,0] += 2
+        photons = sparse.csr_matrix(counts.reshape(4, -1))
+        q_bin, phi_bin = photons.indices // 12, photons.indices % 12
+        hist, count = photon_pairs(photons.indptr, q_bin, phi_bin, photons.data,
+                                   2, 12)
+        assert np.all(count == 4)
+        assert_allclose(hist.sum(2), count) # each shot's pairs sum to one
+
+        # brute force: all pairs of distinct photons
+        ref = np.zeros((2, 2, 12))
+        for x in counts:
+            q, phi = np.where(x > 0)
+            q, phi = np.repeat(q, x[x > 0]), np.repeat(phi, x[x > 0])
+            n = x.sum(1).astype(np.float)
+            for a in range(len(q)):
+                for b in range(len(q)):
+                    if not a == b:
+                        norm = n[q[a]] * (n[q[b]] - (q[a] == q[b]))
+                        ref[q[a], q[b], (phi[a] - phi[b]) % 12] += 1.0 / norm
+        assert_allclose(hist, ref)
+
+        # with self pairs, the (unmasked) dense correlation of the counts
+        hist, count = photon_pairs(photons.indptr, q_bin, phi_bin, photons.data,
+                                   2, 12, self_pairs=True)
+        r = xray.Rings([1.0, 2.0], counts.astype(np.float), self.rings.k)
+        assert_allclose(hist / count[:,:,None] * 12 - 1.0, r.correlate_all(),
+                        atol=1e-12)
+
     def test_mask_nomask_consistency(self):
         
         q1 = 1.0 # chosen arb.
@@ -580,6 +1198,115 @@ class TestRings(object):
         rings2 = xray.Rings.simulate(self.traj, 1, self.q_values, self.num_phi, 3) # 1 molec, 3 shots
         inter = rings2.correlate_inter(q, q, mean_only=True, num_pairs=1)
         
+    def test_correlate_all(self):
+        pi = np.random.rand(5, 3, 36) + 1.0
+        r = xray.Rings([1.0, 2.0, 3.0], pi, self.rings.k)
+        corr = r.correlate_all()
+        assert corr.shape == (3, 3, 36)
+        for i, q1 in enumerate(r.q_values):
+            for j, q2 in enumerate(r.q_values):
+                assert_allclose(corr[i,j], r.correlate_intra(q1, q2, mean_only=True),
+                                rtol=1e-6, atol=1e-12)
+        assert_allclose(r.correlate_all(num_shots=2)[0,1],
+                        r.correlate_intra(1.0, 2.0, num_shots=2, mean_only=True))
+
+        cl = r.legendre_matrix(6)
+        assert_allclose(cl[:,0,2], r.legendre(1.0, 3.0, 6), rtol=1e-6, atol=1e-10)
+        cl = r.legendre_matrix(6, use_inter_statistics=True)
+        assert_allclose(cl[:,0,2], r.legendre(1.0, 3.0, 6, use_inter_statistics=True),
+                        rtol=1e-6, atol=1e-10)
+
+    def test_correlate_inter_all_pairs(self):
+        pi = np.random.rand(6, 3, 36) + 1.0
+        r = xray.Rings([1.0, 2.0, 3.0], pi, self.rings.k)
+        pairs = np.array([ [i,j] for i in range(6) for j in range(i+1, 6) ])
+        ref = r._correlate_rows(pi[pairs[:,0],0,:], pi[pairs[:,1],2,:],
+                                mean_only=True)
+
+        r.memory_budget = pi[0].nbytes * 4 # pairs span blocks
+        inter = r.correlate_inter(1.0, 3.0, mean_only=True)
+        inter_all = r.correlate_all(inter=True)
+        assert_allclose(inter, ref, rtol=1e-6, atol=1e-12)
+        assert_allclose(inter_all[0,2], ref, rtol=1e-6, atol=1e-12)
+
+    def test_correlation_accumulator(self):
+        pi = np.random.rand(7, 3, 36) + 1.0
+        mask = np.random.rand(3, 36) > 0.1
+        r = xray.Rings([1.0, 2.0, 3.0], pi, self.rings.k, polar_mask=mask)
+
+        # two workers, each streaming a block of shots, one shot at a time
+        a = xray.CorrelationAccumulator(r.q_values, r.num_phi, r.k, polar_mask=mask)
+        b = xray.CorrelationAccumulator(r.q_values, r.num_phi, r.k, polar_mask=mask)
+        for i in range(3):
+            a.add(pi[i])
+        b.add(xray.Rings(r.q_values, pi[3:], r.k))
+        acc = a + b
+        assert acc.num_shots == 7
+
+        assert_allclose(acc.correlation(), r.correlate_all(), rtol=1e-6, atol=1e-12)
+        assert_allclose(acc.correlation(inter=True), r.correlate_all(inter=True),
+                        rtol=1e-6, atol=1e-12)
+        assert_allclose(acc.legendre_matrix(6, use_inter_statistics=True),
+                        r.legendre_matrix(6, use_inter_statistics=True),
+                        rtol=1e-6, atol=1e-10)
+
+        acc.save('test.acc')
+        acc2 = xray.CorrelationAccumulator.load('test.acc')
+        os.remove('test.acc')
+        assert acc2.num_shots == 7
+        assert_allclose(acc2.correlation(inter=True), acc.correlation(inter=True))
+
+    def test_correlation_errors(self):
+        pi = np.random.rand(12, 3, 36) + 1.0
+        q_values = np.array([1.0, 2.0, 3.0])
+        acc = xray.CorrelationAccumulator(q_values, 36, self.rings.k, block_size=3)
+        acc.add(pi[:5])
+        acc.add(pi[5:])
+        assert acc.num_blocks == 4
+
+        # each jackknife replicate leaves out one block of shots
+        reps = acc.legendre_replicates(6, use_inter_statistics=True)
+        for b in range(4):
+            r = xray.Rings(q_values, np.delete(pi, range(3*b, 3*b+3), axis=0),
+                           self.rings.k)
+            assert_allclose(reps[b], r.legendre_matrix(6, use_inter_statistics=True),
+                            rtol=1e-6, atol=1e-12)
+
+        cl, err = acc.legendre_errors(6, method='bootstrap', num_samples=20, seed=0)
+        assert_allclose(cl, acc.legendre_matrix(6))
+        assert err.shape == cl.shape
+        assert np.all(err[::2] > 0.0)
+
+        data = scatter.CorrelationData.from_accumulator(acc, 6)
+        assert data.n_data == cl.size
+        assert_allclose(data.values, cl.flatten())
+        assert data.errors.shape == (cl.size,)
+
+        # without resampling, every coefficient -- even a zero -- has an error
+        c = cl.copy()
+        c[:,0,1] = c[:,1,0] = 0.0
+        data = scatter.CorrelationData(q_values, c, acc.k, acc.num_phi)
+        assert np.all(data.errors >= 0.01 * np.abs(c).max())
+        assert np.all(data.errors >= np.abs(c.flatten()))
+
+    def test_correlation_data_predict(self):
+        t = structure.load_coor(ref_file('gold1k.coor'))
+        q_values = np.array([2.0, 2.67])
+        acc = xray.CorrelationAccumulator(q_values, 36, self.rings.k)
+        acc.add(np.random.rand(4, 2, 36))
+        data = scatter.CorrelationData.from_accumulator(acc, 4)
+
+        np.random.seed(1)
+        prediction = data.predict(t, num_shots=3, force_no_gpu=True)
+        assert prediction.shape == (t.n_frames, data.n_data)
+
+        # the same as projecting simulated shots by hand
+        np.random.seed(1)
+        r = xray.Rings.simulate(t, 1, q_values, 36, 3, force_no_gpu=True,
+                                energy=xray.Beam(None, wavenumber=acc.k).energy)
+        assert_allclose(prediction[0], r.legendre_matrix(4).flatten(),
+                        rtol=1e-6)
+
     def test_convert_to_kam(self):
         intra = self.rings.correlate_intra(1.0, 1.0, mean_only=True)
         kam_corr = self.rings._convert_to_kam(1.0, 1.0, intra)
@@ -615,12 +1342,119 @@ class TestRings(object):
         pred = np.polynomial.legendre.legval(kam_ring[:,0], cl)
         assert_allclose(pred, kam_ring[:,1], rtol=0.1, atol=0.1)
 
+    def test_legendre_projector(self):
+        order = 10
+        corr = self.rings.correlate_all()
+        cl = self.rings.legendre_matrix(order)
+        for i in range(self.rings.num_q):
+            for j in range(self.rings.num_q):
+                q1, q2 = self.rings.q_values[i], self.rings.q_values[j]
+                kam = self.rings._convert_to_kam(q1, q2, corr[i,j])
+                ref = np.polynomial.legendre.legfit(kam[:,0], kam[:,1], order-1)
+                assert_allclose(cl[:,i,j], ref, rtol=1e-8, atol=1e-14)
+
+        even = self.rings.legendre_matrix(order, even_only=True)
+        assert np.all(even[1::2] == 0.0)
+        assert_allclose(even[::2], cl[::2], rtol=1e-8, atol=1e-14)
+
     def test_io(self):
         self.rings.save('test.ring')
         r = xray.Rings.load('test.ring')
         os.remove('test.ring')
         assert np.all( self.rings.polar_intensities == r.polar_intensities)
 
+    def test_lazy_io(self):
+        pi = np.random.rand(8, 3, 36) + 1.0
+        mask = np.random.rand(3, 36) > 0.1
+        r = xray.Rings([1.0, 2.0, 3.0], pi, self.rings.k, polar_mask=mask)
+        r.save('test.ring')
+        try:
+            l = xray.Rings.load('test.ring', in_memory=False,
+                                memory_budget=pi[0].nbytes)
+            assert l.on_disk
+            assert not r.on_disk
+            assert l.memory_budget == pi[0].nbytes
+            assert len(list(l.iter_chunks())) == 8
+            assert l.num_shots == 8
+            assert_array_equal(l.polar_intensities[:,1,:], pi[:,1,:])
+
+            assert_allclose(l.correlate_intra(1.0, 3.0), r.correlate_intra(1.0, 3.0))
+            assert_allclose(l.correlate_intra(1.0, 3.0, mean_only=True),
+                            r.correlate_intra(1.0, 3.0, mean_only=True))
+            assert_allclose(l.correlate_inter(1.0, 3.0, mean_only=True),
+                            r.correlate_inter(1.0, 3.0, mean_only=True))
+            assert_allclose(l.intensity_profile(), r.intensity_profile())
+            assert_allclose(l.correlate_all(inter=True), r.correlate_all(inter=True))
+
+            # appending leaves on-disk shots on disk
+            a = xray.Rings([1.0, 2.0, 3.0], pi[:2], self.rings.k, polar_mask=mask)
+            a.append(l)
+            assert a.on_disk
+            assert_array_equal(a.polar_intensities[:,2,:],
+                               np.concatenate([pi[:2], pi])[:,2,:])
+
+            try:
+                xray.Rings(l.q_values, l._polar_intensities, l.k, dtype=np.float32)
+            except TypeError:
+                pass
+            else:
+                raise AssertionError('changed the dtype of on-disk rings')
+
+            try:
+                l.save('test.ring')
+            except IOError:
+                pass
+            else:
+                raise AssertionError('overwrote the file backing an on-disk Rings')
+
+            # in-place operations cannot be applied to on-disk rings
+            for name, args in [('normalize', ()), ('dePolarize', ()),
+                               ('smooth_intensities', (2.0, 10.0, 11, False))]:
+                for lazy in [l, a]:
+                    try:
+                        getattr(lazy, name)(*args)
+                    except TypeError:
+                        pass
+                    else:
+                        raise AssertionError('%s modified on-disk rings' % name)
+            assert_array_equal(l.polar_intensities[:,1,:], pi[:,1,:])
+            s = l.smooth_intensities(2.0, copy=True)
+            assert not s.on_disk
+            assert_allclose(s.polar_intensities,
+                            r.smooth_intensities(2.0).polar_intensities)
+        finally:
+            os.remove('test.ring')
+
+
+    def test_virtual(self):
+        pi = np.random.rand(9, 3, 36) + 1.0
+        mask = np.random.rand(3, 36) > 0.1
+        q_values = [1.0, 2.0, 3.0]
+        xray.Rings(q_values, pi[:5], self.rings.k, polar_mask=mask).save('test1.ring')
+        xray.Rings(q_values, pi[5:], self.rings.k).save('test2.ring')
+        r = xray.Rings(q_values, pi, self.rings.k, polar_mask=mask)
+        try:
+            l = xray.Rings.load_many(['test1.ring', 'test2.ring'],
+                                     memory_budget=2 * pi[0].nbytes)
+            assert l.on_disk
+            assert l.memory_budget == 2 * pi[0].nbytes
+            assert l.num_shots == 9
+            assert_array_equal(l.polar_mask, mask)
+            assert_allclose(l.correlate_intra(1.0, 3.0, mean_only=True),
+                            r.correlate_intra(1.0, 3.0, mean_only=True))
+
+            l.save_virtual('test.ring')
+            v = xray.Rings.load('test.ring', in_memory=False)
+            assert v.on_disk
+            assert_array_equal(v.polar_intensities[3:7,1,:], pi[3:7,1,:])
+            assert_allclose(v.correlate_all(), r.correlate_all())
+            v = xray.Rings.load('test.ring')
+            assert not v.on_disk
+            assert_array_equal(v.polar_intensities, pi)
+        finally:
+            for fn in ['test.ring', 'test1.ring', 'test2.ring']:
+                if os.path.exists(fn): os.remove(fn)
+
 
 class TestMisc(object):
 